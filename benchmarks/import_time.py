@@ -0,0 +1,43 @@
+"""Measure how long it takes to import meme and its submodules.
+
+Each import statement is timed in a fresh interpreter, several times over,
+and the median wall-clock time is reported.  Run it with:
+
+    python -m benchmarks.import_time [--repeat N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+statements = [
+    "import meme",
+    "import meme; meme.__version__",
+    "import meme.names",
+    "import meme.archive",
+    "import meme.model",
+    "import meme.names, meme.archive, meme.model",
+]
+
+def time_import(statement, repeat):
+    # Time the interpreter with and without the import, so only the import itself is counted.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", "pass"])
+        baseline = time.perf_counter() - start
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", statement])
+        times.append(time.perf_counter() - start - baseline)
+    return statistics.median(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7, help="Number of runs per statement.")
+    args = parser.parse_args(argv)
+    for statement in statements:
+        print("{:>8.1f} ms  {}".format(1000.0 * time_import(statement, args.repeat), statement))
+
+if __name__ == "__main__":
+    main()
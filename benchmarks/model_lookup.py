@@ -0,0 +1,73 @@
+"""Time Model R-matrix lookups on a lattice-sized model, with no service behind it.
+
+Builds a synthetic model with as many elements as a full machine, then times
+get_rmat for many device pairs: serially, and in chunks on a thread pool.
+Name resolution is timed on its own, so the share of the work it takes shows up.
+
+    python -m benchmarks.model_lookup [--elements N] [--pairs N] [--workers N]
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from meme.model import Model
+
+def lattice_model(n):
+    """A Model holding `n` elements, with unique device names, and every tenth element split in two."""
+    rmat_data = np.zeros(n, dtype=[('element', 'U60'), ('device_name', 'U60'), ('z', 'float32'), ('s', 'float32'), ('r_mat', 'float32', (6, 6))])
+    # Elements 10k and 10k + 1 are the two halves of device DEV:10k.
+    device = [i - i % 10 if i % 10 < 2 else i for i in range(n)]
+    rmat_data['element'] = ["E{}#{}".format(d, i % 10 + 1) if i % 10 < 2 else "E{}".format(i) for i, d in enumerate(device)]
+    rmat_data['device_name'] = ["DEV:{}".format(d) for d in device]
+    rmat_data['s'] = np.arange(n) * 0.5
+    rmat_data['z'] = rmat_data['s']
+    rmat_data['r_mat'] = np.eye(6)
+    rmat_data['r_mat'][:, 0, 1] = rmat_data['s']
+    twiss_data = np.zeros(n, dtype=[('element', 'U60'), ('device_name', 'U60'), ('s', 'f8'), ('z', 'f8'), ('beta_x', 'f8')])
+    for name in ('element', 'device_name', 's', 'z'):
+        twiss_data[name] = rmat_data[name]
+    m = Model("BENCH", initialize=False)
+    m.rmat_data = rmat_data
+    m.twiss_data = twiss_data
+    return m
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--elements", type=int, default=50000, help="Number of elements in the model.")
+    parser.add_argument("--pairs", type=int, default=2000, help="Number of (from, to) device pairs.")
+    parser.add_argument("--workers", type=int, default=8, help="Threads for the parallel run.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per benchmark.")
+    args = parser.parse_args(argv)
+    m = lattice_model(args.elements)
+    rng = np.random.default_rng(0)
+    names = list(dict.fromkeys(m.twiss_data['device_name'].tolist()))
+    a = [names[i] for i in rng.integers(0, len(names), args.pairs)]
+    b = [names[i] for i in rng.integers(0, len(names), args.pairs)]
+
+    def build_index():
+        m.twiss_data = m.twiss_data
+        m._name_rows()
+
+    with ThreadPoolExecutor(args.workers) as executor:
+        benchmarks = [
+            ("name index build", build_index, 1),
+            ("name resolution", lambda: m._resolve_indices(a + b, '', False), args.repeat),
+            ("get_rmat (serial)", lambda: m.get_rmat(a, b), args.repeat),
+            ("get_rmat ({} threads)".format(args.workers),
+             lambda: m.get_rmat(a, b, executor=executor, chunk_size=max(1, args.pairs // args.workers)), args.repeat),
+        ]
+        print("{} elements, {} pairs".format(args.elements, args.pairs))
+        for name, fn, repeat in benchmarks:
+            print("{:<28} {:>10.2f} ms".format(name, 1000.0 * measure(fn, repeat)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Run the meme benchmark suite against local stand-in servers.
+
+Starts :mod:`benchmarks.servers` in a subprocess (on a private port, so
+nothing reaches the real services), times the main meme client operations,
+and writes the results to a JSON file.  If a baseline results file is given,
+each benchmark is compared to it and regressions are reported.
+
+    python -m benchmarks.run --size medium --output bench_results.json
+    python -m benchmarks.run --size medium --baseline bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sizes = {
+    "small": dict(elements=1000, samples=1000, pvs=10, names=10000, pairs=100),
+    "medium": dict(elements=10000, samples=100000, pvs=100, names=100000, pairs=1000),
+    "large": dict(elements=50000, samples=10000000, pvs=500, names=100000, pairs=10000),
+}
+
+def isolated_environment(port):
+    """EPICS settings that keep the clients and servers on this host, on their own port."""
+    env = dict(os.environ)
+    env.update({
+        "EPICS_PVA_ADDR_LIST": "127.0.0.1",
+        "EPICS_PVA_AUTO_ADDR_LIST": "NO",
+        "EPICS_PVA_SERVER_PORT": str(port),
+        "EPICS_PVA_BROADCAST_PORT": str(port + 1),
+        "EPICS_PVAS_SERVER_PORT": str(port),
+        "EPICS_PVAS_BROADCAST_PORT": str(port + 1),
+    })
+    return env
+
+def start_servers(settings, env):
+    args = [sys.executable, "-m", "benchmarks.servers"]
+    for key in ("elements", "samples", "pvs", "names"):
+        args += ["--" + key, str(settings[key])]
+    return subprocess.Popen(args, env=env)
+
+def wait_for_servers(timeout=60.0):
+    from meme.context import get_context
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            get_context().get("BMAD:SYS0:1:BENCH:LIVE:TWISS", timeout=1.0)
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "mean": statistics.mean(times), "repeat": repeat}
+
+def benchmarks(settings):
+    """Yield (name, function) pairs for every benchmark."""
+    import numpy as np
+    import meme.archive
+    import meme.names
+    from meme.model import Model
+
+    model = Model("BENCH")
+    rng = np.random.default_rng(0)
+    devices = model.twiss_data["device_name"]
+    a = list(rng.choice(devices, settings["pairs"]))
+    b = list(rng.choice(devices, settings["pairs"]))
+    pvs = ["BENCH:PV:{}".format(i) for i in range(settings["pvs"])]
+    archive_data = meme.archive.get(pvs)
+    name_pvs = meme.names.list_pvs("BPMS:BNCH:1%")[:100]
+    name_devices = [pv.rsplit(":", 1)[0] for pv in name_pvs]
+
+    yield "model.construct", lambda: Model("BENCH")
+    yield "model.get_rmat_from_list_to_list", lambda: model.get_rmat(a, b)
+    yield "model.get_rmat_from_start", lambda: model.get_rmat(b)
+    yield "model.get_twiss", lambda: model.get_twiss(b)
+    yield "archive.get", lambda: meme.archive.get(pvs)
+    yield "archive.convert_to_dataframe", lambda: meme.archive.convert_to_dataframe(archive_data)
+    yield "names.list_pvs", lambda: meme.names.list_pvs("BPMS:BNCH:%")
+    yield "names.device_to_element", lambda: meme.names.device_to_element(name_devices)
+    yield "names.load_name_table", lambda: meme.names.load_name_table(refresh=True)
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if not previous or "median" not in result or "median" not in previous:
+            continue
+        ratio = result["median"] / previous["median"]
+        flag = "  REGRESSION" if ratio > 1.0 + threshold else ""
+        print("{:<40} {:>8.2f}x{}".format(name, ratio, flag))
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=sorted(sizes), default="small", help="Preset data sizes.")
+    for key in ("elements", "samples", "pvs", "names", "pairs"):
+        parser.add_argument("--" + key, type=int, help="Override the preset {}.".format(key))
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per benchmark.")
+    parser.add_argument("--port", type=int, default=15075, help="PVA port for the stand-in servers.")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the results.")
+    parser.add_argument("--baseline", help="Results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown (as a fraction) reported as a regression.")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    settings = dict(sizes[args.size])
+    settings.update({key: getattr(args, key) for key in settings if getattr(args, key) is not None})
+    env = isolated_environment(args.port)
+    # The clients in this process have to use the same isolated settings as the servers.
+    os.environ.update(env)
+    server = start_servers(settings, env)
+    results = {"date": datetime.now().isoformat(), "python": platform.python_version(),
+               "settings": settings, "benchmarks": {}}
+    try:
+        wait_for_servers()
+        for name, fn in benchmarks(settings):
+            try:
+                results["benchmarks"][name] = measure(fn, args.repeat)
+                print("{:<40} {:>10.2f} ms".format(name, 1000.0 * results["benchmarks"][name]["median"]), flush=True)
+            except Exception as e:
+                results["benchmarks"][name] = {"error": repr(e)}
+                print("{:<40} failed: {!r}".format(name, e), flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if baseline is not None and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
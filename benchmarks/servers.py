@@ -0,0 +1,139 @@
+"""Local stand-in MEME services with synthetic, configurably-sized data.
+
+Serves a model (twiss and rmat tables), the 'hist' archive service, and the
+'ds' directory service from one process.  The model is served for the
+"BENCH" beam path, as "BMAD:SYS0:1:BENCH:LIVE:TWISS" and friends.  Run it with:
+
+    python -m benchmarks.servers --elements 10000 --samples 100000 --names 100000
+"""
+import argparse
+import re
+import numpy as np
+from p4p import Type, Value
+from p4p.nt import NTScalar, NTTable
+from p4p.server import Server, StaticProvider
+from p4p.server.thread import SharedPV
+
+model_name = "BENCH"
+twiss_columns = ["s", "z", "length", "p0c", "alpha_x", "beta_x", "eta_x", "etap_x", "psi_x",
+                 "alpha_y", "beta_y", "eta_y", "etap_y", "psi_y"]
+rmat_columns = ["r{}{}".format(i, j) for i in range(1, 7) for j in range(1, 7)]
+
+single_pv_table = NTTable([("secondsPastEpoch", "l"), ("values", "d"), ("nanoseconds", "i"), ("severity", "i"), ("status", "i")])
+multi_pv_struct = Type([
+    ("pvName", "s"),
+    ("value", ("S", "NTComplexTable", single_pv_table.type.items()))
+])
+multi_response_struct = Type([("value", "av")])
+
+def wrap_columns(table, columns):
+    """Pack a dict of column arrays into an NTTable Value (NTTable.wrap only takes rows)."""
+    return Value(table.type, {"labels": table.labels, "value": columns})
+
+def synthetic_lattice(n, seed=0):
+    """Make element names, device names, twiss parameters and R-matrices for `n` elements."""
+    rng = np.random.default_rng(seed)
+    elements = np.array(["E{:06d}".format(i) for i in range(n)])
+    devices = np.array(["BPMS:BNCH:{:d}".format(i) for i in range(n)])
+    s = np.cumsum(rng.uniform(0.1, 2.0, n))
+    twiss = {
+        "s": s, "z": s, "length": rng.uniform(0.0, 1.0, n), "p0c": np.linspace(6.0e6, 1.0e10, n),
+        "alpha_x": rng.normal(0, 1, n), "beta_x": rng.uniform(1, 50, n), "eta_x": rng.normal(0, 0.01, n),
+        "etap_x": rng.normal(0, 0.001, n), "psi_x": np.cumsum(rng.uniform(0, 0.5, n)),
+        "alpha_y": rng.normal(0, 1, n), "beta_y": rng.uniform(1, 50, n), "eta_y": rng.normal(0, 0.01, n),
+        "etap_y": rng.normal(0, 0.001, n), "psi_y": np.cumsum(rng.uniform(0, 0.5, n)),
+    }
+    # Well-conditioned, invertible matrices: identity plus a small perturbation.
+    rmats = np.eye(6) + rng.normal(0, 0.05, (n, 6, 6))
+    return elements, devices, twiss, rmats
+
+def model_tables(n):
+    elements, devices, twiss, rmats = synthetic_lattice(n)
+    twiss_table = NTTable([("element", "s"), ("device_name", "s")] + [(c, "d") for c in twiss_columns])
+    twiss_value = wrap_columns(twiss_table, {"element": elements, "device_name": devices, **twiss})
+    rmat_table = NTTable([("element", "s"), ("device_name", "s"), ("z", "d"), ("s", "d")] + [(c, "d") for c in rmat_columns])
+    rmat_cols = {c: rmats[:, i // 6, i % 6] for i, c in enumerate(rmat_columns)}
+    rmat_value = wrap_columns(rmat_table, {"element": elements, "device_name": devices, "z": twiss["z"], "s": twiss["s"], **rmat_cols})
+    return twiss_table, twiss_value, rmat_table, rmat_value
+
+def _rpc_pv():
+    # RPC-only PVs still need to be open to accept requests.
+    return SharedPV(nt=NTScalar("s"), initial="")
+
+def archive_pv(samples_per_pv):
+    rng = np.random.default_rng(1)
+    seconds = 1500000000 + np.arange(samples_per_pv, dtype=np.int64)
+    nanoseconds = rng.integers(0, 1000000000, samples_per_pv, dtype=np.int32)
+    zeros = np.zeros(samples_per_pv, dtype=np.int32)
+
+    def pv_value(name):
+        values = np.cumsum(rng.normal(0, 1, samples_per_pv))
+        return wrap_columns(single_pv_table, {"secondsPastEpoch": seconds, "values": values,
+                                              "nanoseconds": nanoseconds, "severity": zeros, "status": zeros})
+
+    pv = _rpc_pv()
+
+    @pv.rpc
+    def hist(pv, op):
+        pvs = op.value().query.todict().get("pv", "").split(",")
+        if len(pvs) == 1:
+            op.done(pv_value(pvs[0]))
+            return
+        items = [Value(multi_pv_struct, {"pvName": p, "value": pv_value(p)}) for p in pvs]
+        op.done(Value(multi_response_struct, {"value": items}))
+    return pv
+
+def names_pv(n):
+    pvs = np.array(["BPMS:BNCH:{:d}:X".format(i) for i in range(n)])
+    table = {
+        "pv": pvs,
+        "dname": np.array([p.rsplit(":", 1)[0] for p in pvs]),
+        "ename": np.array(["E{:06d}".format(i) for i in range(n)]),
+        "tag": np.array(["BNCH{}".format(i % 10) for i in range(n)]),
+        "etype": np.array(["INST"] * n),
+        "z": np.arange(n, dtype=float),
+    }
+    full_table = NTTable([("pv", "s"), ("dname", "s"), ("ename", "s"), ("tag", "s"), ("etype", "s"), ("z", "d")])
+    name_table = NTTable([("name", "s")])
+    pv = _rpc_pv()
+
+    @pv.rpc
+    def ds(pv, op):
+        query = op.value().query.todict()
+        show = query.get("show") or "pv"
+        if "," in show:
+            op.done(wrap_columns(full_table, table))
+            return
+        if "name" in query:
+            column, pattern = "pv" if show == "pv" else show, query["name"]
+        else:
+            column = "dname" if "dname" in query else "ename"
+            pattern = query[column]
+        regex = re.compile("".join(".*" if c == "%" else re.escape(c) for c in pattern) if "%" in pattern else pattern)
+        rows = np.array([bool(regex.fullmatch(v)) for v in table[column]], dtype=bool)
+        op.done(wrap_columns(name_table, {"name": table[show][rows]}))
+    return pv
+
+def make_providers(elements, samples, pvs, names):
+    twiss_table, twiss_value, rmat_table, rmat_value = model_tables(elements)
+    provider = StaticProvider("meme benchmark servers")
+    for model_type in ("LIVE", "DESIGN"):
+        prefix = "BMAD:SYS0:1:{}:{}".format(model_name, model_type)
+        provider.add(prefix + ":TWISS", SharedPV(nt=twiss_table, initial=twiss_value))
+        provider.add(prefix + ":RMAT", SharedPV(nt=rmat_table, initial=rmat_value))
+    provider.add("hist", archive_pv(max(samples // max(pvs, 1), 1)))
+    provider.add("ds", names_pv(names))
+    return [provider]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--elements", type=int, default=10000, help="Number of elements in the model.")
+    parser.add_argument("--samples", type=int, default=100000, help="Total archive samples per request.")
+    parser.add_argument("--pvs", type=int, default=100, help="Number of PVs the archive samples are spread across.")
+    parser.add_argument("--names", type=int, default=100000, help="Number of rows in the name table.")
+    args = parser.parse_args(argv)
+    print("Starting benchmark servers!", flush=True)
+    Server.forever(providers=make_providers(args.elements, args.samples, args.pvs, args.names))
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,22 @@
-# Patch p4p close with Python 2.7
-# For more details see: https://github.com/mdavidsaver/p4p/issues/55
-from p4p.client import thread
+# Submodules (and their heavy dependencies, like pandas and numpy) are only
+# imported the first time they are used, so `import meme` stays cheap for
+# scripts that only need one service.
+import importlib
 
-_p4p_thread_context_close = thread.Context.close
+_submodules = ("archive", "context", "loadgen", "metrics", "model", "names", "policy", "proxy", "replay", "singleflight")
+__all__ = list(_submodules)
 
-def close(*args, **kwargs):
-    try:
-        _p4p_thread_context_close(*args, **kwargs)
-    except TypeError:
-        pass
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    if name == "__version__":
+        try:
+            from importlib.metadata import version
+        except ImportError:
+            from importlib_metadata import version
+        globals()["__version__"] = version("meme")
+        return globals()["__version__"]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
-thread.Context.close = close
-
-from . import names
-from . import archive
-from . import model
-import pkg_resources
-__version__ = pkg_resources.get_distribution('meme').version
\ No newline at end of file
+def __dir__():
+    return sorted(list(globals()) + list(_submodules) + ["__version__"])
@@ -0,0 +1,47 @@
+"""Pieces shared by the meme servers (:mod:`meme.proxy` and :mod:`meme.replay`)."""
+from p4p.nt import NTScalar
+from p4p.server.thread import SharedPV
+
+def add_server_arguments(parser):
+    """Add the --port, --broadcast-port, and --interface options to a command's parser."""
+    parser.add_argument("--port", type=int, help="The TCP port to serve on.  Defaults to EPICS_PVAS_SERVER_PORT, or 5075.")
+    parser.add_argument("--broadcast-port", type=int, help="The UDP port to answer searches on.  Defaults to EPICS_PVAS_BROADCAST_PORT, or 5076.")
+    parser.add_argument("--interface", help="The address to listen on.  Defaults to every interface.")
+
+def server_conf(args):
+    """Get the server settings (EPICS_PVAS_*) for the options from :func:`add_server_arguments`, or None."""
+    conf = {}
+    if args.port is not None:
+        conf["EPICS_PVAS_SERVER_PORT"] = str(args.port)
+    if args.broadcast_port is not None:
+        conf["EPICS_PVAS_BROADCAST_PORT"] = str(args.broadcast_port)
+    if args.interface is not None:
+        conf["EPICS_PVAS_INTF_ADDR_LIST"] = args.interface
+    return conf or None
+
+def rpc_pv(handler):
+    """Make a PV which answers RPCs with `handler`."""
+    # RPC-only PVs still need to be open to accept requests.
+    return SharedPV(handler=handler, nt=NTScalar("s"), initial="")
+
+class ServerMixin(object):
+    """run_forever() and context manager support for a server.
+
+    The class sets `self._closed` (a threading.Event) in its close() method.
+    """
+    def run_forever(self):
+        """Serve until interrupted (with Ctrl-C, for example)."""
+        try:
+            while not self._closed.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -1 +1,8 @@
-from .archive import get, convert_to_dataframe, get_dataframe
\ No newline at end of file
+from .archive import get, get_windows, get_at, get_steps, set_backend, get_backend, convert_to_dataframe, get_dataframe, to_timeseries
+from .stream import ArchiveStream
+from .timeseries import TimeSeries
+from .bulk_export import export
+from .summary import stats
+from .steps import StepFunction, StepFrame
+from .analysis import correlate
+from .appliance import ApplianceBackend, ApplianceError
\ No newline at end of file
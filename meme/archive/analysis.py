@@ -0,0 +1,162 @@
+"""Correlation and lagged cross-correlation of many PVs over long archive ranges."""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import numpy as np
+from . import archive
+from .steps import StepFunction, StepFrame
+
+class _Sums(object):
+  """Additive sums for the correlation of P PVs, about a fixed shift (for numerical stability)."""
+  def __init__(self, shift, max_lag):
+    p = len(shift)
+    self.shift = shift
+    self.n = 0
+    self.s1 = np.zeros(p)
+    self.s2 = np.zeros((p, p))
+    lags = 2 * max_lag + 1
+    self.lagged = np.zeros((lags, p, p)) if max_lag else None
+    self.lagged_s1 = np.zeros((lags, p)) if max_lag else None
+    self.lagged_s1_after = np.zeros((lags, p)) if max_lag else None
+    self.lag_counts = np.zeros(lags) if max_lag else None
+
+  def merge(self, other):
+    self.n += other.n
+    self.s1 += other.s1
+    self.s2 += other.s2
+    if self.lagged is not None:
+      self.lagged += other.lagged
+      self.lagged_s1 += other.lagged_s1
+      self.lagged_s1_after += other.lagged_s1_after
+      self.lag_counts += other.lag_counts
+    return self
+
+def _grid_chunk(pvs, pvs_per_chunk, grid, step, bounds, timeout):
+  """Fetch PVs and read them on the grid times (in nanoseconds), with NaN outside `bounds`."""
+  start, end = int(grid[0]), int(grid[-1]) + step
+  data = {}
+  for i in range(0, len(pvs), pvs_per_chunk):
+    data.update(archive._fetch_range(pvs[i:i + pvs_per_chunk], max(start, bounds[0]), min(end, bounds[1]), ['values'], timeout, previous=True))
+  frame = StepFrame([StepFunction(data[pv]['time'], data[pv]['values'], pv) if pv in data else StepFunction([], [], pv) for pv in pvs])
+  values = frame._at_ns(grid)
+  values[(grid < bounds[0]) | (grid >= bounds[1])] = np.nan
+  return values
+
+def _chunk_sums(pvs, pvs_per_chunk, core, step, max_lag, bounds, timeout, shift):
+  halo = max_lag * step
+  grid = np.arange(core[0] - halo, core[1] + halo, step, dtype=np.int64)
+  values = _grid_chunk(pvs, pvs_per_chunk, grid, step, bounds, timeout)
+  if shift is None:
+    inside = values[max_lag:len(values) - max_lag]
+    complete = inside[~np.isnan(inside).any(axis=1)]
+    shift = complete.mean(axis=0) if len(complete) else np.zeros(len(pvs))
+  sums = _Sums(shift, max_lag)
+  # Only rows where every PV has a value are used.  Zeroed rows add nothing to the sums.
+  valid = ~np.isnan(values).any(axis=1)
+  centered = np.where(valid[:, None], values - shift, 0.0)
+  core_rows = slice(max_lag, len(values) - max_lag)
+  a, a_valid = centered[core_rows], valid[core_rows]
+  sums.n = int(a_valid.sum())
+  sums.s1 = a.sum(axis=0)
+  sums.s2 = a.T @ a
+  if max_lag:
+    # sum_t a_i(t) * b_j(t + k) for k = 0 .. 2 * max_lag, where b is the chunk with
+    # its halo, so lag = k - max_lag.  Zero padding makes the FFT correlation linear.
+    # The same is done with the masks, for the count and the sums of each PV over
+    # just the pairs at each lag.
+    n_fft = _fft_size(len(a) + len(centered))
+    lags = 2 * max_lag + 1
+    def correlation(x_fft, y_fft):
+      return np.fft.irfft(np.conj(x_fft) * y_fft, n_fft, axis=0)[:lags]
+    a_fft = np.fft.rfft(a, n_fft, axis=0)
+    b_fft = np.fft.rfft(centered, n_fft, axis=0)
+    a_mask_fft = np.fft.rfft(a_valid.astype(float), n_fft)[:, None]
+    b_mask_fft = np.fft.rfft(valid.astype(float), n_fft)[:, None]
+    for i in range(len(pvs)):
+      sums.lagged[:, i, :] = correlation(a_fft[:, i:i + 1], b_fft)
+    sums.lagged_s1 = correlation(a_fft, b_mask_fft)
+    sums.lagged_s1_after = correlation(a_mask_fft, b_fft)
+    sums.lag_counts = np.round(correlation(a_mask_fft, b_mask_fft)[:, 0])
+  return sums
+
+def _fft_size(n):
+  return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+def correlate(pvs, from_time, to_time, step=1.0, max_lag=0, chunk=timedelta(hours=6), pvs_per_chunk=50, timeout=None, max_workers=4):
+  """Correlation matrix (and optionally lagged cross-correlations) for many PVs over a long range.
+
+  Every PV is read as a step function (each value holds until the next change) on
+  a shared grid with spacing `step`.  The range is handled one time chunk at a time,
+  up to `max_workers` chunks at once, and each chunk is reduced to additive sums
+  (centered on the first chunk's means, for accuracy) which are merged as they
+  finish.  Memory depends on the chunk size and number of PVs, not the span.
+
+  Grid times where any PV has no value yet are skipped.  Lagged sums use the grid
+  points just beyond each chunk, so no pairs are lost at chunk boundaries.  They
+  are computed with FFTs: the covariance of each lag is over the pairs of points at
+  that lag, normalized by the overall standard deviations.
+
+  .. code-block:: python
+
+    r = meme.archive.correlate(pvs, loss_time - timedelta(days=2), loss_time, step=1.0, max_lag=30)
+    r["correlation"]          # P x P
+    r["lagged_correlation"]   # 61 x P x P, for lags of -30 to 30 seconds
+
+  Args:
+    pvs (list of str): The PVs.
+    from_time (datetime): The start of the range.  Without a timezone, 'US/Pacific' is implied.
+    to_time (datetime): The end of the range.
+    step (float, optional): The grid spacing, in seconds.
+    max_lag (int, optional): The largest lag, in grid steps.  Lags from -max_lag
+      to max_lag are computed.  Defaults to 0 (no lagged correlations).
+    chunk (timedelta or float, optional): The length of each time chunk (a float is
+      in seconds).  Defaults to six hours.
+    pvs_per_chunk (int, optional): The number of PVs fetched in each request.
+    timeout (float, optional): The timeout for each request.  See :func:`meme.archive.get`.
+    max_workers (int, optional): The most chunks to handle at the same time.
+  Returns:
+    dict: A dict with:
+
+    * `pvs` (list of str): The PVs, in the order of the matrix rows and columns.
+    * `correlation` (np.ndarray): The P x P correlation matrix.
+    * `mean`, `std` (np.ndarray): Each PV's mean and standard deviation on the grid.
+    * `n` (int): The number of grid points used.
+    * `lags` (np.ndarray): The lags in seconds, if `max_lag` was given.
+    * `lagged_correlation` (np.ndarray): If `max_lag` was given, an array with shape
+      (number of lags, P, P), where [k, i, j] is the correlation of PV i at time t
+      with PV j at time t + lags[k].
+  """
+  if isinstance(pvs, str):
+    pvs = [pvs]
+  pvs = list(pvs)
+  step_ns = int(step * 1e9)
+  times, chunk_ns = archive._chunk_bounds(from_time, to_time, chunk)
+  # Chunks hold a whole number of grid steps, so every chunk lands on the same grid.
+  chunk_ns = max(chunk_ns // step_ns, 1) * step_ns
+  bounds = (times[0], times[-1])
+  cores = [(start, min(start + chunk_ns, bounds[1])) for start in range(bounds[0], bounds[1], chunk_ns)]
+  total = _chunk_sums(pvs, pvs_per_chunk, cores[0], step_ns, max_lag, bounds, timeout, None)
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    pending = []
+    for core in cores[1:]:
+      pending.append(executor.submit(_chunk_sums, pvs, pvs_per_chunk, core, step_ns, max_lag, bounds, timeout, total.shift))
+      if len(pending) >= max_workers:
+        total.merge(pending.pop(0).result())
+    for future in pending:
+      total.merge(future.result())
+  return _result(pvs, total, max_lag, step)
+
+def _result(pvs, total, max_lag, step):
+  n = total.n
+  mean_shifted = total.s1 / n if n else np.full(len(pvs), np.nan)
+  cov = (total.s2 - n * np.outer(mean_shifted, mean_shifted)) / (n - 1) if n > 1 else np.full((len(pvs),) * 2, np.nan)
+  std = np.sqrt(np.diag(cov))
+  with np.errstate(invalid="ignore", divide="ignore"):
+    result = {"pvs": pvs, "correlation": cov / np.outer(std, std), "mean": mean_shifted + total.shift, "std": std, "n": n}
+    if max_lag:
+      counts = total.lag_counts[:, None, None]
+      means_before = total.lagged_s1[:, :, None] / counts
+      means_after = total.lagged_s1_after[:, None, :] / counts
+      lagged_cov = (total.lagged / counts - means_before * means_after) * counts / (counts - 1)
+      result["lags"] = np.arange(-max_lag, max_lag + 1) * step
+      result["lagged_correlation"] = lagged_cov / np.outer(std, std)[None]
+  return result
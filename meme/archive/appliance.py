@@ -0,0 +1,318 @@
+"""Get history data straight from an EPICS Archiver Appliance, instead of the MEME hist service.
+
+The Archiver Appliance serves data in its 'PB' format: a stream of chunks, one
+per PV per year.  Each chunk is a header line (a PayloadInfo protobuf message)
+followed by one line per sample, with newlines in the messages escaped.  Chunks
+are separated by an empty line.  This module reads that stream as it arrives
+and decodes it into NumPy arrays, with a small protobuf decoder for just the
+message types it needs.
+
+.. code-block:: python
+
+  import meme.archive
+  meme.archive.set_backend(meme.archive.ApplianceBackend("http://archiver.example:17665/retrieval"))
+  data = meme.archive.get("BPMS:LI24:801:X", from_time="1 hour ago")
+"""
+import array
+import calendar
+import http.client
+import re
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+import numpy as np
+import pytz
+from ..policy import get_policy
+from .. import metrics
+
+class ApplianceError(RuntimeError):
+  """Raised when the Archiver Appliance answers a request with an error."""
+  pass
+
+# PayloadType values from the Archiver Appliance's EPICSEvent.proto.
+SCALAR_STRING, SCALAR_SHORT, SCALAR_FLOAT, SCALAR_ENUM, SCALAR_BYTE, SCALAR_INT, SCALAR_DOUBLE = range(7)
+_zigzag_types = (SCALAR_SHORT, SCALAR_ENUM, SCALAR_INT)
+
+class ApplianceBackend(object):
+  """Fetches history data from an Archiver Appliance's retrieval URL.
+
+  Install it with :func:`meme.archive.set_backend`, and every function in
+  :mod:`meme.archive` uses it instead of the MEME hist service.  The data comes
+  back in the same format as from the hist service.
+
+  Each PV is requested separately, up to `max_workers` at a time.  Every worker
+  thread keeps its own HTTP connection open between requests.
+
+  Args:
+    url (str): The retrieval URL, like "http://archiver.example:17665/retrieval".
+    max_workers (int, optional): The most PVs to request at the same time.
+    block_size (int, optional): The number of bytes read from the response at a time.
+  """
+  def __init__(self, url, max_workers=8, block_size=1 << 20):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+      raise ValueError("The Archiver Appliance URL must start with http:// or https://.")
+    self.url = url
+    self.max_workers = max_workers
+    self.block_size = block_size
+    self._scheme = parts.scheme
+    self._netloc = parts.netloc
+    self._path = parts.path.rstrip("/") + "/data/getData.raw"
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._executor = None
+    self._connections = []
+
+  def fetch(self, pv, from_time, to_time, span=None, timeout=None, fields=None):
+    """Get data for one PV (a str) or many (a list), in the format returned by :func:`meme.archive.get`.
+
+    Times are UTC time strings, as sent to the hist service, or relative ones like
+    "1 hour ago" (see :func:`meme.archive.appliance.parse_time`).  `to_time` defaults to now, and
+    `from_time` to one hour before `to_time`.
+    """
+    pvs = [pv] if isinstance(pv, str) else list(pv)
+    end = parse_time(to_time) if to_time is not None else datetime.now(pytz.utc)
+    start = parse_time(from_time) if from_time is not None else end - timedelta(hours=1)
+    query_times = (_appliance_time(start), _appliance_time(end))
+    if span is None:
+      span = (end - start).total_seconds()
+    executor = self._get_executor()
+    futures = [executor.submit(get_policy().call, "appliance", self._fetch_pv, name, query_times, fields,
+                               timeout=timeout, items=1, span=span) for name in pvs]
+    results = [future.result() for future in futures]
+    if len(pvs) == 1:
+      return results[0]
+    return [{'pvName': name, 'value': {'labels': list(data), 'value': data}} for name, data in zip(pvs, results)]
+
+  def _get_executor(self):
+    with self._lock:
+      if self._executor is None:
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="meme-appliance")
+      return self._executor
+
+  def _connection(self, timeout):
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection_class = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+      connection = connection_class(self._netloc, timeout=timeout)
+      self._local.connection = connection
+      with self._lock:
+        self._connections.append(connection)
+    connection.timeout = timeout
+    if connection.sock is not None:
+      connection.sock.settimeout(timeout)
+    return connection
+
+  def _request(self, path, timeout):
+    """Send a GET on this thread's connection.  A connection closed by the server is reopened once."""
+    for attempt in (0, 1):
+      connection = self._connection(timeout)
+      try:
+        connection.request("GET", path, headers={"Connection": "keep-alive"})
+        return connection.getresponse()
+      except (http.client.RemoteDisconnected, http.client.ImproperConnectionState, ConnectionResetError, BrokenPipeError):
+        # ImproperConnectionState covers ResponseNotReady and CannotSendRequest.
+        connection.close()
+        if attempt:
+          raise
+
+  def _fetch_pv(self, pv, query_times, fields, timeout=None):
+    path = self._path + "?" + urlencode({"pv": pv, "from": query_times[0], "to": query_times[1]})
+    with metrics.timer("appliance", "wait"):
+      response = self._request(path, timeout)
+    try:
+      return self._read_response(pv, response, fields)
+    except BaseException:
+      # The rest of the body is still waiting on the connection, so it can't be
+      # reused.  Closing it makes the next request on this thread reconnect.
+      self._local.connection.close()
+      raise
+
+  def _read_response(self, pv, response, fields):
+    if response.status == 404:
+      # The appliance doesn't archive this PV.
+      response.read()
+      return _PBDecoder().result(fields)
+    if response.status != 200:
+      body = response.read(1000).decode("utf-8", "replace")
+      raise ApplianceError("The Archiver Appliance returned {} {} for {}: {}".format(response.status, response.reason, pv, body))
+    decoder = _PBDecoder()
+    with metrics.timer("appliance", "decode"):
+      while True:
+        block = response.read(self.block_size)
+        if not block:
+          break
+        decoder.feed(block)
+      decoder.close()
+    return decoder.result(fields)
+
+  def close(self):
+    """Stop the worker threads and close their connections."""
+    with self._lock:
+      executor, self._executor = self._executor, None
+      connections, self._connections = self._connections, []
+    if executor is not None:
+      executor.shutdown(wait=True)
+    for connection in connections:
+      connection.close()
+    self._local = threading.local()
+
+  def __repr__(self):
+    return "ApplianceBackend({!r})".format(self.url)
+
+_relative_time = re.compile(r"^\s*(\d+(?:\.\d*)?)\s*(seconds?|secs?|s|minutes?|mins?|m|hours?|hrs?|h|days?|d|weeks?|w)\s+ago\s*$", re.IGNORECASE)
+_units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+def parse_time(time, now=None):
+  """Convert a time string, as accepted by :func:`meme.archive.get`, to a UTC datetime.
+
+  Args:
+    time (str or datetime): "now", a relative time like "1 hour ago" or "90 min ago",
+      or an absolute time like "2024-01-01T08:00:00.000Z".  Absolute times and
+      datetimes without a timezone are in 'US/Pacific'.
+    now (datetime, optional): What relative times are relative to.  Defaults to the current time.
+  Returns:
+    datetime: A timezone-aware UTC datetime.
+  """
+  from .archive import _utc_timestamp
+  if isinstance(time, str):
+    text = time.strip().lower()
+    if now is None:
+      now = datetime.now(pytz.utc)
+    if text == "now":
+      return now
+    match = _relative_time.match(text)
+    if match:
+      unit = _units[match.group(2)[0]]
+      return now - timedelta(**{unit: float(match.group(1))})
+  return _utc_timestamp(time).to_pydatetime()
+
+def _appliance_time(time):
+  return time.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S.') + "{:03d}Z".format(time.microsecond // 1000)
+
+def unescape(line):
+  """Undo the Archiver Appliance's escaping of one line: ESC 1, ESC 2, and ESC 3 become ESC, LF, and CR."""
+  if b"\x1b" not in line:
+    return line
+  # An escaped ESC is always followed by 1, so it can't be mistaken for the start of the other two.
+  return line.replace(b"\x1b\x02", b"\n").replace(b"\x1b\x03", b"\r").replace(b"\x1b\x01", b"\x1b")
+
+_double = struct.Struct("<d")
+_float = struct.Struct("<f")
+
+def decode_message(data):
+  """Decode a protobuf message into {field number: value}, keeping the last value of each field.
+
+  Varints are returned as (unsigned) ints, 64-bit fields as doubles, 32-bit fields as
+  floats, and length-delimited fields as bytes.  That covers every message the
+  Archiver Appliance sends for scalar PVs.
+  """
+  fields = {}
+  position, end = 0, len(data)
+  try:
+    while position < end:
+      key, position = _varint(data, position)
+      number, wire_type = key >> 3, key & 7
+      if wire_type == 0:
+        fields[number], position = _varint(data, position)
+      elif wire_type == 1:
+        fields[number] = _double.unpack_from(data, position)[0]
+        position += 8
+      elif wire_type == 2:
+        length, position = _varint(data, position)
+        fields[number] = data[position:position + length]
+        position += length
+      elif wire_type == 5:
+        fields[number] = _float.unpack_from(data, position)[0]
+        position += 4
+      else:
+        raise ValueError("Unsupported protobuf wire type {}.".format(wire_type))
+  except (IndexError, struct.error):
+    position = end + 1
+  if position != end:
+    raise ValueError("Truncated protobuf message.")
+  return fields
+
+def _varint(data, position):
+  result, shift = 0, 0
+  while True:
+    byte = data[position]
+    position += 1
+    result |= (byte & 0x7f) << shift
+    if byte < 0x80:
+      return result, position
+    shift += 7
+
+def _signed32(value):
+  """A varint int32 (not zigzag): negative values are sent as 64-bit two's complement."""
+  return value - (1 << 64) if value >= 1 << 63 else value
+
+def _zigzag(value):
+  return (value >> 1) ^ -(value & 1)
+
+class _PBDecoder(object):
+  """Decodes a PB stream fed to it in blocks of any size, into arrays for one PV."""
+  def __init__(self):
+    self._tail = b""
+    self._expect_header = True
+    self._type = None
+    self._year_start = 0
+    self.seconds = array.array("q")
+    self.nanoseconds = array.array("l")
+    self.values = array.array("d")
+    self.severity = array.array("l")
+    self.status = array.array("l")
+
+  def feed(self, block):
+    lines = (self._tail + block).split(b"\n")
+    self._tail = lines.pop()
+    for line in lines:
+      self._line(line)
+
+  def close(self):
+    if self._tail:
+      self._line(self._tail)
+      self._tail = b""
+
+  def _line(self, line):
+    if not line:
+      # An empty line ends a chunk.  The next line is a new header.
+      self._expect_header = True
+      return
+    message = decode_message(unescape(line))
+    if self._expect_header:
+      self._start_chunk(message)
+      return
+    self.seconds.append(self._year_start + message.get(1, 0))
+    self.nanoseconds.append(message.get(2, 0))
+    value = message.get(3, 0)
+    if self._type in _zigzag_types:
+      value = _zigzag(value)
+    elif self._type == SCALAR_BYTE:
+      value = value[0] if value else 0
+    self.values.append(value)
+    self.severity.append(_signed32(message.get(4, 0)))
+    self.status.append(_signed32(message.get(5, 0)))
+
+  def _start_chunk(self, header):
+    payload_type = header.get(1, 0)
+    if payload_type not in (SCALAR_SHORT, SCALAR_FLOAT, SCALAR_ENUM, SCALAR_BYTE, SCALAR_INT, SCALAR_DOUBLE):
+      raise ApplianceError("Only numeric scalar PVs are supported, but {} has payload type {}.".format(header.get(2, b"").decode(), payload_type))
+    self._type = payload_type
+    self._year_start = calendar.timegm((header.get(3, 1970), 1, 1, 0, 0, 0))
+    self._expect_header = False
+
+  def result(self, fields=None):
+    """The samples, in the format of single-PV data from :func:`meme.archive.get`."""
+    data = {'secondsPastEpoch': np.frombuffer(self.seconds, dtype=np.int64) if len(self.seconds) else np.empty(0, dtype=np.int64),
+            'values': np.frombuffer(self.values, dtype=np.float64) if len(self.values) else np.empty(0),
+            'nanoseconds': np.asarray(self.nanoseconds, dtype=np.int32),
+            'severity': np.asarray(self.severity, dtype=np.int32),
+            'status': np.asarray(self.status, dtype=np.int32)}
+    if fields is not None:
+      from .archive import time_fields
+      keep = list(time_fields) + [field for field in fields if field not in time_fields]
+      data = {field: data[field] for field in keep}
+    return data
@@ -1,20 +1,56 @@
-from p4p.client.thread import Context
 from p4p.nt import NTTable, NTURI
-import pandas as pd
-import dateutil.parser
 import pytz
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta
+from ..context import get_context
+from ..singleflight import flights
+from ..policy import get_policy
+from .. import metrics
+from .timeseries import TimeSeries
+from .steps import StepFrame
 
 local_time_zone = pytz.timezone('US/Pacific')
-ctx = Context('pva')
 ArchiveQueryURI = NTURI([('from', 's'), ('to', 's'), ('pv', 's')])
 
-def hist_service_get(timeout=None, **kws):
-  if timeout is None:
-    timeout = 5.0
+def hist_service_get(timeout=None, span=None, **kws):
   query_dict = {key.lstrip("_"): val for key, val in kws.items()}
   request = ArchiveQueryURI.wrap("hist", scheme="pva", kws=query_dict)
-  return ctx.rpc("hist", request, timeout=timeout)
+  # The timeout scales with the number of PVs and the time span (in seconds) asked for.
+  items = len(str(query_dict.get("pv", "")).split(","))
+  # Identical queries made at the same time (from different threads) share one request.
+  key = ("hist", tuple(sorted(query_dict.items())))
+  with metrics.timer("hist", "wait"):
+    return flights.do(key, get_policy().call, "hist", get_context().rpc, "hist", request, timeout=timeout, items=items, span=span)
+
+_backend = None
+
+def set_backend(backend):
+  """Choose where :mod:`meme.archive` gets its data from.
+
+  By default, data comes from the MEME hist service.  To skip that hop and read
+  straight from an EPICS Archiver Appliance:
+
+  .. code-block:: python
+
+    meme.archive.set_backend(meme.archive.ApplianceBackend("http://archiver.example:17665/retrieval"))
+
+  Args:
+    backend (ApplianceBackend or None): The backend to use, or None for the hist service.
+      Any object with a `fetch(pv, from_time, to_time, span, timeout, fields)` method
+      that returns data in the format of :func:`get` will do.
+  """
+  global _backend
+  _backend = backend
+
+def get_backend():
+  """Get the backend set with :func:`set_backend`, or None if the hist service is used."""
+  return _backend
+
+def __getattr__(name):
+  # 'ctx' used to be a Context made at import time.  Keep it working for old scripts.
+  if name == "ctx":
+    return get_context()
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def convert_datetime_to_UTC(naive_datetime):
   local_datetime = local_time_zone.localize(naive_datetime, is_dst=None)
@@ -25,7 +61,7 @@ def convert_datetime_to_UTC(naive_datetime):
 def iso8601_string_from_datetime(dt):
   return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
 
-def get(pv, from_time=None, to_time=None, timeout=5.0):
+def get(pv, from_time=None, to_time=None, timeout=None, as_timeseries=False, fields=None):
   """Gets history data from the archive service.
   
   Args:
@@ -43,7 +79,16 @@ def get(pv, from_time=None, to_time=None, timeout=5.0):
     to_time (str or datetime, optional): The end time for the data.  The same
       rules as `from_time` apply.
     timeout (float, optional): An amount of time to wait (in seconds) before cancelling the
-      request.  The default timeout is 5.0 seconds.
+      request.  By default, the timeout comes from the :class:`meme.policy.ServicePolicy`,
+      and grows with the number of PVs and the time span requested.  Timed out
+      requests are retried according to the policy.
+    as_timeseries (bool, optional): Return :class:`meme.archive.TimeSeries` objects
+      instead of dicts: one TimeSeries for a single PV, or a dict of them keyed
+      by PV name for more than one.
+    fields (list of str, optional): Only decode these fields (like ['values']).
+      'secondsPastEpoch' and 'nanoseconds' are always included.  The archive
+      service always sends every field, but skipping the rest saves decode time
+      and memory.  By default, every field is returned.
   Returns:
     dict or list of dicts: A data structure with the following fields:
 
@@ -64,13 +109,16 @@ def get(pv, from_time=None, to_time=None, timeout=5.0):
       * `labels` (list of str): The names of the fields in the value structure.
   
   """
-  multiple_pvs = False
-  if isinstance(pv, str):
-    pvlist = pv
-  else:
-    pvlist = ",".join(pv)
-    if len(pv) > 1:
-      multiple_pvs = True
+  with metrics.timer("hist", "total"):
+    result = _get(pv, from_time, to_time, timeout, fields)
+  if as_timeseries:
+    return to_timeseries(result, pv if isinstance(pv, str) else pv[0])
+  return result
+
+def _get(pv, from_time, to_time, timeout, fields=None):
+  span = None
+  if isinstance(from_time, datetime) and isinstance(to_time, datetime):
+    span = abs((to_time - from_time).total_seconds())
   if isinstance(from_time, datetime):
     if from_time.tzinfo is None or from_time.tzinfo.tzname(from_time) not in ("UTC", "GMT"):
       from_time = convert_datetime_to_UTC(from_time)
@@ -79,12 +127,320 @@ def get(pv, from_time=None, to_time=None, timeout=5.0):
     if to_time.tzinfo is None or to_time.tzinfo.tzname(to_time) not in ("UTC", "GMT"):
       to_time = convert_datetime_to_UTC(to_time)
     to_time = iso8601_string_from_datetime(to_time)
-  response = hist_service_get(pv=pvlist, _from=from_time, _to=to_time, timeout=timeout)
-  if multiple_pvs:
-    return [item.todict() for item in response.value]
+  return _fetch(pv, from_time, to_time, span, timeout, fields)
+
+def _fetch(pv, from_time, to_time, span, timeout, fields=None):
+  """Request and decode history data, with times already converted to strings."""
+  multiple_pvs = False
+  if isinstance(pv, str):
+    pvlist = pv
+  else:
+    pvlist = ",".join(pv)
+    if len(pv) > 1:
+      multiple_pvs = True
+  if _backend is not None:
+    result = _backend.fetch(pv, from_time, to_time, span, timeout, fields)
+  else:
+    response = hist_service_get(pv=pvlist, _from=from_time, _to=to_time, timeout=timeout, span=span)
+    with metrics.timer("hist", "decode"):
+      if fields is not None:
+        result = _decode_fields(response, multiple_pvs, fields)
+      elif multiple_pvs:
+        result = [item.todict() for item in response.value]
+      else:
+        result = response.value.todict()
+  if metrics.enabled:
+    metrics.record_payload("hist", *_payload_size(result))
+  return result
+
+time_fields = ('secondsPastEpoch', 'nanoseconds')
+
+def _decode_fields(response, multiple_pvs, fields):
+  """Decode only some of the fields in a hist response, in the same format as todict()."""
+  keep = list(time_fields) + [field for field in fields if field not in time_fields]
+  if not multiple_pvs:
+    return {field: response.value[field] for field in keep}
+  return [{'pvName': item['pvName'], 'value': {'labels': keep, 'value': {field: item['value']['value'][field] for field in keep}}}
+          for item in response.value]
+
+def get_windows(pv, windows, timeout=None, max_workers=8, fields=None):
+  """Gets history data from the archive service for many time windows at once.
+
+  The windows are requested concurrently, and each distinct window is only
+  requested once.
+
+  .. code-block:: python
+
+    shifts = pandas.interval_range(start="2024-01-01 07:00", periods=3 * 365, freq="8h")
+    data = meme.archive.get_windows("MC00:ASTS:OUTSIDET", shifts)
+    for shift, shift_data in data.items():
+      ...
+
+  Args:
+    pv (str or list of str): A PV (or list of PVs) to get history data for,
+      as in :func:`get`.
+    windows (pandas.IntervalIndex or sequence of (from_time, to_time) pairs): The
+      time windows to get data for.  Times can be datetimes, numpy datetime64s,
+      pandas Timestamps, or strings like "1 hour ago".  Times without a timezone
+      are in 'US/Pacific', as in :func:`get`.
+    timeout (float, optional): The timeout for each window's request.  See :func:`get`.
+    max_workers (int, optional): The most windows to request at the same time.
+    fields (list of str, optional): Only decode these fields.  See :func:`get`.
+  Returns:
+    dict: The data for each window, in the format returned by :func:`get`.  The keys
+    are the windows as given: Intervals for an IntervalIndex, or (from_time, to_time)
+    tuples.  The dict is in the same order as `windows`.
+  """
+  import pandas as pd
+  from concurrent.futures import ThreadPoolExecutor
+  if isinstance(windows, pd.IntervalIndex):
+    keys = list(windows)
+    from_times, to_times = windows.left, windows.right
   else:
-    return response.value.todict()
+    keys = [tuple(window) for window in windows]
+    from_times = [window[0] for window in keys]
+    to_times = [window[1] for window in keys]
+  if len(keys) == 0:
+    return {}
+  from_strings, from_stamps = _utc_strings(from_times)
+  to_strings, to_stamps = _utc_strings(to_times)
+  spans = np.abs((to_stamps - from_stamps) / 1e9)
+  requests = {}
+  for key, from_time, to_time, span in zip(keys, from_strings, to_strings, spans):
+    requests.setdefault((from_time, to_time), (from_time, to_time, None if np.isnan(span) else float(span)))
+  with metrics.timer("hist", "total"):
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+      futures = {window: executor.submit(_fetch, pv, from_time, to_time, span, timeout, fields)
+                 for window, (from_time, to_time, span) in requests.items()}
+      results = {window: future.result() for window, future in futures.items()}
+  return {key: results[(from_time, to_time)] for key, from_time, to_time in zip(keys, from_strings, to_strings)}
+
+def get_at(pvs, timestamps, max_gap=3600.0, timeout=None, max_workers=8, max_span=86400.0):
+  """Gets the value of each PV at each of many times.
+
+  The value at a time is the last archived value at or before that time.  Only
+  the time ranges covering the requested times are fetched: the sorted times are
+  split wherever two are more than `max_gap` seconds apart, ranges longer than
+  `max_span` seconds are split again, and one request is made per range
+  (concurrently, see :func:`get_windows`).  The lookup is a binary
+  search over integer nanosecond timestamps, so no joined, filled DataFrame is built.
+
+  .. code-block:: python
+
+    values = meme.archive.get_at(["BPMS:LI24:801:X", "BPMS:LI24:801:Y"], event_times)
+    # values[i, j] is PV j at event_times[i]
+
+  Args:
+    pvs (str or list of str): The PV(s) to get values for.
+    timestamps (sequence of datetimes, or a pandas.DatetimeIndex): The times to
+      get values at.  Times without a timezone are in 'US/Pacific', as in :func:`get`.
+      They do not need to be sorted.
+    max_gap (float, optional): The longest stretch (in seconds) with no requested
+      times that is still fetched as part of one range.
+    timeout (float, optional): The timeout for each range's request.  See :func:`get`.
+    max_workers (int, optional): The most ranges to request at the same time.
+    max_span (float, optional): The longest range (in seconds) fetched in one
+      request.  Longer runs of requested times are split into consecutive ranges,
+      so no single response holds more than this much data.  Defaults to a day.
+  Returns:
+    np.ndarray: A float array with shape (len(timestamps), len(pvs)), in the order
+    given.  Times before a PV's first archived sample in a range are NaN.  This relies
+    on the archive returning the last sample before the start of each range, as the
+    EPICS Archiver Appliance does.
+  """
+  if max_span <= 0:
+    raise ValueError("max_span must be longer than zero.")
+  if isinstance(pvs, str):
+    pvs = [pvs]
+  stamps = _utc_index(timestamps).asi8
+  values = np.full((len(stamps), len(pvs)), np.nan)
+  if len(stamps) == 0 or len(pvs) == 0:
+    return values
+  order = np.argsort(stamps, kind="stable")
+  sorted_stamps = stamps[order]
+  starts, stops = _ranges(sorted_stamps, int(max_gap * 1e9), int(max_span * 1e9))
+  # The service takes times to the second, so round the ends of each range outwards.
+  second = 1000000000
+  windows = [(_utc_timestamp_from_ns(sorted_stamps[start] // second * second),
+              _utc_timestamp_from_ns(-(-sorted_stamps[stop - 1] // second) * second))
+             for start, stop in zip(starts, stops)]
+  # Each PV is fetched once, even if it is listed more than once.
+  unique_pvs = list(dict.fromkeys(pvs))
+  results = get_windows(unique_pvs, windows, timeout=timeout, max_workers=max_workers, fields=['values'])
+  for window, start, stop in zip(windows, starts, stops):
+    steps = StepFrame.from_archive(results[window], pvs)
+    values[order[start:stop]] = steps._at_ns(sorted_stamps[start:stop])
+  return values
+
+def _ranges(sorted_stamps, max_gap, max_span):
+  """Split sorted nanosecond times into ranges for :func:`get_at`.
+
+  Returns:
+    tuple: (list of start indices, list of stop indices), one of each per range.
+  """
+  breaks = np.flatnonzero(np.diff(sorted_stamps) > max_gap) + 1
+  starts, stops = [], []
+  for run_start, run_stop in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(sorted_stamps)]))):
+    start = run_start
+    while start < run_stop:
+      stop = min(int(np.searchsorted(sorted_stamps, sorted_stamps[start] + max_span, side="right")), run_stop)
+      starts.append(start)
+      stops.append(stop)
+      start = stop
+  return starts, stops
+
+def get_steps(pv, from_time=None, to_time=None, timeout=None, compress=True):
+  """Gets history data from the archive service as step functions.
+
+  Each PV is kept as its change times and values (see :class:`meme.archive.StepFrame`),
+  instead of being joined and filled like :func:`get_dataframe` does.  Reading the
+  PVs at particular times, or on a grid, happens later, only when asked for.
+
+  Args:
+    pv (str or list of str): A PV (or list of PVs) to get history data for.
+    from_time (str or datetime, optional): The start time for the data.  See :func:`get`.
+    to_time (str or datetime, optional): The end time for the data.  See :func:`get`.
+    timeout (float, optional): See :func:`get`.
+    compress (bool, optional): Drop samples which repeat the value before them.
+  Returns:
+    StepFrame: A step function for each PV.
+  """
+  pvs = [pv] if isinstance(pv, str) else list(pv)
+  return StepFrame.from_archive(get(pvs, from_time, to_time, timeout, fields=['values']), pvs, compress)
+
+def _utc_timestamp_from_ns(ns):
+  import pandas as pd
+  return pd.Timestamp(int(ns), tz=pytz.utc)
+
+def _samples_by_pv(archive_data, pvs):
+  """Get (int64 nanosecond timestamps, float values) for each PV, sorted by time."""
+  if isinstance(archive_data, dict):
+    data = {pvs[0]: archive_data}
+  else:
+    data = {item['pvName']: item['value']['value'] for item in archive_data}
+  for pv in pvs:
+    pv_data = data.get(pv)
+    if pv_data is None:
+      yield np.empty(0, dtype=np.int64), np.empty(0)
+      continue
+    sample_stamps = np.asarray(pv_data['secondsPastEpoch'], dtype=np.int64) * 1000000000 + np.asarray(pv_data['nanoseconds'], dtype=np.int64)
+    sample_values = np.asarray(pv_data['values'], dtype=np.float64)
+    if len(sample_stamps) > 1 and np.any(np.diff(sample_stamps) < 0):
+      order = np.argsort(sample_stamps, kind="stable")
+      sample_stamps, sample_values = sample_stamps[order], sample_values[order]
+    yield sample_stamps, sample_values
+
+def _chunk_bounds(from_time, to_time, chunk):
+  """Split a time range into chunks.
+
+  Returns:
+    tuple: (list of chunk boundaries in nanoseconds since the epoch, chunk length in nanoseconds)
+  """
+  bounds = _utc_index([from_time, to_time]).asi8
+  step = int((chunk.total_seconds() if isinstance(chunk, timedelta) else chunk) * 1e9)
+  if step <= 0:
+    raise ValueError("chunk must be longer than zero.")
+  return list(range(int(bounds[0]), int(bounds[1]), step)) + [int(bounds[1])], step
+
+def _fetch_range(pvs, start, end, fields, timeout, previous=False):
+  """Fetch data for some PVs between two times (in nanoseconds since the epoch).
+
+  Returns:
+    dict: {pv: {'time': int64 array, field: array, ...}} for the samples with
+    start <= time < end.  Field names are as in :func:`get`.  If `previous` is True,
+    the last sample before `start` (if the archive sent one) is kept too.
+  """
+  # The service takes times to the second, so round the range outwards, then trim it.
+  second = 1000000000
+  strings, _ = _utc_strings([_utc_timestamp_from_ns(start // second * second),
+                             _utc_timestamp_from_ns(-(-end // second) * second)])
+  result = _fetch(pvs, strings[0], strings[1], (end - start) / 1e9, timeout, fields)
+  if isinstance(result, dict):
+    by_pv = {pvs[0]: result}
+  else:
+    by_pv = {item['pvName']: item['value']['value'] for item in result}
+  data = {}
+  for pv in pvs:
+    pv_data = by_pv.get(pv)
+    if pv_data is None:
+      continue
+    stamps = np.asarray(pv_data['secondsPastEpoch'], dtype=np.int64) * second + np.asarray(pv_data['nanoseconds'], dtype=np.int64)
+    keep = (stamps >= start) & (stamps < end)
+    if previous:
+      before = np.flatnonzero(stamps < start)
+      if len(before):
+        keep[before[-1]] = True
+    data[pv] = {'time': stamps[keep]}
+    for field in fields:
+      data[pv][field] = np.asarray(pv_data[field], dtype=np.float64 if field == 'values' else np.int32)[keep]
+  return data
+
+def _utc_strings(times):
+  """Convert many times to the service's UTC time strings at once.
+
+  Strings (like "1 hour ago") are passed through untouched.  Times without a
+  timezone are in the local time zone.
+
+  Returns:
+    tuple: (list of str, float array of nanoseconds since the epoch, NaN for strings)
+  """
+  import pandas as pd
+  times = list(times)
+  strings = [time if isinstance(time, str) else None for time in times]
+  stamps = np.full(len(times), np.nan)
+  positions = [i for i, time in enumerate(times) if not isinstance(time, str)]
+  if not positions:
+    return strings, stamps
+  converted = _utc_index([times[i] for i in positions])
+  for i, string in zip(positions, converted.strftime('%Y-%m-%dT%H:%M:%S.000Z')):
+    strings[i] = string
+  stamps[positions] = converted.asi8.astype(np.float64)
+  return strings, stamps
+
+def _utc_index(times):
+  """Convert many times to one UTC pandas.DatetimeIndex.  Times without a timezone are local."""
+  import pandas as pd
+  try:
+    index = pd.DatetimeIndex(times)
+  except (TypeError, ValueError):
+    # A mix of timezones (or of naive and aware times) can't share one index.
+    index = pd.DatetimeIndex([_utc_timestamp(time) for time in times])
+  if index.tz is None:
+    index = index.tz_localize(local_time_zone, ambiguous='raise', nonexistent='raise')
+  return index.tz_convert(pytz.utc).as_unit("ns")
+
+def _utc_timestamp(time):
+  import pandas as pd
+  time = pd.Timestamp(time)
+  if time.tzinfo is None:
+    time = time.tz_localize(local_time_zone, ambiguous='raise', nonexistent='raise')
+  return time.tz_convert(pytz.utc)
+
+def to_timeseries(archive_data, name=None):
+  """Convert archive data returned by :func:`meme.archive.get` to :class:`meme.archive.TimeSeries`.
+
+  Args:
+    archive_data (dict or list of dicts): Archive data, in the format returned by :func:`meme.archive.get`.
+    name (str, optional): The PV name for single-PV data, which doesn't include it.
+  Returns:
+    TimeSeries or dict: A TimeSeries for single-PV data, or a dict of TimeSeries keyed by PV name.
+  """
+  if isinstance(archive_data, dict):
+    return TimeSeries.from_archive(archive_data, name)
+  return {item['pvName']: TimeSeries.from_archive(item['value']['value'], item['pvName']) for item in archive_data}
+
+def _payload_size(archive_data):
+  """Count the samples and bytes in data returned by :func:`get`."""
+  if isinstance(archive_data, dict):
+    archive_data = [{"value": {"value": archive_data}}]
+  rows, nbytes = 0, 0
+  for pv_data in archive_data:
+    for column in pv_data['value']['value'].values():
+      nbytes += getattr(column, 'nbytes', 0)
+    rows += len(pv_data['value']['value']['secondsPastEpoch'])
+  return rows, nbytes
 
+@metrics.timed("hist", "convert")
 def convert_to_dataframe(archive_data):
     """Convert archive data returned by :func:`meme.archive.get` to a pandas dataframe. 
   
@@ -122,8 +478,8 @@ def convert_to_dataframe(archive_data):
         dfs.append(df)
     # Now join all the individual data frames together, and fill gaps in timestamps
     all_data = dfs[0].join(dfs[1:], how='outer')
-    all_data.fillna(method="ffill", inplace=True)
-    all_data.fillna(method="bfill", inplace=True)
+    all_data.ffill(inplace=True)
+    all_data.bfill(inplace=True)
     # Now get the timezone set correctly for all timestamps.
     all_data = all_data.tz_localize('UTC').tz_convert(local_time_zone)
     
@@ -154,7 +510,7 @@ def get_dataframe(*args, **kwargs):
       to_time (str or datetime, optional): The end time for the data.  The same
         rules as `from_time` apply.
       timeout (float, optional): An amount of time to wait (in seconds) before cancelling the
-        request.  The default timeout is 5.0 seconds.
+        request.  By default, the timeout comes from the :class:`meme.policy.ServicePolicy`.
     Returns:
       pandas.DataFrame: A pandas DataFrame object with a column for the values of each PV.
       
@@ -0,0 +1,207 @@
+"""Export archive data for many PVs over long time ranges to Parquet or HDF5, in bounded memory."""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import numpy as np
+from . import archive
+
+formats = ("parquet", "hdf5")
+columns = {"values": "value", "severity": "severity", "status": "status"}
+# Readers of the dataset skip files starting with "_".
+manifest_name = "_manifest.json"
+
+def export(pvs, from_time, to_time, path, format="parquet", chunk=timedelta(days=1), pvs_per_chunk=50,
+           fields=("values", "severity", "status"), timeout=None, max_workers=4):
+  """Export archive data to disk, one (time range, group of PVs) chunk at a time.
+
+  The time range is split into chunks of length `chunk`, and the PVs into groups of
+  `pvs_per_chunk`.  Each (time, PV group) chunk is fetched, turned into columns,
+  and written before later chunks are fetched, so memory use depends on the chunk
+  size, not on the whole export.  Up to `max_workers` chunks are fetched at once.
+
+  Progress is saved in a manifest after every chunk.  If an export is interrupted,
+  run it again with the same arguments, and it carries on from the first chunk
+  that wasn't finished.
+
+  The data is written in "long" format: one row per sample, with columns `pv`,
+  `time` (UTC, nanoseconds), `value`, and (if in `fields`) `severity` and `status`.
+  Only samples with from_time <= time < to_time are written.
+
+  * "parquet": `path` is a directory holding a partitioned Parquet dataset, with one
+    `chunk_start=...` directory per time chunk and one file per PV group in each.
+    Read it back with `pandas.read_parquet(path)` or `pyarrow.dataset`.  Requires pyarrow.
+  * "hdf5": `path` is an HDF5 file, with one group per PV holding `time`, `value`, and
+    the other columns as resizable, chunked datasets.  Requires h5py.  The manifest
+    is written next to the file, as `path + ".manifest.json"`.
+
+  .. code-block:: python
+
+    meme.archive.export(pvs, datetime(2024, 1, 1), datetime(2024, 7, 1), "/data/bpms")
+    df = pandas.read_parquet("/data/bpms", filters=[("pv", "==", "BPMS:LI24:801:X")])
+
+  Args:
+    pvs (list of str): The PVs to export.
+    from_time (datetime): The start of the export.  Without a timezone, 'US/Pacific' is implied.
+    to_time (datetime): The end of the export.
+    path (str): Where to write the export.
+    format (str, optional): "parquet" (the default) or "hdf5".
+    chunk (timedelta or float, optional): The length of each time chunk (a float is in
+      seconds).  Defaults to one day.
+    pvs_per_chunk (int, optional): The number of PVs fetched in each request.
+    fields (list of str, optional): Which archive fields to export, from 'values',
+      'severity', and 'status'.  Times are always exported.
+    timeout (float, optional): The timeout for each chunk's request.  See :func:`meme.archive.get`.
+    max_workers (int, optional): The most chunks to fetch at the same time.
+  Returns:
+    dict: The finished manifest, with the export settings and the chunks written.
+  """
+  if format not in formats:
+    raise ValueError("format must be one of {}.".format(", ".join(formats)))
+  if isinstance(pvs, str):
+    pvs = [pvs]
+  pvs = list(pvs)
+  fields = [field for field in columns if field in fields]
+  if "values" not in fields:
+    raise ValueError("fields must include 'values'.")
+  times, step = archive._chunk_bounds(from_time, to_time, chunk)
+  groups = [pvs[i:i + pvs_per_chunk] for i in range(0, len(pvs), pvs_per_chunk)]
+  settings = {"pvs": pvs, "from": times[0], "to": times[-1], "chunk": step, "pvs_per_chunk": pvs_per_chunk,
+              "fields": fields, "format": format}
+  writer = _ParquetWriter(path, fields) if format == "parquet" else _HDF5Writer(path, fields)
+  manifest = _load_manifest(writer.manifest_path, settings)
+  try:
+    writer.resume(manifest)
+    tasks = [(t, g) for t in range(len(times) - 1) for g in range(len(groups))
+             if _chunk_id(t, g) not in manifest["done"]]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+      # Keep at most max_workers chunks in memory, and write them in order.
+      pending = []
+      for t, g in tasks:
+        pending.append((t, g, executor.submit(archive._fetch_range, groups[g], times[t], times[t + 1], fields, timeout)))
+        if len(pending) >= max_workers:
+          _write_next(pending, writer, manifest, times)
+      while pending:
+        _write_next(pending, writer, manifest, times)
+  finally:
+    writer.close()
+  manifest["complete"] = True
+  _save_manifest(writer.manifest_path, manifest)
+  return manifest
+
+def _chunk_id(t, g):
+  return "{}-{}".format(t, g)
+
+def _write_next(pending, writer, manifest, times):
+  t, g, future = pending.pop(0)
+  data = future.result()
+  written = writer.write(t, g, times[t], data)
+  manifest["done"][_chunk_id(t, g)] = written
+  _save_manifest(writer.manifest_path, manifest)
+
+def _load_manifest(manifest_path, settings):
+  if os.path.exists(manifest_path):
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+    if manifest["settings"] != settings:
+      raise ValueError("{} is from an export with different settings.  Use a new path, or delete it to start over.".format(manifest_path))
+    return manifest
+  return {"settings": settings, "done": {}, "complete": False}
+
+def _save_manifest(manifest_path, manifest):
+  # Write then rename, so the manifest is never left half written.
+  tmp = manifest_path + ".tmp"
+  with open(tmp, "w") as f:
+    json.dump(manifest, f)
+  os.replace(tmp, manifest_path)
+
+class _ParquetWriter(object):
+  def __init__(self, path, fields):
+    try:
+      import pyarrow
+      import pyarrow.parquet
+    except ImportError:
+      raise ImportError("Parquet export needs pyarrow.  Install it with 'pip install pyarrow' (or 'pip install meme[arrow]').")
+    self.pa = pyarrow
+    self.path = path
+    self.fields = fields
+    self.manifest_path = os.path.join(path, manifest_name)
+    os.makedirs(path, exist_ok=True)
+
+  def resume(self, manifest):
+    # Files are renamed into place when they are complete, so there is nothing to undo.
+    pass
+
+  def write(self, t, g, start, data):
+    pa = self.pa
+    names = list(data)
+    lengths = [len(data[pv]["time"]) for pv in names]
+    arrays = {"pv": pa.DictionaryArray.from_arrays(pa.array(np.repeat(np.arange(len(names), dtype=np.int32), lengths)), pa.array(names, type=pa.string())),
+              "time": pa.array(_concat(data, "time", np.int64).view("datetime64[ns]"), type=pa.timestamp("ns", tz="UTC"))}
+    for field in self.fields:
+      arrays[columns[field]] = pa.array(_concat(data, field, np.float64 if field == "values" else np.int32))
+    table = pa.Table.from_pydict(arrays)
+    directory = os.path.join(self.path, "chunk_start={}".format(archive._utc_timestamp_from_ns(start).strftime("%Y%m%dT%H%M%S%fZ")))
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, "pvs-{:05d}.parquet".format(g))
+    # Write to a hidden file, then rename, so readers never see a partial file.
+    tmp = os.path.join(directory, ".pvs-{:05d}.parquet.tmp".format(g))
+    pa.parquet.write_table(table, tmp)
+    os.replace(tmp, filename)
+    return {"file": os.path.relpath(filename, self.path), "rows": table.num_rows}
+
+  def close(self):
+    pass
+
+class _HDF5Writer(object):
+  def __init__(self, path, fields):
+    try:
+      import h5py
+    except ImportError:
+      raise ImportError("HDF5 export needs h5py.  Install it with 'pip install h5py' (or 'pip install meme[hdf5]').")
+    self.fields = fields
+    self.manifest_path = path + ".manifest.json"
+    self.file = h5py.File(path, "a")
+
+  def resume(self, manifest):
+    # Throw away anything appended after the last chunk the manifest knows about.
+    lengths = {}
+    for written in manifest["done"].values():
+      lengths.update(written["lengths"])
+    for name in self.file:
+      group = self.file[name]
+      length = lengths.get(group.attrs["pv"], 0)
+      for dataset in group.values():
+        if len(dataset) > length:
+          dataset.resize((length,))
+
+  def _group(self, pv):
+    name = pv.replace("/", "%2F")
+    if name in self.file:
+      return self.file[name]
+    group = self.file.create_group(name)
+    group.attrs["pv"] = pv
+    group.create_dataset("time", shape=(0,), maxshape=(None,), dtype="i8", chunks=(65536,))
+    for field in self.fields:
+      group.create_dataset(columns[field], shape=(0,), maxshape=(None,), dtype="f8" if field == "values" else "i4", chunks=(65536,))
+    return group
+
+  def write(self, t, g, start, data):
+    lengths = {}
+    for pv, pv_data in data.items():
+      group = self._group(pv)
+      for field, values in pv_data.items():
+        dataset = group[columns.get(field, field)]
+        length = len(dataset)
+        dataset.resize((length + len(values),))
+        dataset[length:] = values
+      lengths[pv] = len(group["time"])
+    self.file.flush()
+    return {"lengths": lengths}
+
+  def close(self):
+    self.file.close()
+
+def _concat(data, column, dtype):
+  parts = [pv_data[column] for pv_data in data.values()]
+  return np.concatenate(parts).astype(dtype, copy=False) if parts else np.empty(0, dtype=dtype)
@@ -0,0 +1,198 @@
+"""Archive data kept as step functions: the times a value changed, and the new values."""
+import numpy as np
+
+class StepFunction(object):
+  """One PV's archive data as a step function.
+
+  The archiver stores a value when it changes, and the value holds until the next
+  one.  A StepFunction keeps just those change times and values.  Reading it at
+  other times (with :meth:`at` or :meth:`resample`) is a vectorized binary search,
+  done only when asked for.
+
+  Args:
+    times (array-like of int): Change times, in nanoseconds since the epoch (UTC).
+    values (array-like of float): The value from each change time on.
+    name (str, optional): The PV name.
+    compress (bool, optional): Drop samples which repeat the value before them,
+      since they don't change the function.  Defaults to True.
+  """
+  def __init__(self, times, values, name=None, compress=True):
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(times) != len(values):
+      raise ValueError("times and values must be the same length.")
+    if len(times) > 1 and np.any(np.diff(times) < 0):
+      order = np.argsort(times, kind="stable")
+      times, values = times[order], values[order]
+    if compress and len(values) > 1:
+      previous = values[:-1]
+      same = (values[1:] == previous) | (np.isnan(values[1:]) & np.isnan(previous))
+      keep = np.concatenate(([True], ~same))
+      times, values = times[keep], values[keep]
+    self.times = times
+    self.values = values
+    self.name = name
+
+  @classmethod
+  def from_archive(cls, archive_data, name=None, compress=True):
+    """Make a StepFunction from data for one PV, as returned by :func:`meme.archive.get`."""
+    times = np.asarray(archive_data['secondsPastEpoch'], dtype=np.int64) * 1000000000 + np.asarray(archive_data['nanoseconds'], dtype=np.int64)
+    return cls(times, archive_data['values'], name, compress)
+
+  def __len__(self):
+    return len(self.times)
+
+  def at(self, times):
+    """Get the value at each of some times.
+
+    Args:
+      times (array-like): Datetimes (without a timezone, 'US/Pacific' is implied), or
+        integer nanoseconds since the epoch.
+    Returns:
+      np.ndarray: The value at each time: the last value at or before it.  NaN
+      before the first change.
+    """
+    return self._at_ns(_to_ns(times))
+
+  def _at_ns(self, stamps):
+    positions = np.searchsorted(self.times, stamps, side="right") - 1
+    values = np.full(len(stamps), np.nan)
+    found = positions >= 0
+    values[found] = self.values[positions[found]]
+    return values
+
+  def to_series(self):
+    """Get the change times and values as a pandas.Series.  No filling is done."""
+    import pandas as pd
+    from .archive import local_time_zone
+    index = pd.DatetimeIndex(self.times.view("datetime64[ns]")).tz_localize("UTC").tz_convert(local_time_zone)
+    return pd.Series(self.values, index=index, name=self.name)
+
+  def __repr__(self):
+    return "StepFunction(name={!r}, changes={})".format(self.name, len(self))
+
+class StepFrame(object):
+  """Several PVs' archive data, each kept as its own :class:`StepFunction`.
+
+  Nothing is joined or filled until asked for.  :meth:`at` and :meth:`resample`
+  read every PV at the same times, and :meth:`to_dataframe` builds the full
+  joined table, like :func:`meme.archive.convert_to_dataframe`, only when called.
+
+  .. code-block:: python
+
+    steps = meme.archive.get_steps(pvs, from_time=start, to_time=end)
+    grid, values = steps.resample(1.0)        # One row per second.
+    df = steps.resample(1.0, as_dataframe=True)
+
+  Args:
+    steps (list of StepFunction): One per PV, each with a name.  A PV which is
+      listed more than once gets a column each time.
+  """
+  def __init__(self, steps):
+    self.steps = list(steps)
+    self._positions = {}
+    for position, step in enumerate(self.steps):
+      self._positions.setdefault(step.name, position)
+
+  @classmethod
+  def from_archive(cls, archive_data, pvs=None, compress=True):
+    """Make a StepFrame from data returned by :func:`meme.archive.get`.
+
+    Args:
+      archive_data (dict or list of dicts): The archive data.
+      pvs (list of str, optional): The PV names, in order.  Needed for single-PV
+        data, which doesn't include the name.  By default, every PV in the data is used.
+      compress (bool, optional): See :class:`StepFunction`.
+    """
+    if isinstance(archive_data, dict):
+      step = StepFunction.from_archive(archive_data, pvs[0] if pvs else "value", compress)
+      # The same PV may be listed more than once.
+      return cls([step] * max(len(pvs or ()), 1))
+    data = {item['pvName']: item['value']['value'] for item in archive_data}
+    names = pvs if pvs is not None else list(data)
+    return cls([StepFunction.from_archive(data[name], name, compress) if name in data else StepFunction([], [], name)
+                for name in names])
+
+  @property
+  def names(self):
+    """list of str: The PV names, in order."""
+    return [step.name for step in self.steps]
+
+  def __getitem__(self, name):
+    return self.steps[self._positions[name]]
+
+  def __iter__(self):
+    return iter(self.steps)
+
+  def __len__(self):
+    return len(self.steps)
+
+  def at(self, times):
+    """Get every PV's value at each of some times.
+
+    Args:
+      times (array-like): As for :meth:`StepFunction.at`.
+    Returns:
+      np.ndarray: A float array with shape (len(times), number of PVs).
+    """
+    return self._at_ns(_to_ns(times))
+
+  def _at_ns(self, stamps):
+    values = np.empty((len(stamps), len(self.steps)))
+    for column, step in enumerate(self.steps):
+      values[:, column] = step._at_ns(stamps)
+    return values
+
+  def resample(self, step, start=None, end=None, as_dataframe=False):
+    """Read every PV on a regular time grid.
+
+    Args:
+      step (float): The grid spacing, in seconds.
+      start (datetime or int, optional): The first grid time.  Defaults to the first change of any PV.
+      end (datetime or int, optional): The grid stops before this time.  Defaults to
+        just after the last change of any PV.
+      as_dataframe (bool, optional): Return a pandas.DataFrame indexed on the grid.
+    Returns:
+      tuple: (grid times as int64 nanoseconds since the epoch, float array with shape
+      (len(grid), number of PVs)).  Or a DataFrame, if `as_dataframe` is True.
+    """
+    firsts = [s.times[0] for s in self if len(s)]
+    lasts = [s.times[-1] for s in self if len(s)]
+    start = (min(firsts) if firsts else 0) if start is None else _to_ns([start])[0]
+    end = (max(lasts) + 1 if lasts else start) if end is None else _to_ns([end])[0]
+    grid = np.arange(start, end, int(step * 1e9), dtype=np.int64)
+    values = self._at_ns(grid)
+    if as_dataframe:
+      return self._frame(grid, values)
+    return grid, values
+
+  def to_dataframe(self):
+    """Build the full table: every PV at every change time of any PV.
+
+    This is the dense form :func:`meme.archive.convert_to_dataframe` makes, and can
+    be very large when fast and slow PVs are mixed.  Unlike that function, values
+    are only carried forward: times before a PV's first change are NaN.
+
+    Returns:
+      pandas.DataFrame: Indexed on timestamp, with a column for each PV.
+    """
+    times = [s.times for s in self]
+    grid = np.unique(np.concatenate(times)) if times else np.empty(0, dtype=np.int64)
+    return self._frame(grid, self._at_ns(grid))
+
+  def _frame(self, grid, values):
+    import pandas as pd
+    from .archive import local_time_zone
+    index = pd.DatetimeIndex(grid.view("datetime64[ns]")).tz_localize("UTC").tz_convert(local_time_zone)
+    return pd.DataFrame(values, index=index, columns=self.names)
+
+  def __repr__(self):
+    return "StepFrame(names={!r})".format(self.names)
+
+def _to_ns(times):
+  times = np.asarray(times) if not hasattr(times, "dtype") else times
+  # pandas extension dtypes (like datetime64[ns, UTC]) aren't numpy dtypes.
+  if isinstance(times.dtype, np.dtype) and np.issubdtype(times.dtype, np.integer):
+    return np.asarray(times, dtype=np.int64)
+  from .archive import _utc_index
+  return _utc_index(times).asi8
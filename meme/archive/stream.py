@@ -0,0 +1,186 @@
+"""Archive history followed by live updates, for PVs that are watched over time."""
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pytz
+from ..context import get_context
+from . import archive
+from .timeseries import TimeSeries
+
+class ArchiveStream(object):
+  """Backfills recent history for some PVs from the archive, then follows them with live monitors.
+
+  The monitors are started before the history is fetched, and updates that arrive
+  during the backfill are held back.  Once the history is in, any update at or
+  before the last archived sample for its PV is dropped, so the stream has no gap
+  and no duplicate at the handoff.  After that, the archive is never asked again.
+
+  Each PV keeps its most recent `buffer_size` samples in a ring buffer (see
+  :meth:`latest`).  :meth:`chunks` yields the new samples as they arrive.
+
+  .. code-block:: python
+
+    with ArchiveStream(["BPMS:LI24:801:X", "BPMS:LI24:801:Y"], backfill=3600) as stream:
+      for pv, times, values in stream.chunks():
+        update_plot(pv, times, values)
+
+  Args:
+    pvs (str or list of str): The PV(s) to stream.
+    backfill (float, datetime, or str, optional): How much history to start with.
+      Either a number of seconds before now, or a `from_time` for :func:`meme.archive.get`.
+      Defaults to one hour.
+    buffer_size (int, optional): The number of samples kept for each PV.  Older
+      samples are dropped, from the ring buffer and from chunks not yet read.
+    timeout (float, optional): The timeout for the backfill request.  See :func:`meme.archive.get`.
+    start (bool, optional): Start streaming right away.  If False, call :meth:`start` later.
+  """
+  def __init__(self, pvs, backfill=3600.0, buffer_size=100000, timeout=None, start=True):
+    if isinstance(pvs, str):
+      pvs = [pvs]
+    self.pvs = list(pvs)
+    self.backfill = backfill
+    self.buffer_size = buffer_size
+    self.timeout = timeout
+    self.boundary = {}
+    self._buffers = {pv: TimeSeries(pv, buffer_size) for pv in self.pvs}
+    self._unread = {pv: TimeSeries(pv, buffer_size) for pv in self.pvs}
+    self._held = {pv: [] for pv in self.pvs}
+    self._subscriptions = []
+    self._changed = threading.Condition()
+    self._backfilled = False
+    self._closed = False
+    if start:
+      self.start()
+
+  def start(self):
+    """Start the monitors, then fetch the history."""
+    ctx = get_context()
+    for pv in self.pvs:
+      self._subscriptions.append(ctx.monitor(pv, self._make_callback(pv), notify_disconnect=True))
+    if isinstance(self.backfill, (int, float)):
+      from_time = datetime.now(pytz.utc) - timedelta(seconds=self.backfill)
+    else:
+      from_time = self.backfill
+    try:
+      history = archive.get(self.pvs, from_time=from_time, to_time=datetime.now(pytz.utc), timeout=self.timeout, fields=['values'])
+    except Exception:
+      self.close()
+      raise
+    with self._changed:
+      for pv, (stamps, values) in zip(self.pvs, archive._samples_by_pv(history, self.pvs)):
+        self._add(pv, stamps, values)
+        self.boundary[pv] = int(stamps[-1]) if len(stamps) else -1
+        held, self._held[pv] = self._held[pv], None
+        self._add(pv, *_to_arrays(held))
+      self._backfilled = True
+      self._changed.notify_all()
+
+  def _make_callback(self, pv):
+    def callback(update):
+      if isinstance(update, Exception):
+        # Disconnects and errors don't add samples.  The monitor keeps trying to reconnect.
+        return
+      sample = _sample_from_update(update)
+      with self._changed:
+        if not self._backfilled:
+          self._held[pv].append(sample)
+          return
+        buffer = self._buffers[pv]
+        if sample[0] > (buffer.times[-1] if len(buffer) else self.boundary[pv]):
+          buffer.append(*sample)
+          self._unread[pv].append(*sample)
+          self._changed.notify_all()
+    return callback
+
+  def _add(self, pv, times, values):
+    """Add samples (with the lock held), skipping any not newer than the ones before them."""
+    buffer = self._buffers[pv]
+    last = buffer.times[-1] if len(buffer) else self.boundary.get(pv, -1)
+    previous = np.maximum.accumulate(np.concatenate(([last], times)))[:-1]
+    newer = times > previous
+    buffer.extend(times[newer], values[newer])
+    self._unread[pv].extend(times[newer], values[newer])
+
+  def latest(self, pv, as_timeseries=False):
+    """Get a copy of the samples in a PV's ring buffer.
+
+    Args:
+      pv (str): The PV.
+      as_timeseries (bool, optional): Return a :class:`meme.archive.TimeSeries`.
+    Returns:
+      tuple: (times, values), as an int64 array of nanoseconds since the epoch (UTC)
+      and a float array, oldest first.  Or a TimeSeries, if `as_timeseries` is True.
+    """
+    with self._changed:
+      buffer = self._buffers[pv]
+      times, values = buffer.times.copy(), buffer.values.copy()
+    if as_timeseries:
+      return TimeSeries(pv, None, times, values)
+    return times, values
+
+  def chunks(self, timeout=None, as_timeseries=False):
+    """Yield new samples as they arrive.
+
+    The first chunk for each PV is its backfilled history.  After that, each chunk
+    has whatever arrived since the last one was read.
+
+    Args:
+      timeout (float, optional): Stop after this many seconds with no new data.
+        By default, this keeps going until the stream is closed (and everything
+        already received has been yielded).
+      as_timeseries (bool, optional): Yield (pv, :class:`meme.archive.TimeSeries`) pairs.
+    Yields:
+      tuple: (pv, times, values), with times and values as in :meth:`latest`.
+    """
+    while True:
+      with self._changed:
+        self._changed.wait_for(lambda: self._closed or any(len(unread) for unread in self._unread.values()), timeout=timeout)
+        chunks = []
+        for pv in self.pvs:
+          unread = self._unread[pv]
+          if len(unread):
+            chunks.append((pv, unread.times.copy(), unread.values.copy()))
+            unread.clear()
+      if not chunks:
+        return
+      for pv, times, values in chunks:
+        if as_timeseries:
+          yield pv, TimeSeries(pv, None, times, values)
+        else:
+          yield pv, times, values
+
+  def close(self):
+    """Stop the monitors.  The buffers can still be read."""
+    subscriptions, self._subscriptions = self._subscriptions, []
+    for subscription in subscriptions:
+      subscription.close()
+    with self._changed:
+      self._closed = True
+      self._changed.notify_all()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+    return False
+
+def _sample_from_update(update):
+  """Get (nanoseconds since the epoch, value) from a monitor update."""
+  if hasattr(update, "raw_stamp"):
+    seconds, nanoseconds = update.raw_stamp
+    value = float(update)
+  else:
+    seconds = update.get('timeStamp.secondsPastEpoch', 0)
+    nanoseconds = update.get('timeStamp.nanoseconds', 0)
+    value = float(update['value'])
+  if seconds == 0 and nanoseconds == 0:
+    # No timestamp from the server, so use the time it arrived.
+    return time.time_ns(), value
+  return seconds * 1000000000 + nanoseconds, value
+
+def _to_arrays(samples):
+  times = np.fromiter((sample[0] for sample in samples), dtype=np.int64, count=len(samples))
+  values = np.fromiter((sample[1] for sample in samples), dtype=np.float64, count=len(samples))
+  return times, values
@@ -0,0 +1,239 @@
+"""Summary statistics over long archive ranges, computed chunk by chunk."""
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import numpy as np
+from . import archive
+
+class Moments(object):
+  """Count, mean, variance, min, and max of a stream of values (Welford's method).
+
+  Moments from separate parts of a stream can be combined with :meth:`merge`.
+  """
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.min = math.inf
+    self.max = -math.inf
+
+  def update(self, values):
+    """Add an array of values.  NaNs are skipped."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+      return
+    other = Moments()
+    other.count = len(values)
+    other.mean = float(values.mean())
+    other.m2 = float(((values - other.mean) ** 2).sum())
+    other.min = float(values.min())
+    other.max = float(values.max())
+    self.merge(other)
+
+  def merge(self, other):
+    """Add the values summarized by another Moments (Chan et al.'s parallel update)."""
+    if other.count == 0:
+      return self
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta * other.count / count
+    self.m2 += other.m2 + delta * delta * self.count * other.count / count
+    self.count = count
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    return self
+
+  @property
+  def variance(self):
+    """The sample variance, or NaN if there are fewer than two values."""
+    return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+  @property
+  def std(self):
+    """The sample standard deviation."""
+    return math.sqrt(self.variance)
+
+class QuantileSketch(object):
+  """An approximate quantile sketch (KLL), which uses memory that doesn't grow with the data.
+
+  The rank error is about 1.7 / k (roughly 1% with the default k=200).  Sketches
+  from separate parts of a stream can be combined with :meth:`merge`.
+
+  Args:
+    k (int, optional): The size parameter.  Bigger is more accurate, and uses more memory.
+    seed (int, optional): Seed for the random choices made while compacting.
+  """
+  def __init__(self, k=200, seed=None):
+    self.k = k
+    self.count = 0
+    self.levels = [np.empty(0)]
+    self._rng = np.random.default_rng(seed)
+
+  def _capacity(self, level):
+    return max(int(math.ceil(self.k * (2.0 / 3.0) ** (len(self.levels) - level - 1))), 2)
+
+  def update(self, values):
+    """Add an array of values.  NaNs are skipped."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    self.count += len(values)
+    self.levels[0] = np.concatenate((self.levels[0], values))
+    self._compress()
+
+  def merge(self, other):
+    """Add the values summarized by another sketch."""
+    while len(self.levels) < len(other.levels):
+      self.levels.append(np.empty(0))
+    for level, items in enumerate(other.levels):
+      self.levels[level] = np.concatenate((self.levels[level], items))
+    self.count += other.count
+    self._compress()
+    return self
+
+  def _compress(self):
+    level = 0
+    while level < len(self.levels):
+      items = self.levels[level]
+      if len(items) > self._capacity(level):
+        if level + 1 == len(self.levels):
+          self.levels.append(np.empty(0))
+        items = np.sort(items)
+        # Keep one item back if there's an odd number, then promote every other item.
+        keep = items[-1:] if len(items) % 2 else items[:0]
+        paired = items[:len(items) - len(keep)]
+        promoted = paired[self._rng.integers(2)::2]
+        self.levels[level] = keep
+        self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+      level += 1
+
+  def quantiles(self, qs):
+    """Get approximate quantiles.
+
+    Args:
+      qs (list of float): The quantiles to get, each between 0 and 1.
+    Returns:
+      np.ndarray: The value at each quantile (NaN if the sketch is empty).
+    """
+    items = np.concatenate(self.levels)
+    if len(items) == 0:
+      return np.full(len(qs), np.nan)
+    weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+    order = np.argsort(items, kind="stable")
+    items, cumulative = items[order], np.cumsum(weights[order])
+    ranks = np.asarray(qs, dtype=np.float64) * cumulative[-1]
+    return items[np.minimum(np.searchsorted(cumulative, ranks, side="left"), len(items) - 1)]
+
+class _PVSummary(object):
+  """Everything accumulated for one PV."""
+  def __init__(self, k, seed):
+    self.moments = Moments()
+    self.sketch = QuantileSketch(k, seed)
+    self.weighted_sum = 0.0
+    self.covered = 0
+    self.above = 0
+
+  def update(self, times, values, start, end, threshold):
+    # Archived values are "on change", so each one holds until the next sample.
+    # The last sample before the chunk (if there is one) covers the start of it.
+    inside = times >= start
+    self.moments.update(values[inside])
+    self.sketch.update(values[inside])
+    if len(times) == 0:
+      return
+    begins = np.maximum(times, start)
+    durations = np.diff(np.append(begins, end))
+    valid = ~np.isnan(values)
+    self.weighted_sum += float(np.dot(values[valid], durations[valid]) / 1e9)
+    self.covered += int(durations[valid].sum())
+    self.above += int(durations[valid & (values > threshold)].sum())
+
+  def merge(self, other):
+    self.moments.merge(other.moments)
+    self.sketch.merge(other.sketch)
+    self.weighted_sum += other.weighted_sum
+    self.covered += other.covered
+    self.above += other.above
+
+  def result(self, quantiles):
+    covered = self.covered / 1e9
+    return {"count": self.moments.count,
+            "mean": self.moments.mean if self.moments.count else math.nan,
+            "std": self.moments.std,
+            "min": self.moments.min if self.moments.count else math.nan,
+            "max": self.moments.max if self.moments.count else math.nan,
+            "quantiles": dict(zip(quantiles, self.sketch.quantiles(quantiles).tolist())),
+            "time_weighted_mean": self.weighted_sum / covered if covered else math.nan,
+            "duty_cycle": self.above / self.covered if self.covered else math.nan,
+            "covered_seconds": covered}
+
+def _summarize_chunk(pvs, start, end, timeout, threshold, k, seed):
+  data = archive._fetch_range(pvs, start, end, ['values'], timeout, previous=True)
+  summaries = {}
+  for pv, pv_data in data.items():
+    summaries[pv] = _PVSummary(k, seed)
+    summaries[pv].update(pv_data['time'], pv_data['values'], start, end, threshold)
+  return summaries
+
+def stats(pvs, from_time, to_time, chunk=timedelta(days=1), pvs_per_chunk=50, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95),
+          threshold=0.0, timeout=None, max_workers=4, k=200, seed=None):
+  """Get summary statistics for PVs over a long time range, without loading it all at once.
+
+  The range is fetched in (time chunk, PV group) pieces, up to `max_workers` at a
+  time.  Each piece is reduced to small, mergeable summaries, then thrown away, so
+  memory use doesn't depend on how long the range is.
+
+  .. code-block:: python
+
+    s = meme.archive.stats(["BPMS:LI24:801:X"], datetime(2024, 1, 1), datetime(2025, 1, 1))
+    s["BPMS:LI24:801:X"]["quantiles"][0.95]
+
+  Args:
+    pvs (str or list of str): The PV(s) to summarize.
+    from_time (datetime): The start of the range.  Without a timezone, 'US/Pacific' is implied.
+    to_time (datetime): The end of the range.
+    chunk (timedelta or float, optional): The length of each time chunk (a float is
+      in seconds).  Defaults to one day.
+    pvs_per_chunk (int, optional): The number of PVs fetched in each request.
+    quantiles (list of float, optional): The quantiles to estimate.
+    threshold (float, optional): The duty cycle is the fraction of the time that a
+      PV's value is above this.  Defaults to 0.
+    timeout (float, optional): The timeout for each chunk's request.  See :func:`meme.archive.get`.
+    max_workers (int, optional): The most chunks to fetch at the same time.
+    k (int, optional): The quantile sketch size.  See :class:`QuantileSketch`.
+    seed (int, optional): Seed for the quantile sketch, for repeatable results.
+  Returns:
+    dict: {pv: summary} for each PV with data.  Each summary is a dict with:
+
+    * `count`, `mean`, `std`, `min`, `max`: Over the archived samples in the range.
+    * `quantiles` (dict): {quantile: approximate value}.
+    * `time_weighted_mean`: The mean of the value over time, treating each
+      sample as holding until the next one.  The value from before the range
+      (if the archive has one) covers the start of it.
+    * `duty_cycle`: The fraction of the time that the value was above `threshold`.
+    * `covered_seconds`: The time with a known value.
+  """
+  if isinstance(pvs, str):
+    pvs = [pvs]
+  quantiles = list(quantiles)
+  times, _ = archive._chunk_bounds(from_time, to_time, chunk)
+  groups = [pvs[i:i + pvs_per_chunk] for i in range(0, len(pvs), pvs_per_chunk)]
+  tasks = [(t, group) for t in range(len(times) - 1) for group in groups]
+  totals = {}
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    # Keep at most max_workers chunks in flight, so memory stays bounded.
+    pending = []
+    for t, group in tasks:
+      pending.append(executor.submit(_summarize_chunk, group, times[t], times[t + 1], timeout, threshold, k, seed))
+      if len(pending) >= max_workers:
+        _merge_into(totals, pending.pop(0).result())
+    for future in pending:
+      _merge_into(totals, future.result())
+  return {pv: totals[pv].result(quantiles) for pv in pvs if pv in totals}
+
+def _merge_into(totals, summaries):
+  for pv, summary in summaries.items():
+    if pv in totals:
+      totals[pv].merge(summary)
+    else:
+      totals[pv] = summary
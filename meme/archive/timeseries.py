@@ -0,0 +1,156 @@
+"""A compact, appendable time series for one PV."""
+import numpy as np
+
+class TimeSeries(object):
+  """Times and values for one PV, in preallocated int64 and float64 arrays.
+
+  Times are integer nanoseconds since the epoch (UTC).  Appending is amortized
+  O(1).  With a `capacity`, the series is a ring buffer which keeps only the
+  newest `capacity` samples.  The ring is stored twice over, so the samples are
+  always contiguous: :attr:`times`, :attr:`values`, :meth:`window`, and
+  :meth:`to_series` share the buffer, instead of copying it.
+
+  .. code-block:: python
+
+    ts = meme.archive.get("BPMS:LI24:801:X", from_time="1 hour ago", as_timeseries=True)
+    ts.window(start_ns, end_ns).to_series().plot()
+
+  Args:
+    name (str, optional): The PV name.
+    capacity (int, optional): The most samples to keep.  By default, there is no limit.
+    times (array-like of int, optional): Initial times, in nanoseconds since the epoch.
+    values (array-like of float, optional): Initial values.
+  """
+  def __init__(self, name=None, capacity=None, times=None, values=None):
+    if capacity is not None and capacity < 1:
+      raise ValueError("capacity must be at least 1.")
+    self.name = name
+    self.capacity = capacity
+    size = 2 * capacity if capacity is not None else 16
+    self._times = np.zeros(size, dtype=np.int64)
+    self._values = np.zeros(size, dtype=np.float64)
+    self._start = 0
+    self._len = 0
+    if times is not None:
+      self.extend(times, values)
+
+  @classmethod
+  def from_archive(cls, archive_data, name=None, capacity=None):
+    """Make a TimeSeries from data for one PV, as returned by :func:`meme.archive.get`."""
+    times = np.asarray(archive_data['secondsPastEpoch'], dtype=np.int64) * 1000000000 + np.asarray(archive_data['nanoseconds'], dtype=np.int64)
+    return cls(name, capacity, times, archive_data['values'])
+
+  def __len__(self):
+    return self._len
+
+  @property
+  def times(self):
+    """int64 array: The sample times, in nanoseconds since the epoch.  A view into the buffer."""
+    return self._times[self._start:self._start + self._len]
+
+  @property
+  def values(self):
+    """float64 array: The sample values.  A view into the buffer."""
+    return self._values[self._start:self._start + self._len]
+
+  def append(self, time, value):
+    """Add one sample, which should be newer than the last one."""
+    if self.capacity is None:
+      if self._len == len(self._times):
+        self._grow(self._len + 1)
+      self._times[self._len] = time
+      self._values[self._len] = value
+      self._len += 1
+      return
+    # Write each sample at position i and i + capacity.  The newest `capacity`
+    # samples are then always in one contiguous block ending at i + capacity.
+    i = (self._start + self._len) % self.capacity
+    self._times[i] = self._times[i + self.capacity] = time
+    self._values[i] = self._values[i + self.capacity] = value
+    if self._len < self.capacity:
+      self._len += 1
+    self._start = (i + 1) % self.capacity + self.capacity - self._len
+
+  def extend(self, times, values):
+    """Add many samples, which should be newer than the last one."""
+    times = np.asarray(times, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(times) != len(values):
+      raise ValueError("times and values must be the same length.")
+    if len(times) == 0:
+      return
+    if self.capacity is None:
+      if self._len + len(times) > len(self._times):
+        self._grow(self._len + len(times))
+      self._times[self._len:self._len + len(times)] = times
+      self._values[self._len:self._len + len(values)] = values
+      self._len += len(times)
+      return
+    times, values = times[-self.capacity:], values[-self.capacity:]
+    first = (self._start + self._len) % self.capacity
+    positions = (first + np.arange(len(times))) % self.capacity
+    self._times[positions] = self._times[positions + self.capacity] = times
+    self._values[positions] = self._values[positions + self.capacity] = values
+    self._len = min(self._len + len(times), self.capacity)
+    self._start = (positions[-1] + 1) % self.capacity + self.capacity - self._len
+
+  def _grow(self, needed):
+    size = max(needed, 2 * len(self._times))
+    for attr in ("_times", "_values"):
+      array = np.zeros(size, dtype=getattr(self, attr).dtype)
+      array[:self._len] = getattr(self, attr)[:self._len]
+      setattr(self, attr, array)
+
+  def clear(self):
+    """Remove every sample.  The buffer is kept."""
+    self._start = self.capacity if self.capacity is not None else 0
+    self._len = 0
+
+  def window(self, start=None, end=None):
+    """Get the samples with start <= time < end.
+
+    Args:
+      start (int, optional): The start time, in nanoseconds since the epoch.
+        Defaults to the first sample.
+      end (int, optional): The end time (not included).  Defaults to after the last sample.
+    Returns:
+      TimeSeries: A series which shares its data with this one.  It is only valid
+      until this series is appended to.
+    """
+    times = self.times
+    first = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+    last = len(times) if end is None else int(np.searchsorted(times, end, side="left"))
+    return self._view(first, last)
+
+  def last(self, n):
+    """Get the newest `n` samples, as a view like :meth:`window`."""
+    return self._view(max(self._len - n, 0), self._len)
+
+  def _view(self, first, last):
+    view = TimeSeries.__new__(TimeSeries)
+    view.name = self.name
+    view.capacity = None
+    view._times = self.times[first:last]
+    view._values = self.values[first:last]
+    view._start = 0
+    view._len = max(last - first, 0)
+    return view
+
+  def to_series(self, tz=None):
+    """Get the samples as a pandas.Series, without copying them.
+
+    Args:
+      tz (str or tzinfo, optional): Give the index this timezone.  By default the
+        index is naive UTC time, which shares its data with this series.  With a
+        timezone, pandas copies the index (but not the values).
+    Returns:
+      pandas.Series: The values, indexed by sample time.
+    """
+    import pandas as pd
+    index = pd.DatetimeIndex(self.times.view("datetime64[ns]"), copy=False)
+    if tz is not None:
+      index = index.tz_localize("UTC").tz_convert(tz)
+    return pd.Series(self.values, index=index, name=self.name, copy=False)
+
+  def __repr__(self):
+    return "TimeSeries(name={!r}, len={}, capacity={})".format(self.name, self._len, self.capacity)
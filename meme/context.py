@@ -0,0 +1,114 @@
+"""Shared PVA client contexts for all of the meme service modules.
+
+Every meme submodule talks to its service through a p4p client Context.  Rather
+than each module making its own Context at import time, they all ask this module
+for one, and the Contexts are only created the first time a request is made.
+"""
+import atexit
+import threading
+from p4p.client import thread
+from p4p.client.thread import Context
+
+# Patch p4p close with Python 2.7
+# For more details see: https://github.com/mdavidsaver/p4p/issues/55
+_p4p_thread_context_close = thread.Context.close
+
+def _close(*args, **kwargs):
+    try:
+        _p4p_thread_context_close(*args, **kwargs)
+    except TypeError:
+        pass
+
+thread.Context.close = _close
+
+class ContextPool(object):
+    """A lazily-created pool of p4p client Contexts.
+
+    Contexts are created on demand, up to `max_contexts` of them, and handed
+    out in round-robin order.  Most programs only need one Context (the default),
+    but heavily multi-threaded programs can spread their requests across a few.
+
+    Args:
+      provider (str, optional): The p4p provider to use.  Defaults to 'pva'.
+      max_contexts (int, optional): The maximum number of Contexts to create.
+        Defaults to 1.
+      factory (callable, optional): Called with the provider name and any
+        extra keyword arguments to make a new Context.  Defaults to
+        :class:`p4p.client.thread.Context`.
+      **context_kws: Extra keyword arguments passed to the factory, like
+        `conf` or `maxsize`.
+    """
+    def __init__(self, provider='pva', max_contexts=1, factory=None, **context_kws):
+        if max_contexts < 1:
+            raise ValueError("max_contexts must be at least 1.")
+        self._lock = threading.Lock()
+        self._contexts = []
+        self._next = 0
+        self.provider = provider
+        self.max_contexts = max_contexts
+        self.factory = factory
+        self.context_kws = context_kws
+
+    def configure(self, provider=None, max_contexts=None, factory=None, **context_kws):
+        """Change the pool settings.  Any existing Contexts are closed first.
+
+        Takes the same arguments as :class:`ContextPool`.  Arguments which are
+        not given keep their current values.
+        """
+        if max_contexts is not None and max_contexts < 1:
+            raise ValueError("max_contexts must be at least 1.")
+        self.close()
+        with self._lock:
+            if provider is not None:
+                self.provider = provider
+            if max_contexts is not None:
+                self.max_contexts = max_contexts
+            if factory is not None:
+                self.factory = factory
+            self.context_kws.update(context_kws)
+
+    def get(self):
+        """Get a Context from the pool, creating it if needed."""
+        with self._lock:
+            if len(self._contexts) < self.max_contexts:
+                factory = Context if self.factory is None else self.factory
+                self._contexts.append(factory(self.provider, **self.context_kws))
+                return self._contexts[-1]
+            ctx = self._contexts[self._next % len(self._contexts)]
+            self._next += 1
+            return ctx
+
+    def close(self):
+        """Close all the Contexts in the pool.  New ones are made if the pool is used again."""
+        with self._lock:
+            contexts, self._contexts = self._contexts, []
+            self._next = 0
+        for ctx in contexts:
+            ctx.close()
+
+    def __len__(self):
+        return len(self._contexts)
+
+class SharedContextAttribute(object):
+    """A class attribute which gets its Context from the shared pool on every access.
+
+    Lets classes keep a `ctx` attribute (like :attr:`meme.model.Model.ctx`)
+    without creating a Context when the class is defined.
+    """
+    def __get__(self, obj, owner=None):
+        return get_context()
+
+_pool = ContextPool()
+atexit.register(_pool.close)
+
+def get_context():
+    """Get a Context from the shared pool used by all meme submodules."""
+    return _pool.get()
+
+def configure(provider=None, max_contexts=None, factory=None, **context_kws):
+    """Configure the shared Context pool.  See :class:`ContextPool` for the arguments."""
+    _pool.configure(provider=provider, max_contexts=max_contexts, factory=factory, **context_kws)
+
+def close():
+    """Close all the shared Contexts.  They are re-created if meme is used again."""
+    _pool.close()
@@ -0,0 +1,210 @@
+"""Drive many concurrent meme clients at the MEME services, and measure them.
+
+Each simulated client is a thread which makes requests through the normal meme
+API (:mod:`meme.archive`, :mod:`meme.names`, and :class:`meme.model.Model`)
+one after another, taking turns through the operations asked for.  Every
+request is timed, and the run is summarized as throughput and latency
+percentiles for each operation.
+
+Aim it at a :class:`meme.replay.ReplayServer` to load-test meme itself, or at a
+:class:`meme.proxy.CachingProxy` to see what it saves:
+
+.. code-block:: bash
+
+  meme-loadgen --address localhost:5095 --clients 32 --duration 60 \\
+    --pv BPMS:LI24:801:X --from "1 hour ago" --pattern "BPMS:%:X" --model CU_HXR --device QE01
+
+The same run, with `--record session.rec` and no `--address`, records the real
+services' answers for :mod:`meme.replay`.  Add `--replay` when running against a
+replay server: it answers model gets without the model service's latency, so the
+'model' operation's latencies are left out of the report.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import numpy as np
+from . import context
+
+percentiles = (50, 90, 99)
+
+class LoadReport(object):
+    """The results of a :func:`run`.
+
+    Attributes:
+      duration (float): The length of the run, in seconds.
+      clients (int): The number of simulated clients.
+      latencies (dict): For each operation, a list of (seconds, ok) for every request.
+      untimed (set of str): Operations whose latencies don't mean anything (like
+        'model', against a replay server).  They are counted, but their latency
+        statistics are NaN, and they are left out of the total's (but still counted in it).
+    """
+    def __init__(self, duration, clients, latencies, untimed=()):
+        self.duration = duration
+        self.clients = clients
+        self.latencies = latencies
+        self.untimed = set(untimed)
+
+    def summary(self):
+        """Get a row of statistics for each operation, and one for all of them ('total').
+
+        Returns:
+          list of dict: Each with `operation`, `requests`, `errors`, `throughput`
+          (completed requests per second), `mean`, and `p50`, `p90`, and `p99`
+          (latencies in seconds, of the requests without errors).
+        """
+        rows = [self._row(name, samples, [] if name in self.untimed else samples) for name, samples in self.latencies.items()]
+        timed = [samples for name, samples in self.latencies.items() if name not in self.untimed]
+        rows.append(self._row("total", list(itertools.chain.from_iterable(self.latencies.values())),
+                              list(itertools.chain.from_iterable(timed))))
+        return rows
+
+    def _row(self, name, samples, timed_samples):
+        completed = sum(1 for _, ok in samples if ok)
+        row = {"operation": name, "requests": len(samples), "errors": len(samples) - completed,
+               "throughput": completed / self.duration if self.duration else 0.0}
+        seconds = np.array([s for s, ok in timed_samples if ok])
+        row["mean"] = float(seconds.mean()) if len(seconds) else float("nan")
+        for p in percentiles:
+            row["p{}".format(p)] = float(np.percentile(seconds, p)) if len(seconds) else float("nan")
+        return row
+
+    def format(self):
+        """The summary as a text table, with latencies in milliseconds."""
+        lines = ["{} clients, {:.1f} s".format(self.clients, self.duration),
+                 "{:<12}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format("operation", "requests", "errors", "req/s", "mean ms", "p50 ms", "p90 ms", "p99 ms")]
+        for row in self.summary():
+            lines.append("{:<12}{:>10}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                row["operation"], row["requests"], row["errors"], row["throughput"],
+                row["mean"] * 1000, row["p50"] * 1000, row["p90"] * 1000, row["p99"] * 1000))
+        return "\n".join(lines)
+
+def make_operations(pvs=None, from_time=None, to_time=None, pattern=None, model=None, devices=None, use_design=False):
+    """Make the operations for :func:`run`, from what there is to ask for.
+
+    Only the operations with everything they need are made.
+
+    Args:
+      pvs (list of str, optional): PVs for 'archive': :func:`meme.archive.get` of them.
+      from_time, to_time (str or datetime, optional): The range for 'archive'.
+      pattern (str, optional): A pattern for 'names': :func:`meme.names.list_pvs`.
+      model (str, optional): A model name for 'model': a new :class:`meme.model.Model`
+        (which gets the full R-matrix and Twiss tables), then an R-matrix lookup
+        if `devices` are given.
+      devices (list of str, optional): Devices for the 'model' R-matrix lookup.
+      use_design (bool, optional): Use the design model instead of the live one.
+    Returns:
+      dict: {operation name: function with no arguments}.
+    """
+    operations = {}
+    if pvs:
+        import meme.archive
+        pv = pvs[0] if len(pvs) == 1 else list(pvs)
+        operations["archive"] = lambda: meme.archive.get(pv, from_time=from_time, to_time=to_time)
+    if pattern:
+        import meme.names
+        operations["names"] = lambda: meme.names.list_pvs(pattern)
+    if model:
+        from meme.model import Model
+        def model_operation():
+            m = Model(model, use_design=use_design)
+            if devices:
+                m.get_rmat(list(devices))
+        operations["model"] = model_operation
+    return operations
+
+def run(operations, clients=8, duration=10.0, requests=None, untimed=()):
+    """Run simulated clients, and time every request.
+
+    Each client takes turns through `operations`, starting from a different one
+    than its neighbours, so every operation is always in progress.  Errors are
+    counted, and the client carries on.
+
+    Args:
+      operations (dict): {name: function with no arguments}, like from :func:`make_operations`.
+      clients (int, optional): The number of concurrent clients.
+      duration (float, optional): How long (in seconds) to run.
+      requests (int, optional): Stop each client after this many requests instead.
+      untimed (list of str, optional): Operations to leave out of the latency
+        statistics.  See :class:`LoadReport`.
+    Returns:
+      LoadReport: The results.
+    """
+    if not operations:
+        raise ValueError("There are no operations to run.")
+    names = list(operations)
+    latencies = {name: [] for name in names}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def client(index):
+        samples = []
+        for count in itertools.count():
+            if stop.is_set() or (requests is not None and count >= requests):
+                break
+            name = names[(index + count) % len(names)]
+            start = time.perf_counter()
+            try:
+                operations[name]()
+                ok = True
+            except Exception:
+                ok = False
+            samples.append((name, time.perf_counter() - start, ok))
+        with lock:
+            for name, seconds, ok in samples:
+                latencies[name].append((seconds, ok))
+
+    threads = [threading.Thread(target=client, args=(i,), name="meme-loadgen-{}".format(i), daemon=True) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    if requests is None:
+        stop.wait(duration)
+        stop.set()
+    for thread in threads:
+        thread.join()
+    return LoadReport(time.perf_counter() - start, clients, latencies, untimed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run concurrent simulated meme clients, and report throughput and latency.")
+    parser.add_argument("--clients", type=int, default=8, help="The number of concurrent clients.")
+    parser.add_argument("--duration", type=float, default=10.0, help="How long to run, in seconds.")
+    parser.add_argument("--requests", type=int, help="Stop each client after this many requests, instead of after --duration.")
+    parser.add_argument("--pv", action="append", help="A PV for the archive operation.  Can be given more than once.")
+    parser.add_argument("--from", dest="from_time", default="1 hour ago", help="The start time for the archive operation.")
+    parser.add_argument("--to", dest="to_time", default="now", help="The end time for the archive operation.")
+    parser.add_argument("--pattern", help="A name pattern for the names operation, like 'BPMS:%%:X'.")
+    parser.add_argument("--model", help="A model name for the model operation, like CU_HXR.")
+    parser.add_argument("--device", action="append", help="A device for the model operation's R-matrix lookup.  Can be given more than once.")
+    parser.add_argument("--design", action="store_true", help="Use the design model.")
+    parser.add_argument("--address", action="append",
+                        help="An address (host or host:port) to find the services at.  Defaults to the EPICS_PVA_* environment variables.")
+    parser.add_argument("--contexts", type=int, help="The number of shared client Contexts.  See meme.context.")
+    parser.add_argument("--record", help="Record every response to this file, for meme-replay.")
+    parser.add_argument("--replay", action="store_true",
+                        help="The services are a meme-replay server, which answers model gets at once: leave out the model latencies.")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    args = parser.parse_args(argv)
+    operations = make_operations(pvs=args.pv, from_time=args.from_time, to_time=args.to_time, pattern=args.pattern,
+                                 model=args.model, devices=args.device, use_design=args.design)
+    if not operations:
+        parser.error("Give at least one of --pv, --pattern, or --model.")
+    context_kws = {}
+    if args.address:
+        context_kws = {"conf": {"EPICS_PVA_ADDR_LIST": " ".join(args.address), "EPICS_PVA_AUTO_ADDR_LIST": "NO"}, "useenv": False}
+    context.configure(max_contexts=args.contexts, **context_kws)
+    untimed = ["model"] if args.replay else []
+    if args.record:
+        from .replay import record
+        with record(args.record):
+            report = run(operations, args.clients, args.duration, args.requests, untimed)
+    else:
+        report = run(operations, args.clients, args.duration, args.requests, untimed)
+    if args.json:
+        print(json.dumps({"duration": report.duration, "clients": report.clients, "operations": report.summary()}, indent=2))
+    else:
+        print(report.format())
+
+if __name__ == "__main__":
+    main()
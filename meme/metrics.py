@@ -0,0 +1,216 @@
+"""Opt-in timing and payload metrics for the meme service wrappers.
+
+When metrics are enabled, every service call records how long it spent in each
+phase:
+
+* `wait`: Waiting for the service to answer (the RPC or get itself).
+* `decode`: Turning the p4p response into python or numpy data.
+* `convert`: Post-processing, like building a pandas DataFrame.
+* `total`: The whole call.
+
+Payload sizes (rows and bytes) and cache hit/miss counts are recorded too.
+Metrics are off by default, and cost almost nothing while they are off.
+
+.. code-block:: python
+
+  import meme.metrics
+  meme.metrics.enable()
+  # ... use meme ...
+  meme.metrics.snapshot()       # A dict of everything recorded so far.
+  meme.metrics.to_prometheus()  # The same data in Prometheus text format.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the histogram buckets used for timings.
+buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+enabled = False
+log_events = False
+_lock = threading.Lock()
+_timings = {}
+_payloads = {}
+_cache = {}
+
+class _Timing(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(buckets) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(buckets, seconds)] += 1
+
+    def todict(self):
+        return {"count": self.count, "total": self.total, "min": self.min if self.count else None,
+                "max": self.max, "mean": self.total / self.count if self.count else None,
+                "buckets": dict(zip(buckets + (float("inf"),), self.buckets))}
+
+class _Timer(object):
+    __slots__ = ("operation", "phase", "start")
+
+    def __init__(self, operation, phase):
+        self.operation = operation
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.operation, self.phase, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+def enable(log=False):
+    """Start recording metrics.
+
+    Args:
+      log (bool, optional): Also emit every measurement as a structured log
+        event on the 'meme.metrics' logger.  Each record has a `meme_metric`
+        attribute holding the measurement as a dict.
+    """
+    global enabled, log_events
+    enabled = True
+    log_events = log
+
+def disable():
+    """Stop recording metrics.  Anything already recorded is kept."""
+    global enabled
+    enabled = False
+
+def reset():
+    """Throw away everything recorded so far."""
+    with _lock:
+        _timings.clear()
+        _payloads.clear()
+        _cache.clear()
+
+def timer(operation, phase):
+    """A context manager which records how long its block takes.
+
+    Args:
+      operation (str): What is being timed, like 'hist' or 'model.twiss'.
+      phase (str): Which part of the operation: 'wait', 'decode', 'convert', or 'total'.
+    """
+    if not enabled:
+        return _null_timer
+    return _Timer(operation, phase)
+
+def timed(operation, phase):
+    """A decorator which records how long each call to the decorated function takes.
+
+    Takes the same arguments as :func:`timer`.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Timer(operation, phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _emit(event):
+    if log_events:
+        logger.info("%s", event, extra={"meme_metric": event})
+
+def record(operation, phase, seconds):
+    """Record one timing measurement (in seconds)."""
+    if not enabled:
+        return
+    with _lock:
+        _timings.setdefault((operation, phase), _Timing()).add(seconds)
+    _emit({"type": "timing", "operation": operation, "phase": phase, "seconds": seconds})
+
+def record_payload(operation, rows=None, nbytes=None):
+    """Record the size of one response."""
+    if not enabled:
+        return
+    with _lock:
+        payload = _payloads.setdefault(operation, {"count": 0, "rows": 0, "bytes": 0})
+        payload["count"] += 1
+        payload["rows"] += rows or 0
+        payload["bytes"] += nbytes or 0
+    _emit({"type": "payload", "operation": operation, "rows": rows, "bytes": nbytes})
+
+def record_cache(cache, hit):
+    """Record a hit (or a miss, if `hit` is False) for a cache."""
+    if not enabled:
+        return
+    with _lock:
+        counts = _cache.setdefault(cache, {"hits": 0, "misses": 0})
+        counts["hits" if hit else "misses"] += 1
+    _emit({"type": "cache", "cache": cache, "hit": bool(hit)})
+
+def snapshot():
+    """Get everything recorded so far.
+
+    Returns:
+      dict: A dict with three keys:
+
+      * `timings`: {operation: {phase: {count, total, min, max, mean, buckets}}}
+      * `payloads`: {operation: {count, rows, bytes}}
+      * `cache`: {cache name: {hits, misses}}
+    """
+    with _lock:
+        timings = {}
+        for (operation, phase), timing in _timings.items():
+            timings.setdefault(operation, {})[phase] = timing.todict()
+        return {"timings": timings,
+                "payloads": {op: dict(p) for op, p in _payloads.items()},
+                "cache": {name: dict(c) for name, c in _cache.items()}}
+
+def to_prometheus(prefix="meme"):
+    """Get everything recorded so far, in the Prometheus text exposition format.
+
+    Args:
+      prefix (str, optional): The prefix for every metric name.
+    Returns:
+      str: The metrics, ready to be served at a /metrics endpoint or written to a
+      node-exporter textfile.
+    """
+    data = snapshot()
+    lines = ["# TYPE {}_call_seconds histogram".format(prefix)]
+    for operation, phases in sorted(data["timings"].items()):
+        for phase, timing in sorted(phases.items()):
+            labels = 'operation="{}",phase="{}"'.format(operation, phase)
+            cumulative = 0
+            for bound, count in timing["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append('{}_call_seconds_bucket{{{},le="{}"}} {}'.format(prefix, labels, le, cumulative))
+            lines.append("{}_call_seconds_sum{{{}}} {!r}".format(prefix, labels, timing["total"]))
+            lines.append("{}_call_seconds_count{{{}}} {}".format(prefix, labels, timing["count"]))
+    # In the text format, a counter's TYPE line names the sample exactly, _total included.
+    for unit in ("rows", "bytes"):
+        lines.append("# TYPE {}_payload_{}_total counter".format(prefix, unit))
+        for operation, payload in sorted(data["payloads"].items()):
+            lines.append('{}_payload_{}_total{{operation="{}"}} {}'.format(prefix, unit, operation, payload[unit]))
+    lines.append("# TYPE {}_cache_requests_total counter".format(prefix))
+    for name, counts in sorted(data["cache"].items()):
+        for result, key in (("hit", "hits"), ("miss", "misses")):
+            lines.append('{}_cache_requests_total{{cache="{}",result="{}"}} {}'.format(prefix, name, result, counts[key]))
+    return "\n".join(lines) + "\n"
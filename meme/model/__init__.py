@@ -1 +1,3 @@
-from .model import Model, full_machine_rmats, full_machine_twiss
\ No newline at end of file
+from .model import Model, full_machine_rmats, full_machine_twiss
+from .profiling import ModelProfiler
+from .snapshot import SharedModelSnapshot
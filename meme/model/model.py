@@ -1,8 +1,15 @@
+import ast
 import sys
-from p4p.client.thread import Context
 from p4p.nt import NTTable, NTURI
 import numpy as np
+from functools import partial
 from itertools import cycle
+from ..context import SharedContextAttribute
+from ..singleflight import flights
+from ..policy import get_policy
+from .. import metrics
+from .profiling import ModelProfiler, null_section, profiled
+from . import snapshot
 
 class NumpyNTTable(NTTable):
      # Note: There's a 60 character limit on strings
@@ -39,17 +46,26 @@ class NumpyNTTable(NTTable):
             raise
 
     @staticmethod
-    def unwrap(value):
-        col_names = value.value.keys()
-        if sys.version_info[0] < 3:
-          col_names = [n.encode('utf-8') for n in col_names]
+    @metrics.timed("model", "decode")
+    def unwrap(value, fields=None):
+        """Turn a NTTable into a numpy structured array.
+
+        If `fields` is given, only those columns are decoded (any others the
+        server sent are skipped).
+        """
         # We need to get the dtype info for each column.  This lives in the 
         # following location:
-        col_types = value.type().items()[1][1].items()
+        col_types = value.type()['value'].items()
+        if fields is not None:
+            col_types = [(name, t) for name, t in col_types if name in fields]
+        col_names = [name for name, _ in col_types]
+        if sys.version_info[0] < 3:
+          col_names = [n.encode('utf-8') for n in col_names]
         np_types = [NumpyNTTable.p4p_to_numpy_dtype[t] for _, t in col_types]
-        m = np.zeros(len(value.value.items()[0][1]), dtype=list(zip(col_names, np_types)))
-        for col, val in value.value.items():
-            m[col] = val
+        length = len(value.value[col_types[0][0]]) if col_types else 0
+        m = np.zeros(length, dtype=list(zip(col_names, np_types)))
+        for col, (name, _) in zip(col_names, col_types):
+            m[col] = value.value[name]
         return m
   
     @staticmethod
@@ -82,6 +98,10 @@ class Model(object):
       no_caching (bool, optional): If true, model-data will be re-fetched
         every time it is used.  This ensures you stay in-sync with the current
         model, but makes method calls in this class slower.
+      fields (list of str, optional): Only fetch these Twiss columns (like
+        ['s', 'beta_x', 'beta_y']), to make the Twiss data smaller and faster
+        to fetch.  The device and element names are always fetched.  Methods
+        which need other columns will fail.  By default, every column is fetched.
     
     Examples:
     
@@ -101,9 +121,9 @@ class Model(object):
       m.get_rmat('LI16:XCOR:402')
  
     """
-    ctx = Context('pva')
+    ctx = SharedContextAttribute()
     
-    def __init__(self, model_name, model_source=None, initialize=True, use_design=False, no_caching=False):
+    def __init__(self, model_name, model_source=None, initialize=True, use_design=False, no_caching=False, fields=None):
         self.model_name = str(model_name).upper()
         if self.model_name == "FACET2E" and model_source is None:
             # The only FACET2E model comes from LUCRETIA, so might as well fill that in as a default.
@@ -113,21 +133,92 @@ class Model(object):
         self.model_source = str(model_source).upper()
         self.use_design = use_design
         self.no_caching = no_caching
+        self.fields = fields
         self.rmat_data = None
         self.twiss_data = None
+        self.profiler = None
         if initialize:
             self.refresh_all()
-    
+
+    @property
+    def twiss_data(self):
+        """The full machine Twiss table, as a numpy structured array."""
+        return self._twiss_data
+
+    @twiss_data.setter
+    def twiss_data(self, data):
+        self._twiss_data = data
+        self._name_index = None
+
+    def enable_profiling(self, profiler=None):
+        """Start counting and timing the work done by this Model's methods.
+
+        Args:
+          profiler (ModelProfiler, optional): The profiler to record into.  Pass
+            the same profiler to several Models to combine their data.  A new
+            one is made if this isn't given.
+        Returns:
+          ModelProfiler: The profiler that is recording this Model.
+        """
+        self.profiler = ModelProfiler() if profiler is None else profiler
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stop profiling this Model."""
+        self.profiler = None
+
+    def _profile(self, section):
+        if self.profiler is None:
+            return null_section
+        return self.profiler.section(section)
+
     def _get_indices_for_names(self, names, split_suffix, ignore_bad_names=False):
-        indices = []
         if isinstance(names, str):
             names = [names]
+        if self.profiler is not None:
+            self.profiler.count("name_lookups", len(names))
+        with self._profile("index_resolution"):
+            return self._find_indices(names, split_suffix, ignore_bad_names)
+
+    def _resolve_indices(self, names, split_suffix, ignore_bad_names):
+        """Get one model index per name, looking up each distinct name only once.
+
+        Names that aren't in the model get -1.  A name of None means the first element.
+        """
+        if self.twiss_data is None:
+            self.refresh_twiss_data()
+        distinct = list(dict.fromkeys(name for name in names if name is not None))
+        found = dict(zip(distinct, self._get_indices_for_names(distinct, split_suffix, ignore_bad_names) if distinct else []))
+        found[None] = 0
+        indices = np.empty(len(names), dtype=np.intp)
+        for i, name in enumerate(names):
+            index = found[name]
+            indices[i] = -1 if index is None else index
+        return indices
+
+    def _name_rows(self):
+        """Get {name: list of rows} for every name a device can be looked up by.
+
+        A row can be found by its device name, its element name, or its element
+        name without a '#1' or '#2' split suffix.  The dict is built once for each
+        `twiss_data`, and thrown away whenever `twiss_data` is replaced.
+        """
+        if self._name_index is None:
+            rows = {}
+            for i, (device_name, element) in enumerate(zip(self.twiss_data['device_name'].tolist(), self.twiss_data['element'].tolist())):
+                keys = {device_name, element}
+                if element.endswith(("#1", "#2")):
+                    keys.add(element[:-2])
+                for key in keys:
+                    rows.setdefault(key, []).append(i)
+            self._name_index = rows
+        return self._name_index
+
+    def _find_indices(self, names, split_suffix, ignore_bad_names):
+        name_rows = self._name_rows()
+        indices = []
         for name in names:
-            dev_index = np.asarray(self.twiss_data['device_name'] == name)
-            dev_index = np.logical_or(dev_index, np.asarray(self.twiss_data['element'] == name))
-            dev_index = np.logical_or(dev_index, np.asarray(self.twiss_data['element'] == f"{name}#1"))
-            dev_index = np.logical_or(dev_index, np.asarray(self.twiss_data['element'] == f"{name}#2"))
-            dev_index = dev_index.nonzero()[0] #nonzero always returns a tuple, we always want the first element.
+            dev_index = name_rows.get(name, [])
             num_matching_devices = len(dev_index)
             if num_matching_devices == 0:
                 msg = f"Device with name {name} not found in the machine model."
@@ -156,7 +247,8 @@ class Model(object):
                 raise IndexError(f"Multiple devices matching {name} were found in the model, could not determine which one to use.")
         return indices
     
-    def get_rmat(self, from_device, to_device=[], ignore_bad_names=False, from_device_pos='beg', to_device_pos='end'):
+    @profiled("get_rmat")
+    def get_rmat(self, from_device, to_device=[], ignore_bad_names=False, from_device_pos='beg', to_device_pos='end', executor=None, chunk_size=None):
         """Get 6x6 transfer matrices for one or more devices.
 
         This method operates in a few different modes:
@@ -227,6 +319,14 @@ class Model(object):
             the matrix up to the first half-element, 'end' will calculate
             the matrix up to the second half-element.  This option is ignored
             for non-split elements.
+          executor (concurrent.futures.Executor, optional): Split the matrix
+            products into chunks, and compute them on this executor.  Both thread
+            and process pools work well: numpy releases the GIL for the linear algebra,
+            and each chunk only sends its own matrices to a worker process.  Device
+            names are always looked up in the calling process.  Results come back in
+            the same order as the requested devices.
+          chunk_size (int, optional): The number of matrices in each chunk sent to
+            the executor.  Defaults to 4096.
 
         Returns:
           np.ndarray: An array with shape Nx6x6, where N is the length of from_device
@@ -241,66 +341,33 @@ class Model(object):
         if len(to_device) == 0:
             to_device = list(from_device)
             from_device = [None] # Later, we'll use the first element in the lattice if from_device is None.
+        device_list = list(zip(from_device, cycle(to_device))) if len(from_device) > len(to_device) else list(zip(cycle(from_device), to_device))
+        rmats = self._transfer_matrices([a for a, _ in device_list], [b for _, b in device_list], from_device_pos, to_device_pos,
+                                        ignore_bad_names, executor, chunk_size)
+        if len(device_list) == 1:
+            return rmats[0]
+        return rmats
 
+    def _transfer_matrices(self, from_devices, to_devices, from_device_pos, to_device_pos, ignore_bad_names, executor=None, chunk_size=None):
+        """Get the transfer matrix from each of `from_devices` to the device at the same position in `to_devices`."""
+        from_suffix = _rmat_suffix(from_device_pos, ('beg', 'mid'), "from_device_pos")
+        to_suffix = _rmat_suffix(to_device_pos, ('mid', 'end'), "to_device_pos")
+        metrics.record_cache("model.rmat", not (self.rmat_data is None or self.no_caching))
         if self.rmat_data is None or self.no_caching:
             self.refresh_rmat_data()
-                
-        device_list = list(zip(from_device, cycle(to_device))) if len(from_device) > len(to_device) else list(zip(cycle(from_device), to_device))
-        rmats = np.zeros((len(device_list),6,6))
-        i = 0
-        for dev_pair in device_list:
-            a, b = dev_pair
-            if a is None:
-                a_index = 0
-            else:
-                if from_device_pos == 'beg':
-                    split_suffix = "#1"
-                elif from_device_pos == 'mid':
-                    split_suffix = "#2"
-                else:
-                    raise ValueError("from_device_pos must be 'beg' or 'mid'.")
-                a_index = self._get_indices_for_names(a, split_suffix, ignore_bad_names)[0]
-                
-            if to_device_pos == 'mid':
-                split_suffix = "#1"
-            elif to_device_pos == 'end':
-                split_suffix = "#2"
-            else:
-                raise ValueError("to_device_pos must be 'mid' or 'end'.")
-            b_index = self._get_indices_for_names(b, split_suffix, ignore_bad_names)[0]
-
-            try:
-                if a_index is None:
-                    raise IndexError()
-                a_mat = self.rmat_data[a_index]['r_mat']
-            except IndexError:
-                msg = "Device with name {name} not found in the machine model.".format(name=a)
-                if ignore_bad_names:
-                    print(msg)
-                    a_mat = np.empty((6,6))
-                    a_mat.fill(np.nan)
-                else:
-                    raise IndexError(msg)
-            
-            try:
-                if b_index is None:
-                    raise IndexError()
-                b_mat = self.rmat_data[b_index]['r_mat']
-            except IndexError:
-                msg = "Device with name {name} not found in the machine model.".format(name=b)
-                if ignore_bad_names:
-                    print(msg)
-                    b_mat = np.empty((6,6))
-                    b_mat.fill(np.nan)
-                else:
-                    raise IndexError(msg)
-            rmats[i] = np.matmul(b_mat,np.linalg.inv(a_mat))
-            i += 1
-        if i == 1:
-            return rmats[0]
+        a_indices = self._resolve_indices(from_devices, from_suffix, ignore_bad_names)
+        b_indices = self._resolve_indices(to_devices, to_suffix, ignore_bad_names)
+        a_mats = _gather(self.rmat_data['r_mat'], a_indices)
+        b_mats = _gather(self.rmat_data['r_mat'], b_indices)
+        with self._profile("linear_algebra"):
+            rmats = _map_chunks(_compose_rmats, executor, chunk_size, a_mats, b_mats)
+        if self.profiler is not None:
+            self.profiler.count("inversions", len(from_devices))
+            self.profiler.count("matmuls", len(from_devices))
         return rmats
         
-    def get_twiss_attribute(self, device_list, attribute, ignore_bad_names=False, pos='mid'):
+    @profiled("get_twiss_attribute")
+    def get_twiss_attribute(self, device_list, attribute, ignore_bad_names=False, pos='mid', executor=None, chunk_size=None):
         """Get the values for one attribute for one or more devices.
         
         Args:
@@ -311,28 +378,22 @@ class Model(object):
                 device is not found in the model, np.nan will be inserted for that device.
             pos (str, optional): Either 'mid' or 'end'.  'mid' is the default.
                 Only applies to split elements.
+            executor (concurrent.futures.Executor, optional): Gather the values in
+                chunks on this executor.  Use a thread pool: the gathers share the
+                model data, which a process pool would have to copy for every chunk.
+            chunk_size (int, optional): The number of devices in each chunk sent to
+                the executor.  Defaults to 4096.
         """
         if isinstance(device_list, str):
             device_list = [device_list]
+        metrics.record_cache("model.twiss", not (self.twiss_data is None or self.no_caching))
         if self.twiss_data is None or self.no_caching:
             self.refresh_twiss_data()
-        attr = np.full((len(device_list)), np.nan)
-        i = 0
-        for dev in device_list:
-            if pos == 'mid':
-                split_suffix = "#1"
-            elif pos == 'end':
-                split_suffix = "#2"
-            else:
-                raise ValueError("'pos' must be either 'mid' or 'end'.")
-            dev_index = self._get_indices_for_names(dev, split_suffix, ignore_bad_names)[0]
-            if dev_index is None:
-                continue
-            else:
-                attr[i] = self.twiss_data[dev_index][attribute]
-            i += 1
-            
-        if i == 1:
+        indices = self._resolve_indices(device_list, _twiss_suffix(pos), ignore_bad_names)
+        if self.profiler is not None:
+            self.profiler.count("twiss_lookups", len(device_list))
+        attr = _map_chunks(partial(_gather, self.twiss_data[attribute]), executor, chunk_size, indices)
+        if len(device_list) == 1:
             return attr[0]
         return attr
     
@@ -369,7 +430,8 @@ class Model(object):
         """
         return self.get_twiss_attribute(device_list, 'z', ignore_bad_names, pos)
 
-    def get_twiss(self, device_list, ignore_bad_names=False, pos='mid'):
+    @profiled("get_twiss")
+    def get_twiss(self, device_list, ignore_bad_names=False, pos='mid', executor=None, chunk_size=None):
         """Get twiss data for one or more devices.
         
         Args:
@@ -382,6 +444,11 @@ class Model(object):
                 If 'mid', the twiss after the first half-element will be used.
                 If 'end', the twiss after the second half-element will be used.
                 Ignored completely for non-split elements.
+            executor (concurrent.futures.Executor, optional): Gather the twiss data in
+                chunks on this executor.  Use a thread pool: the gathers share the
+                model data, which a process pool would have to copy for every chunk.
+            chunk_size (int, optional): The number of devices in each chunk sent to
+                the executor.  Defaults to 4096.
         
         Returns:
             np.ndarray: A numpy structured array containing the twiss parameters for the
@@ -417,60 +484,384 @@ class Model(object):
         """
         if isinstance(device_list, str):
             device_list = [device_list]
-        if self.rmat_data is None or self.no_caching:
+        metrics.record_cache("model.twiss", not (self.twiss_data is None or self.no_caching))
+        if self.twiss_data is None or self.no_caching:
             self.refresh_twiss_data()
-        twiss = np.zeros(len(device_list), dtype=[('s', 'float32'), ('z', 'float32'),('length', 'float32'), ('p0c', 'float32'), ('alpha_x', 'float32'), ('beta_x', 'float32'), ('eta_x', 'float32'), ('etap_x', 'float32'), ('psi_x', 'float32'), ('alpha_y', 'float32'), ('beta_y', 'float32'), ('eta_y', 'float32'), ('etap_y', 'float32'), ('psi_y', 'float32')])
-        i = 0
-        for dev in device_list:
-            if pos == 'mid':
-                split_suffix = "#1"
-            elif pos == 'end':
-                split_suffix = "#2"
-            else:
-                raise ValueError("'pos' must be either 'mid' or 'end'.")
-            dev_index = self._get_indices_for_names(dev, split_suffix, ignore_bad_names)[0]
-            if dev_index is None:
-                msg = "Device with name {name} not found in the machine model, could not get twiss information.".format(name=dev)
-                if ignore_bad_names:
-                    print(msg)
-                    twiss[i][:] = None
-                else:
-                    raise IndexError(msg)
-            
-            twiss[i]['s'] = self.twiss_data[dev_index]['s']
-            twiss[i]['z'] = self.twiss_data[dev_index]['z']
-            twiss[i]['length'] = self.twiss_data[dev_index]['length']
-            twiss[i]['p0c'] = self.twiss_data[dev_index]['p0c']
-            twiss[i]['psi_x'] = self.twiss_data[dev_index]['psi_x']
-            twiss[i]['beta_x'] = self.twiss_data[dev_index]['beta_x']
-            twiss[i]['alpha_x'] = self.twiss_data[dev_index]['alpha_x']
-            twiss[i]['eta_x'] = self.twiss_data[dev_index]['eta_x']
-            twiss[i]['etap_x'] = self.twiss_data[dev_index]['etap_x']
-            twiss[i]['psi_y'] = self.twiss_data[dev_index]['psi_y']
-            twiss[i]['beta_y'] = self.twiss_data[dev_index]['beta_y']
-            twiss[i]['alpha_y'] = self.twiss_data[dev_index]['alpha_y']
-            twiss[i]['eta_y'] = self.twiss_data[dev_index]['eta_y']
-            twiss[i]['etap_y'] = self.twiss_data[dev_index]['etap_y']
-            i += 1
-            
-        if i == 1:
+        indices = self._resolve_indices(device_list, _twiss_suffix(pos), ignore_bad_names)
+        if self.profiler is not None:
+            self.profiler.count("twiss_lookups", len(device_list))
+        twiss = _map_chunks(partial(_gather_twiss, self.twiss_data), executor, chunk_size, indices)
+        if len(device_list) == 1:
             return twiss[0]
         return twiss
     
+    @profiled("propagate_twiss")
+    def propagate_twiss(self, initial_conditions, from_device, to_devices, ignore_bad_names=False, from_device_pos='beg',
+                        to_device_pos='end', executor=None, chunk_size=None):
+        """Propagate many sets of initial Twiss parameters to many devices at once.
+
+        The transfer matrices from `from_device` to each of `to_devices` come from the
+        cached R-matrix data.  Each plane's Twiss parameters are propagated with its 2x2
+        block of the matrix, and the dispersion with the 3x3 block that includes the
+        momentum column.  The K initial conditions and M devices are done together as
+        one K x M array operation, so thousands of trial conditions take milliseconds.
+
+        .. code-block:: python
+
+          m = Model("CU_HXR")
+          trials = np.zeros(1000, dtype=[('beta_x', 'f8'), ('alpha_x', 'f8'), ('beta_y', 'f8'), ('alpha_y', 'f8')])
+          trials['beta_x'] = np.linspace(1.0, 10.0, 1000)
+          trials['beta_y'] = 5.0
+          twiss = m.propagate_twiss(trials, 'OTRS:IN20:571', bpms)
+          twiss['beta_x'][k, j]   # beta_x at bpms[j], starting from trials[k]
+
+        Beta and alpha are divided by the determinant of each 2x2 block, and the
+        dispersion by R66, so they stay correct where the beam is accelerated.
+
+        Args:
+          initial_conditions: The Twiss parameters at `from_device`: a structured array
+            (like one from :func:`get_twiss`), a single row of one, or a dict of floats
+            or arrays.  Needs `beta_x`, `alpha_x`, `beta_y`, and `alpha_y`.  `eta_x`,
+            `etap_x`, `eta_y`, and `etap_y` are zero if they are not given.
+          from_device (str): The device the initial conditions are at.
+          to_devices (str or list of str): The devices to propagate to.
+          ignore_bad_names (bool, optional): If True, devices which aren't in the model
+            get NaN, instead of raising an IndexError.
+          from_device_pos (optional): Either 'beg' or 'mid'.  See :func:`get_rmat`.
+          to_device_pos (optional): Either 'mid' or 'end'.  See :func:`get_rmat`.
+          executor (concurrent.futures.Executor, optional): Split the initial conditions
+            into chunks, and propagate them on this executor.
+          chunk_size (int, optional): The number of initial conditions in each chunk sent
+            to the executor.  Defaults to 4096.
+
+        Returns:
+          np.ndarray: A structured array with shape (K, M), for K initial conditions and
+          M devices, with the fields `beta_x`, `alpha_x`, `eta_x`, `etap_x`, `psi_x`,
+          and the same for y.  `psi_x` and `psi_y` are the phase advances from
+          `from_device`, in radians, from 0 to 2 pi.
+        """
+        if isinstance(to_devices, str):
+            to_devices = [to_devices]
+        initial = _initial_twiss(initial_conditions)
+        rmats = self._transfer_matrices([from_device] * len(to_devices), list(to_devices), from_device_pos, to_device_pos, ignore_bad_names)
+        with self._profile("linear_algebra"):
+            twiss = _map_chunks(partial(_propagate_twiss, rmats), executor, chunk_size, initial)
+        if self.profiler is not None:
+            self.profiler.count("twiss_propagations", len(initial) * len(to_devices))
+        return twiss
+
+    @profiled("track")
+    def track(self, particles, from_device, to_devices, output='moments', ignore_bad_names=False, from_device_pos='beg',
+              to_device_pos='end', executor=None, chunk_size=None):
+        """Transport a particle distribution through the linear optics, to one or more devices.
+
+        Each particle's coordinates (x, x', y, y', z, delta) are multiplied by the
+        cached 6x6 transfer matrix from `from_device` to each of `to_devices`.  The
+        particles are handled in chunks of `chunk_size`, spread across `executor`
+        if one is given (numpy releases the GIL for the matrix products, so a
+        thread pool works well).
+
+        With output='moments', only the first and second moments of the distribution
+        are computed, one chunk at a time, and then transported (the transport is
+        linear, so that gives the same result as moving every particle).  Memory
+        stays at a few chunks, however many particles there are.  With
+        output='coordinates', every particle's coordinates at every device are
+        returned.
+
+        .. code-block:: python
+
+          m = Model("CU_HXR")
+          particles = np.random.default_rng().multivariate_normal(np.zeros(6), sigma0, 1000000)
+          moments = m.track(particles, 'OTRS:IN20:571', bpms)
+          moments['rms'][:, 0]   # The horizontal beam size at each BPM.
+
+        Args:
+          particles (np.ndarray): An N x 6 array of particle coordinates at `from_device`.
+          from_device (str): The device the particles start at.
+          to_devices (str or list of str): The devices to transport the particles to.
+          output (str, optional): 'moments' (the default) or 'coordinates'.
+          ignore_bad_names (bool, optional): If True, devices which aren't in the model
+            get NaN, instead of raising an IndexError.
+          from_device_pos (optional): Either 'beg' or 'mid'.  See :func:`get_rmat`.
+          to_device_pos (optional): Either 'mid' or 'end'.  See :func:`get_rmat`.
+          executor (concurrent.futures.Executor, optional): Process the chunks of
+            particles on this executor.  Use a thread pool: a process pool would
+            have to copy the particles to every worker.
+          chunk_size (int, optional): The number of particles in each chunk.  Defaults to 4096.
+
+        Returns:
+          dict or np.ndarray: For output='moments', a dict with:
+
+          * `mean` (np.ndarray): The mean coordinates at each device, with shape M x 6.
+          * `covariance` (np.ndarray): The covariance matrix at each device (normalized
+            by N), with shape M x 6 x 6.
+          * `rms` (np.ndarray): The rms size in each coordinate at each device, with shape M x 6.
+          * `count` (int): The number of particles.
+
+          For output='coordinates', an array with shape M x N x 6, with the same dtype as
+          `particles` if that is a float type.
+        """
+        if output not in ('moments', 'coordinates'):
+            raise ValueError("output must be 'moments' or 'coordinates'.")
+        if isinstance(to_devices, str):
+            to_devices = [to_devices]
+        particles = np.asarray(particles)
+        if particles.ndim != 2 or particles.shape[1] != 6:
+            raise ValueError("particles must be an N x 6 array.")
+        rmats = self._transfer_matrices([from_device] * len(to_devices), list(to_devices), from_device_pos, to_device_pos, ignore_bad_names)
+        if self.profiler is not None:
+            self.profiler.count("tracked_particles", len(particles))
+        with self._profile("linear_algebra"):
+            if output == 'coordinates':
+                return _track_coordinates(rmats, particles, executor, chunk_size)
+            count, mean, m2 = _particle_moments(particles, executor, chunk_size)
+            if count == 0:
+                mean, m2 = np.full(6, np.nan), np.full((6, 6), np.nan)
+            covariance = np.matmul(np.matmul(rmats, m2 / max(count, 1)), np.transpose(rmats, (0, 2, 1)))
+            return {"mean": np.matmul(rmats, mean), "covariance": covariance,
+                    "rms": np.sqrt(np.diagonal(covariance, axis1=1, axis2=2)), "count": count}
+
     def refresh_rmat_data(self):
         """Refresh the R-Matrix data from the MEME optics service."""
         self.rmat_data = full_machine_rmats(self.model_name, self.use_design, self.model_source)
     
     def refresh_twiss_data(self):
         """Refresh the Twiss data from the MEME optics service."""
-        self.twiss_data = full_machine_twiss(self.model_name, self.use_design, self.model_source)
+        self.twiss_data = full_machine_twiss(self.model_name, self.use_design, self.model_source, fields=self.fields)
     
     def refresh_all(self):
         """Refresh the R-Matrix and Twiss data from the MEME optics service."""
         self.refresh_rmat_data()
         self.refresh_twiss_data()
 
-def full_machine_rmats(model_name, use_design=False, model_source='BMAD'):
+    def save_snapshot(self, path, format="arrow"):
+        """Save the cached R-Matrix and Twiss data to a snapshot directory.
+
+        The directory holds one file for the R-Matrix data and one for the Twiss
+        data.  Requires pyarrow.
+
+        The default "arrow" format (Arrow IPC, uncompressed) holds each row exactly as
+        it is laid out in memory.  Loading it memory-maps the file, and uses the data
+        in place, so it takes milliseconds, and every process that loads the same
+        snapshot shares one copy of the data through the page cache.
+
+        The "parquet" format is columnar, with the 6x6 matrices as fixed-size list
+        columns, so other tools can read it.  Loading it decodes a new copy of the
+        data in each process.
+
+        Args:
+          path (str): The directory to write the snapshot to.  It is created if it
+            doesn't exist.
+          format (str, optional): Either "arrow" (the default) or "parquet".
+            Parquet files are smaller, but take longer to load.
+        """
+        snapshot.save(self, path, format)
+
+    @classmethod
+    def from_snapshot(cls, path, no_caching=False):
+        """Make a Model from a snapshot saved with :meth:`save_snapshot`, without contacting the model service.
+
+        If the directory holds both an Arrow and a Parquet file for a table, the
+        newer one is used.  Data loaded from Arrow files is read-only.  The Model's
+        `fields` are restored too, so refreshing the Twiss data fetches the same columns.
+
+        Args:
+          path (str): The snapshot directory.
+          no_caching (bool, optional): Same as for :class:`Model`.  If True, the
+            snapshot is only used until the first method call, which re-fetches
+            the data from the service.
+        Returns:
+          Model: A Model holding the snapshot data.
+        """
+        metadata, data = snapshot.load(path)
+        model = cls(metadata["model_name"], model_source=metadata["model_source"], initialize=False,
+                    use_design=metadata["use_design"] == "True", no_caching=no_caching,
+                    fields=ast.literal_eval(metadata.get("fields", "None")))
+        model.rmat_data = data["rmat_data"]
+        model.twiss_data = data["twiss_data"]
+        return model
+
+    def share(self):
+        """Publish this Model's data in shared memory, for use by other processes.
+
+        Worker processes (in a multiprocessing pool, for example) can attach to the
+        shared data with :meth:`from_shared_memory`, without copying it and without
+        contacting the model service.  Only the small descriptor needs to be sent to
+        each worker.
+
+        .. code-block:: python
+
+          m = Model("CU_HXR")
+          with m.share() as shared:
+              pool.map(scan, [(shared.descriptor, settings) for settings in all_settings])
+
+          # In each worker:
+          def scan(args):
+              descriptor, settings = args
+              m = Model.from_shared_memory(descriptor)
+              ...
+
+        Returns:
+          SharedModelSnapshot: The owner of the shared memory.  Keep it alive until
+          the workers are done, then close it.
+        """
+        if self.rmat_data is None:
+            self.refresh_rmat_data()
+        if self.twiss_data is None:
+            self.refresh_twiss_data()
+        return snapshot.SharedModelSnapshot(self)
+
+    @classmethod
+    def from_shared_memory(cls, descriptor):
+        """Make a Model which uses data published by :meth:`share` in another process.
+
+        The Model's rmat and twiss data are read-only views into the shared memory,
+        so nothing is copied.  The data is only re-fetched from the service if you
+        call one of the refresh methods.
+
+        Args:
+          descriptor (dict): The `descriptor` of a :class:`SharedModelSnapshot`.
+        Returns:
+          Model: A Model backed by the shared data.
+        """
+        data, blocks = snapshot.attach(descriptor)
+        model = cls(descriptor["model_name"], model_source=descriptor["model_source"], initialize=False,
+                    use_design=descriptor["use_design"])
+        model.rmat_data = data["rmat_data"]
+        model.twiss_data = data["twiss_data"]
+        # Set after the arrays, so the arrays are released before the blocks are closed.
+        model._shared_memory = blocks
+        return model
+
+default_chunk_size = 4096
+twiss_fields = ('s', 'z', 'length', 'p0c', 'alpha_x', 'beta_x', 'eta_x', 'etap_x', 'psi_x',
+                'alpha_y', 'beta_y', 'eta_y', 'etap_y', 'psi_y')
+
+propagated_twiss_fields = ('beta_x', 'alpha_x', 'eta_x', 'etap_x', 'psi_x', 'beta_y', 'alpha_y', 'eta_y', 'etap_y', 'psi_y')
+initial_twiss_fields = ('beta_x', 'alpha_x', 'eta_x', 'etap_x', 'beta_y', 'alpha_y', 'eta_y', 'etap_y')
+
+def _initial_twiss(initial_conditions):
+    """Pack initial Twiss parameters into a K x 8 array, in the order of `initial_twiss_fields`."""
+    if isinstance(initial_conditions, (np.ndarray, np.void)):
+        names = initial_conditions.dtype.names or ()
+    else:
+        names = tuple(initial_conditions)
+    columns = []
+    for name in initial_twiss_fields:
+        if name in names:
+            columns.append(np.atleast_1d(np.asarray(initial_conditions[name], dtype=np.float64)))
+        elif name.startswith('eta'):
+            columns.append(np.zeros(1))
+        else:
+            raise ValueError("The initial conditions need '{}'.".format(name))
+    return np.column_stack(np.broadcast_arrays(*columns))
+
+def _propagate_twiss(rmats, initial):
+    """Propagate K initial conditions (a K x 8 array) through M transfer matrices, into a K x M structured array."""
+    twiss = np.empty((len(initial), len(rmats)), dtype=[(name, 'float64') for name in propagated_twiss_fields])
+    r66 = rmats[None, :, 5, 5]
+    for plane, i, start in (('x', 0, 0), ('y', 2, 4)):
+        beta0, alpha0, eta0, etap0 = (initial[:, start + j, None] for j in range(4))
+        gamma0 = (1.0 + alpha0 ** 2) / beta0
+        r11, r12 = rmats[None, :, i, i], rmats[None, :, i, i + 1]
+        r21, r22 = rmats[None, :, i + 1, i], rmats[None, :, i + 1, i + 1]
+        det = r11 * r22 - r12 * r21
+        twiss['beta_' + plane] = (r11 ** 2 * beta0 - 2.0 * r11 * r12 * alpha0 + r12 ** 2 * gamma0) / det
+        twiss['alpha_' + plane] = (-r11 * r21 * beta0 + (r11 * r22 + r12 * r21) * alpha0 - r12 * r22 * gamma0) / det
+        twiss['psi_' + plane] = np.mod(np.arctan2(r12, r11 * beta0 - r12 * alpha0), 2.0 * np.pi)
+        twiss['eta_' + plane] = (r11 * eta0 + r12 * etap0 + rmats[None, :, i, 5]) / r66
+        twiss['etap_' + plane] = (r21 * eta0 + r22 * etap0 + rmats[None, :, i + 1, 5]) / r66
+    return twiss
+
+def _for_chunks(fn, executor, chunk_size, n):
+    """Call fn(start, stop) for each chunk of range(n), on `executor` if there is one, and list the results in order."""
+    chunk_size = chunk_size or default_chunk_size
+    starts = range(0, n, chunk_size)
+    stops = [min(start + chunk_size, n) for start in starts]
+    if executor is None:
+        return [fn(start, stop) for start, stop in zip(starts, stops)]
+    return list(executor.map(fn, starts, stops))
+
+def _track_coordinates(rmats, particles, executor, chunk_size):
+    dtype = particles.dtype if np.issubdtype(particles.dtype, np.floating) else np.float64
+    coordinates = np.empty((len(rmats), len(particles), 6), dtype=dtype)
+    transposed = np.transpose(rmats, (0, 2, 1)).astype(dtype)
+    def track_chunk(start, stop):
+        # Each chunk's rows are at most a few hundred kilobytes, so they stay in cache for every matrix.
+        coordinates[:, start:stop] = np.matmul(particles[start:stop].astype(dtype, copy=False), transposed)
+    _for_chunks(track_chunk, executor, chunk_size, len(particles))
+    return coordinates
+
+def _particle_moments(particles, executor, chunk_size):
+    """Get (count, mean, sum of squared deviations from the mean) of N x 6 particles, one chunk at a time."""
+    def chunk_moments(start, stop):
+        chunk = np.asarray(particles[start:stop], dtype=np.float64)
+        mean = chunk.mean(axis=0)
+        centered = chunk - mean
+        return len(chunk), mean, centered.T @ centered
+    count, mean, m2 = 0, np.zeros(6), np.zeros((6, 6))
+    for n, chunk_mean, chunk_m2 in _for_chunks(chunk_moments, executor, chunk_size, len(particles)):
+        # Merge with the pairwise update (Chan et al.), which stays accurate for large N.
+        total = count + n
+        delta = chunk_mean - mean
+        mean = mean + delta * (n / total)
+        m2 = m2 + chunk_m2 + np.outer(delta, delta) * (count * n / total)
+        count = total
+    return count, mean, m2
+
+def _rmat_suffix(pos, choices, argument):
+    """The split-element suffix for an R-matrix position: the first choice is "#1", the second "#2"."""
+    if pos not in choices:
+        raise ValueError("{} must be '{}' or '{}'.".format(argument, *choices))
+    return "#1" if pos == choices[0] else "#2"
+
+def _twiss_suffix(pos):
+    if pos == 'mid':
+        return "#1"
+    if pos == 'end':
+        return "#2"
+    raise ValueError("'pos' must be either 'mid' or 'end'.")
+
+def _gather(data, indices):
+    """Take rows of `data` at `indices`, with NaN rows wherever the index is -1."""
+    rows = np.asarray(data[np.maximum(indices, 0)], dtype=np.float64)
+    rows[indices < 0] = np.nan
+    return rows
+
+def _gather_twiss(twiss_data, indices):
+    fields = [name for name in twiss_fields if name in twiss_data.dtype.names]
+    twiss = np.zeros(len(indices), dtype=[(name, 'float32') for name in fields])
+    missing = indices < 0
+    rows = twiss_data[np.maximum(indices, 0)]
+    for name in fields:
+        twiss[name] = rows[name]
+        twiss[name][missing] = np.nan
+    return twiss
+
+def _compose_rmats(a_mats, b_mats):
+    """Get the transfer matrices b * inv(a) for stacks of 'from' and 'to' matrices."""
+    missing = np.isnan(a_mats).any(axis=(1, 2))
+    if missing.any():
+        a_mats = a_mats.copy()
+        a_mats[missing] = np.identity(6)
+    rmats = np.matmul(b_mats, np.linalg.inv(a_mats))
+    rmats[missing] = np.nan
+    return rmats
+
+def _map_chunks(fn, executor, chunk_size, *arrays):
+    """Call fn(*arrays), split into chunks on `executor` if there is one.
+
+    The results are concatenated in the same order as the inputs.
+    """
+    n = len(arrays[0])
+    if executor is None or n == 0:
+        return fn(*arrays)
+    chunk_size = chunk_size or default_chunk_size
+    starts = range(0, n, chunk_size)
+    chunks = [[array[start:start + chunk_size] for start in starts] for array in arrays]
+    return np.concatenate(list(executor.map(fn, *chunks)))
+
+def full_machine_rmats(model_name, use_design=False, model_source='BMAD', fields=None):
     """Gets the full machine model from the BMAD Live Model service. It uses the PV "{model_source.upper}:SYS0:1:{model_name.upper}:{LIVE or DESIGN}:RMAT"  Most of the time, it is more convenient to use the :class:`~meme.model.Model` class, rather than this method.
     
     Args:
@@ -478,9 +869,11 @@ def full_machine_rmats(model_name, use_design=False, model_source='BMAD'):
         use_design (bool, optional): Whether or not to use the design model, rather
         than the extant model.  Defaults to False.
         model_source (str, optional): The name of the model source ('BMAD', or 'LUCRETIA', for example).
+        fields (list of str, optional): Only fetch these fields: any of 'z', 's', and 'r_mat'.
+          The element and device names are always fetched.  By default, every field is fetched.
     Returns:
         numpy.ndarray: A numpy structured array containing the model data.  The array
-        has the following fields:
+        has the following fields (or only the ones asked for):
         
         * `element` (str): The element name for the element.
         * `device_name` (str): The device name for the element.
@@ -493,16 +886,30 @@ def full_machine_rmats(model_name, use_design=False, model_source='BMAD'):
     if use_design:
         model_type = "DESIGN"
     path = "{}:SYS0:1:{}:{}:RMAT".format(model_source.upper(),model_name.upper(), model_type)
-    response = NumpyNTTable.unwrap(Model.ctx.get(path))
-    m = np.zeros(len(response['element']), dtype=[('element', 'U60'), ('device_name', 'U60'), ('z', 'float32'), ('s', 'float32'), ('r_mat', 'float32', (6,6))])
-    m['element'] = response['element']
-    m['device_name'] = response['device_name']
-    m['z'] = response['z']
-    m['s'] = response['s']
-    m['r_mat'] = np.reshape(np.array([response['r11'], response['r12'], response['r13'], response['r14'], response['r15'], response['r16'], response['r21'], response['r22'], response['r23'], response['r24'], response['r25'], response['r26'], response['r31'], response['r32'], response['r33'], response['r34'], response['r35'], response['r36'], response['r41'], response['r42'], response['r43'], response['r44'], response['r45'], response['r46'], response['r51'], response['r52'], response['r53'], response['r54'], response['r55'], response['r56'], response['r61'], response['r62'], response['r63'], response['r64'], response['r65'], response['r66']]).T, (-1,6,6))
+    with metrics.timer("model.rmat", "total"):
+        return _full_machine_rmats(path, fields)
+
+rmat_columns = ["r{}{}".format(i, j) for i in range(1, 7) for j in range(1, 7)]
+rmat_dtype = [('element', 'U60'), ('device_name', 'U60'), ('z', 'float32'), ('s', 'float32'), ('r_mat', 'float32', (6,6))]
+name_columns = ('element', 'device_name')
+
+def _full_machine_rmats(path, fields=None):
+    dtype = rmat_dtype
+    columns = None
+    if fields is not None:
+        dtype = [field for field in rmat_dtype if field[0] in name_columns or field[0] in fields]
+        columns = [name for name, *_ in dtype if name != 'r_mat'] + (rmat_columns if 'r_mat' in fields else [])
+    response = NumpyNTTable.unwrap(_model_service_get("model.rmat", path, columns), columns)
+    m = np.zeros(len(response['element']), dtype=dtype)
+    for name, *_ in dtype:
+        if name == 'r_mat':
+            m['r_mat'] = np.reshape(np.array([response[col] for col in rmat_columns]).T, (-1,6,6))
+        else:
+            m[name] = response[name]
+    metrics.record_payload("model.rmat", len(m), m.nbytes)
     return m
 
-def full_machine_twiss(model_name, use_design=False, model_source='BMAD'):
+def full_machine_twiss(model_name, use_design=False, model_source='BMAD', fields=None):
     """Gets twiss parameters for the full machine from the BMAD Live Model service. It uses the PV "{model_source.upper}:SYS0:1:{model_name.upper}:{LIVE or DESIGN}:RMAT". Most of the time, it is more convenient to use the :class:`~meme.model.Model` class, rather than this method.
 
     
@@ -511,10 +918,12 @@ def full_machine_twiss(model_name, use_design=False, model_source='BMAD'):
         use_design (bool, optional): Whether or not to use the design model, rather
         than the extant model.  Defaults to False.
          model_source (str, optional): The name of the model source ('BMAD', or 'LUCRETIA', for example).
+        fields (list of str, optional): Only fetch these columns, like ['s', 'beta_x', 'beta_y'].
+          The element and device names are always fetched.  By default, every column is fetched.
 
     Returns:
         numpy.ndarray: A numpy structured array containing the model data.  The array
-        has the following fields for each element:
+        has the following fields for each element (or only the ones asked for):
         
         * `element` (str): The element name for the element.
         * `device_name` (str): The device name for the element.
@@ -538,4 +947,16 @@ def full_machine_twiss(model_name, use_design=False, model_source='BMAD'):
     if use_design:
         model_type = "DESIGN"
     path = "{}:SYS0:1:{}:{}:TWISS".format(model_source.upper(),model_name.upper(), model_type)
-    return NumpyNTTable.unwrap(Model.ctx.get(path))
+    columns = None if fields is None else list(name_columns) + [f for f in fields if f not in name_columns]
+    with metrics.timer("model.twiss", "total"):
+        twiss = NumpyNTTable.unwrap(_model_service_get("model.twiss", path, columns), columns)
+    metrics.record_payload("model.twiss", len(twiss), twiss.nbytes)
+    return twiss
+
+def _model_service_get(operation, path, columns=None):
+    # Ask the server for only some columns.  Servers which don't support field
+    # selection send them all, and unwrap() skips the rest.
+    request = None if columns is None else "field({})".format(",".join("value." + col for col in columns))
+    # Identical requests made at the same time (from different threads) share one request.
+    with metrics.timer(operation, "wait"):
+        return flights.do(("get", path, request), get_policy().call, "model", Model.ctx.get, path, request=request)
@@ -0,0 +1,121 @@
+import functools
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+
+# Returned by Model._profile() when profiling is off, so the hot paths only pay for one check.
+null_section = nullcontext()
+
+class _Section(object):
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+def profiled(section):
+    """Decorate a Model method so each call is timed as one pass through `section`."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None:
+                return method(self, *args, **kwargs)
+            with self.profiler.section(section):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class ModelProfiler(object):
+    """Counts and times the work done inside a :class:`~meme.model.Model`.
+
+    A profiler keeps two kinds of data:
+
+    * `counts`: How many times something happened.  Model records
+      'name_lookups', 'inversions', 'matmuls', 'twiss_lookups',
+      'twiss_propagations', and 'tracked_particles'.
+    * `times` and `calls`: Total time (in seconds) spent in, and the number of
+      times through, a section of code.  Model records 'get_rmat', 'get_twiss',
+      'get_twiss_attribute', 'propagate_twiss', and 'track' for whole calls, and
+      'index_resolution' and 'linear_algebra' for the work inside them.
+
+    Hooks are called for every count and every timed section, with the
+    arguments (event, value), where value is the count or the time in seconds.
+    Use them to feed your own monitoring.
+
+    Profilers from several Model instances (or processes) can be combined
+    with :meth:`merge` or `+`.
+
+    Examples:
+
+    .. code-block:: python
+
+      m = Model("CU_HXR")
+      profiler = m.enable_profiling()
+      m.get_rmat(from_list, to_list)
+      profiler.report()
+    """
+    def __init__(self):
+        self.counts = Counter()
+        self.times = defaultdict(float)
+        self.calls = Counter()
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """Add a function to be called as hook(event, value) for every count and timing."""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Remove a hook added with :meth:`add_hook`."""
+        self.hooks.remove(hook)
+
+    def count(self, event, n=1):
+        """Add `n` to the count for `event`."""
+        self.counts[event] += n
+        for hook in self.hooks:
+            hook(event, n)
+
+    def add_time(self, section, seconds):
+        """Add one pass through `section`, which took `seconds`."""
+        self.times[section] += seconds
+        self.calls[section] += 1
+        for hook in self.hooks:
+            hook(section, seconds)
+
+    def section(self, name):
+        """A context manager which times its block as one pass through section `name`."""
+        return _Section(self, name)
+
+    def reset(self):
+        """Clear all counts and times.  Hooks are kept."""
+        self.counts.clear()
+        self.times.clear()
+        self.calls.clear()
+
+    def merge(self, other):
+        """Add the counts and times from another profiler to this one."""
+        self.counts.update(other.counts)
+        self.calls.update(other.calls)
+        for section, seconds in other.times.items():
+            self.times[section] += seconds
+        return self
+
+    def __add__(self, other):
+        return ModelProfiler().merge(self).merge(other)
+
+    def report(self):
+        """Get the counts and times as a dict.
+
+        Returns:
+          dict: {'counts': {event: count}, 'sections': {section: {'calls', 'total', 'mean'}}}
+        """
+        sections = {name: {"calls": self.calls[name], "total": total, "mean": total / self.calls[name] if self.calls[name] else 0.0}
+                    for name, total in self.times.items()}
+        return {"counts": dict(self.counts), "sections": sections}
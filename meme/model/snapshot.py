@@ -0,0 +1,230 @@
+import ast
+import os
+import sys
+import numpy as np
+
+formats = {"arrow": ".arrow", "parquet": ".parquet"}
+tables = ("rmat_data", "twiss_data")
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Model snapshots need pyarrow.  Install it with 'pip install pyarrow' (or 'pip install meme[arrow]').")
+    return pyarrow
+
+def _to_arrow(pa, data, metadata):
+    """Convert a structured array into a pyarrow Table.
+
+    Matrix fields (like 'r_mat') become fixed-size list columns.  The numpy dtype
+    is saved in the schema metadata, so the structured array can be rebuilt exactly.
+    """
+    columns = []
+    for name in data.dtype.names:
+        col = data[name]
+        if col.dtype.kind == 'U':
+            columns.append(pa.array(col.tolist(), type=pa.string()))
+        elif col.ndim > 1:
+            size = int(np.prod(col.shape[1:]))
+            flat = pa.array(np.ascontiguousarray(col).reshape(-1))
+            columns.append(pa.FixedSizeListArray.from_arrays(flat, size))
+        else:
+            columns.append(pa.array(col))
+    metadata = dict(metadata, numpy_dtype=repr(data.dtype.descr))
+    return pa.Table.from_arrays(columns, names=list(data.dtype.names),
+                                metadata={k: str(v) for k, v in metadata.items()})
+
+def _to_arrow_records(pa, data, metadata):
+    """Convert a structured array into a pyarrow Table with one fixed-size binary column.
+
+    Each value in the 'records' column is one row, laid out exactly as in the
+    structured array, so :func:`_from_arrow_records` can use the data in place.
+    """
+    data = np.ascontiguousarray(data)
+    records = pa.FixedSizeBinaryArray.from_buffers(pa.binary(data.dtype.itemsize), len(data),
+                                                   [None, pa.py_buffer(data.tobytes())])
+    metadata = dict(metadata, numpy_dtype=repr(data.dtype.descr), layout="records")
+    return pa.Table.from_arrays([records], names=["records"], metadata={k: str(v) for k, v in metadata.items()})
+
+def _from_arrow_records(table):
+    """Get a read-only structured array view of a table written by :func:`_to_arrow_records`.
+
+    Nothing is copied: when the table was read from a memory-mapped file, the
+    array is backed by the file's pages, which every process that loads the
+    file shares through the page cache.
+    """
+    dtype = np.dtype(ast.literal_eval(table.schema.metadata[b'numpy_dtype'].decode()))
+    chunks = table.column("records").chunks
+    records = chunks[0] if len(chunks) == 1 else table.column("records").combine_chunks()
+    data = np.frombuffer(records.buffers()[1], dtype=dtype, count=len(records), offset=records.offset * dtype.itemsize)
+    data.flags.writeable = False
+    return data
+
+def _from_arrow(table):
+    """Convert a pyarrow Table written by :func:`_to_arrow` back into a structured array.
+
+    Model data is kept in row-oriented structured arrays, so every column is
+    copied into a new array: the result doesn't refer to the file.
+    """
+    dtype = np.dtype(ast.literal_eval(table.schema.metadata[b'numpy_dtype'].decode()))
+    data = np.zeros(table.num_rows, dtype=dtype)
+    for name in dtype.names:
+        col = table.column(name).combine_chunks()
+        if dtype[name].shape:
+            # The matrix values are read without conversion, then copied into place.
+            data[name] = col.flatten().to_numpy().reshape((-1,) + dtype[name].shape)
+        else:
+            data[name] = col.to_numpy(zero_copy_only=False)
+    return data
+
+def save(model, path, format="arrow"):
+    """Write a Model's rmat and twiss data to a snapshot directory.
+
+    See :meth:`meme.model.Model.save_snapshot`.
+    """
+    if format not in formats:
+        raise ValueError("format must be one of {}.".format(", ".join(sorted(formats))))
+    pa = _import_pyarrow()
+    metadata = {"model_name": model.model_name, "model_source": model.model_source,
+                "use_design": model.use_design, "fields": model.fields}
+    os.makedirs(path, exist_ok=True)
+    for name in tables:
+        data = getattr(model, name)
+        if data is None:
+            continue
+        filename = os.path.join(path, name + formats[format])
+        if format == "arrow":
+            table = _to_arrow_records(pa, data, metadata)
+            with pa.OSFile(filename, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            pa.parquet.write_table(_to_arrow(pa, data, metadata), filename)
+
+def load(path):
+    """Read a snapshot directory written by :func:`save`.
+
+    When a table was saved in both formats, the newer file is used.  Arrow files
+    are memory-mapped, and their tables are read-only views of the mapped file.
+    Parquet files are decoded into new arrays.
+
+    Returns:
+      tuple: (metadata dict, {'rmat_data': array or None, 'twiss_data': array or None})
+    """
+    pa = _import_pyarrow()
+    data = {}
+    metadata = None
+    for name in tables:
+        data[name] = None
+        found = []
+        for order, (format, extension) in enumerate(formats.items()):
+            filename = os.path.join(path, name + extension)
+            if os.path.exists(filename):
+                found.append((os.path.getmtime(filename), -order, format, filename))
+        if not found:
+            continue
+        # The newest file wins.  Ties go to the format listed first in `formats`.
+        _, _, format, filename = max(found)
+        if format == "arrow":
+            # The arrays keep the mapping alive after the file is closed.
+            with pa.memory_map(filename, "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+            records = table.schema.metadata.get(b'layout') == b'records'
+            data[name] = _from_arrow_records(table) if records else _from_arrow(table)
+        else:
+            table = pa.parquet.read_table(filename, memory_map=True)
+            data[name] = _from_arrow(table)
+        metadata = {k.decode(): v.decode() for k, v in table.schema.metadata.items() if k not in (b'numpy_dtype', b'layout')}
+    if metadata is None:
+        raise FileNotFoundError("No model snapshot found in {}".format(path))
+    return metadata, data
+
+def _tracker_pid():
+    """The pid of the resource tracker this process started, or None if it didn't start one."""
+    from multiprocessing import resource_tracker
+    return getattr(resource_tracker._resource_tracker, "_pid", None)
+
+def _attach_shared_memory(name, creator_tracker_pid):
+    from multiprocessing import resource_tracker, shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Only the process which created the block should unlink it.  Before python 3.13,
+    # attaching registers the block with the resource tracker.  A process with its own
+    # tracker has to unregister it, or its tracker unlinks the block (and warns about a
+    # leak) when the process exits.  Processes forked or spawned by the creator share
+    # its tracker, where the block is already registered, and unregistering it there
+    # would drop the creator's registration.
+    tracker_pid = _tracker_pid()
+    if tracker_pid is not None and tracker_pid != creator_tracker_pid:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+class SharedModelSnapshot(object):
+    """A Model's rmat and twiss data, published in shared memory blocks.
+
+    Made by :meth:`meme.model.Model.share`.  The process that made it owns
+    the shared memory, and must keep this object alive while other processes
+    use it.  Call :meth:`close` (or use it as a context manager) when the
+    other processes are done, to free the memory.
+
+    Attributes:
+      descriptor (dict): A small, picklable description of the shared data.
+        Send it to worker processes, and attach to the data with
+        :meth:`meme.model.Model.from_shared_memory`.
+    """
+    def __init__(self, model):
+        from multiprocessing import shared_memory
+        self._blocks = []
+        self.descriptor = {"model_name": model.model_name, "model_source": model.model_source,
+                           "use_design": model.use_design, "tables": {}}
+        try:
+            for name in tables:
+                data = getattr(model, name)
+                if data is None:
+                    continue
+                # Shared memory blocks can't be empty.
+                shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+                self._blocks.append(shm)
+                view = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+                view[:] = data
+                del view
+                self.descriptor["tables"][name] = {"shm_name": shm.name, "dtype": repr(data.dtype.descr), "length": len(data)}
+        except Exception:
+            self.close()
+            raise
+        self.descriptor["tracker_pid"] = _tracker_pid()
+
+    def close(self):
+        """Release and unlink the shared memory.  Processes still attached keep their mappings."""
+        blocks, self._blocks = self._blocks, []
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def attach(descriptor):
+    """Map the data described by a :class:`SharedModelSnapshot` descriptor into this process.
+
+    Returns:
+      tuple: ({'rmat_data': array or None, 'twiss_data': array or None}, list of SharedMemory blocks).
+      The arrays are read-only views into the blocks, which must be kept open while
+      the arrays are in use.
+    """
+    data = {name: None for name in tables}
+    blocks = []
+    for name, table in descriptor["tables"].items():
+        shm = _attach_shared_memory(table["shm_name"], descriptor.get("tracker_pid"))
+        blocks.append(shm)
+        array = np.ndarray(table["length"], dtype=np.dtype(ast.literal_eval(table["dtype"])), buffer=shm.buf)
+        array.flags.writeable = False
+        data[name] = array
+    return data, blocks
@@ -1,3 +1,10 @@
 from .names import (
 	list_pvs, list_devices, list_elements, device_to_element, element_to_device
 )
+
+def __getattr__(name):
+	# The name table needs numpy, so only import it when it is used.
+	if name in ("NameTable", "load_name_table"):
+		from . import table
+		return getattr(table, name)
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -1,18 +1,34 @@
 import re
-from p4p.client.thread import Context
 from p4p.nt import NTTable, NTURI
+from ..context import get_context
+from ..singleflight import flights
+from ..policy import get_policy
+from .. import metrics
 
-ctx = Context('pva')
 NameQueryURI = NTURI([('name', 's'), ('to', 's'), ('pv', 's')])
 
 def directory_service_get(timeout=None, **kws):
-  if timeout is None:
-    timeout = 5.0
   NameQueryURI = NTURI([(key, 's') for key in kws])
   request = NameQueryURI.wrap("ds", scheme="pva", kws=kws)
-  response = ctx.rpc("ds", request, timeout=timeout)
+  # Identical queries made at the same time (from different threads) share one request.
+  key = ("ds", tuple(sorted(kws.items())))
+  with metrics.timer("ds", "wait"):
+    response = flights.do(key, get_policy().call, "ds", get_context().rpc, "ds", request, timeout=timeout)
   return response
 
+@metrics.timed("ds", "decode")
+def _names_from_response(response):
+  names = [row['name'] for row in NTTable.unwrap(response)]
+  if metrics.enabled:
+    metrics.record_payload("ds", len(names), sum(len(name) for name in names))
+  return names
+
+def __getattr__(name):
+  # 'ctx' used to be a Context made at import time.  Keep it working for old scripts.
+  if name == "ctx":
+    return get_context()
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 def _list(pattern, tag=None, sort_by=None, element_type=None, show=None, timeout=None):
   """Gets a list of PVs, device names, or element names from the directory service.
   
@@ -36,7 +52,7 @@ def _list(pattern, tag=None, sort_by=None, element_type=None, show=None, timeout
     list of str: A list of names matching the parameters sent.
   """
   response = directory_service_get(timeout=timeout, name=pattern, tag=tag, sort=sort_by, etype=element_type, show=show)
-  return [row['name'] for row in NTTable.unwrap(response)]
+  return _names_from_response(response)
 
 def list_pvs(pattern, tag=None, sort_by=None, element_type=None, timeout=None):
   """Gets a list of PVs from the directory service.
@@ -117,7 +133,7 @@ def device_to_element(device_name, timeout=None):
   responses = []
   for devname in device_name:
     response = directory_service_get(timeout=timeout, dname=devname, show="ename")
-    responses.extend([row['name'] for row in NTTable.unwrap(response)])
+    responses.extend(_names_from_response(response))
   flattened_responses = []
   for item in responses:
     if isinstance(item, list):
@@ -146,7 +162,7 @@ def element_to_device(element_name, timeout=None):
   responses = []
   for elename in element_name:
     response = directory_service_get(timeout=timeout, ename=elename, show="dname")
-    responses.extend([row['name'] for row in NTTable.unwrap(response)])
+    responses.extend(_names_from_response(response))
   flattened_responses = []
   for item in responses:
     if isinstance(item, list):
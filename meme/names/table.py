@@ -0,0 +1,255 @@
+import re
+import warnings
+import numpy as np
+from functools import lru_cache
+from p4p.nt import NTTable
+from p4p.client.thread import RemoteError
+from .names import directory_service_get
+from .. import metrics
+
+# Characters which mark a pattern as a regular expression rather than a plain name.
+_regex_chars = set(".^$*+?{}()[]\\|")
+
+@lru_cache(maxsize=1024)
+def _compile_pattern(pattern):
+  """Compile a directory service pattern into a regex and its literal prefix.
+
+  Oracle-style patterns use '%' as the only wildcard, everything else is
+  matched literally.  Any other pattern is treated as a regular expression.
+  The literal prefix is used to narrow the search with a sorted index before
+  the regex is applied.
+  """
+  if "%" in pattern:
+    regex = "".join(".*" if c == "%" else re.escape(c) for c in pattern)
+    prefix = pattern.split("%", 1)[0]
+  elif "|" in pattern:
+    # With alternation there may be no common literal prefix.
+    regex = pattern
+    prefix = ""
+  else:
+    regex = pattern
+    prefix = ""
+    for c in pattern:
+      if c in _regex_chars:
+        # A quantifier applies to the previous character, so it can't be part of the prefix.
+        if c in "*?{" and prefix:
+          prefix = prefix[:-1]
+        break
+      prefix += c
+  return re.compile(regex), prefix
+
+class NameTable(object):
+  """An in-memory copy of the directory service name table.
+
+  A NameTable holds one row per PV, with the device name, element name, tag,
+  element type, and z position for each PV.  Its list methods take the same
+  arguments as :func:`meme.names.list_pvs` and friends, but evaluate the
+  query locally, so repeated queries (like filtering as a user types) don't
+  hit the directory service at all.
+
+  Patterns are compiled once and cached, and the table keeps a sorted index
+  for each name column and a row index for each tag and element type, so
+  most queries only look at the handful of rows that can possibly match.
+  Oracle-style patterns are matched with vectorized string operations, and
+  the rows matching each pattern are cached, so repeating a query is cheap.
+
+  Columns which aren't given are missing from the table (see `missing`).
+  Queries that need a missing column raise a ValueError, rather than
+  quietly returning nothing.
+
+  Args:
+    pv (list of str): The PV name for each row.
+    dname (list of str, optional): The device name for each row.
+    ename (list of str, optional): The element name for each row.
+    tag (list of str, optional): The tag(s) for each row.  Multiple tags
+      can be given for one row as a comma-separated string.
+    etype (list of str, optional): The element type for each row.
+    z (list of float, optional): The z position for each row.  Only its
+      order is used, for sort_by='z'.
+
+  Examples:
+
+  .. code-block:: python
+
+    from meme.names import load_name_table
+    names = load_name_table()
+    names.list_devices("BPMS:%", tag="L2", sort_by="z")
+  """
+  columns = ("pv", "dname", "ename", "tag", "etype", "z")
+
+  def __init__(self, pv, dname=None, ename=None, tag=None, etype=None, z=None):
+    n = len(pv)
+    self.pv = np.asarray(pv, dtype=str)
+    self.dname = self._column(dname, n)
+    self.ename = self._column(ename, n)
+    self.tag = self._column(tag, n)
+    self.etype = self._column(etype, n)
+    self.z = self._column(z, n, dtype=float)
+    self.missing = {name for name in self.columns if getattr(self, name) is None}
+    self._sorted_index = {}
+    self._match = lru_cache(maxsize=1024)(self._find)
+    self._tag_index = None if tag is None else self._build_index(self.tag, split=True)
+    self._etype_index = None if etype is None else self._build_index(self.etype)
+
+  @staticmethod
+  def _column(values, n, dtype=str):
+    if values is None:
+      return None
+    values = np.asarray(values, dtype=dtype)
+    if len(values) != n:
+      raise ValueError("All name table columns must have the same length.")
+    return values
+
+  @staticmethod
+  def _build_index(values, split=False):
+    index = {}
+    for i, value in enumerate(values):
+      keys = value.split(",") if split else [value]
+      for key in keys:
+        key = key.strip()
+        if key:
+          index.setdefault(key, []).append(i)
+    return {key: np.asarray(rows, dtype=np.intp) for key, rows in index.items()}
+
+  def __len__(self):
+    return len(self.pv)
+
+  def _require(self, column, argument):
+    if column in self.missing:
+      raise ValueError("Can't use {}: this name table has no '{}' column.".format(argument, column))
+
+  def _sorted(self, column):
+    """Get (sort order, sorted values) for a name column, building it on first use."""
+    if column not in self._sorted_index:
+      values = getattr(self, column)
+      order = np.argsort(values, kind="stable")
+      self._sorted_index[column] = (order, values[order])
+    return self._sorted_index[column]
+
+  def _find(self, column, pattern):
+    """Get the (unordered) row indices where `column` matches `pattern`.
+
+    Use `_match`, which caches the result for each pattern.
+    """
+    regex, prefix = _compile_pattern(pattern)
+    order, sorted_values = self._sorted(column)
+    if prefix:
+      start = np.searchsorted(sorted_values, prefix, side="left")
+      end = np.searchsorted(sorted_values, prefix + "\U0010ffff", side="left")
+      order, sorted_values = order[start:end], sorted_values[start:end]
+    if "%" in pattern:
+      # The prefix is the first literal part.  Check the others without a python loop.
+      parts = pattern.split("%")
+      keep = np.char.endswith(sorted_values, parts[-1])
+      keep &= np.char.str_len(sorted_values) >= len(parts[0]) + len(parts[-1])
+      for part in parts[1:-1]:
+        if part:
+          keep &= np.char.find(sorted_values, part) >= 0
+      order, sorted_values = order[keep], sorted_values[keep]
+      if len(parts) == 2:
+        # 'start%end' is fully checked.  Patterns with more wildcards still need the regex.
+        order.flags.writeable = False
+        return order
+    rows = order[[i for i, value in enumerate(sorted_values) if regex.fullmatch(value)]]
+    rows.flags.writeable = False
+    return rows
+
+  def list(self, pattern, tag=None, sort_by=None, element_type=None, show=None):
+    """Gets a list of PVs, device names, or element names from the table.
+
+    Takes the same arguments as :func:`meme.names.list_pvs`, plus 'show',
+    which can be 'dname' or 'ename' to list device or element names.
+    The pattern is matched against the kind of name being shown.
+
+    Returns:
+      list of str: A list of names matching the parameters sent.
+    Raises:
+      ValueError: If the query needs a column this table doesn't have.
+    """
+    column = {None: "pv", "pv": "pv", "dname": "dname", "ename": "ename"}.get(show)
+    if column is None:
+      raise ValueError("show must be None, 'dname', or 'ename'.")
+    self._require(column, "show='{}'".format(show))
+    if tag is not None:
+      self._require("tag", "a tag filter")
+    if element_type is not None:
+      self._require("etype", "an element_type filter")
+    if sort_by is not None:
+      if sort_by not in self.columns:
+        raise ValueError("Cannot sort by '{}'.".format(sort_by))
+      self._require(sort_by, "sort_by='{}'".format(sort_by))
+    rows = self._match(column, pattern)
+    if tag is not None:
+      rows = np.intersect1d(rows, self._tag_index.get(tag, rows[:0]), assume_unique=True)
+    if element_type is not None:
+      rows = np.intersect1d(rows, self._etype_index.get(element_type, rows[:0]), assume_unique=True)
+    rows = np.sort(rows)
+    if sort_by is not None:
+      rows = rows[np.argsort(getattr(self, sort_by)[rows], kind="stable")]
+    names = getattr(self, column)[rows]
+    # Device and element names repeat for every PV of the device, only list them once.
+    _, first = np.unique(names, return_index=True)
+    return names[np.sort(first)].tolist()
+
+  def list_pvs(self, pattern, tag=None, sort_by=None, element_type=None):
+    """Gets a list of PVs from the table.  See :func:`meme.names.list_pvs`."""
+    return self.list(pattern, tag=tag, sort_by=sort_by, element_type=element_type)
+
+  def list_devices(self, pattern, tag=None, sort_by=None, element_type=None):
+    """Gets a list of device names from the table.  See :func:`meme.names.list_devices`."""
+    return self.list(pattern, tag=tag, sort_by=sort_by, element_type=element_type, show="dname")
+
+  def list_elements(self, pattern, tag=None, sort_by=None, element_type=None):
+    """Gets a list of element names from the table.  See :func:`meme.names.list_elements`."""
+    return self.list(pattern, tag=tag, sort_by=sort_by, element_type=element_type, show="ename")
+
+  @classmethod
+  def from_service(cls, pattern="%", timeout=None):
+    """Fetch the name table from the directory service.
+
+    The whole table is asked for in one request.  Directory services which
+    refuse it, or only answer with a 'name' column, get two plain queries
+    instead: one for the PVs, and one for the same PVs with sort='z', which
+    gives their z order.  The 'dname', 'ename', 'tag', and 'etype' columns
+    are then missing, with a warning.
+
+    Args:
+      pattern (str, optional): Only fetch PVs matching this pattern.
+        Defaults to the whole table.
+      timeout (float, optional): Time to wait (in seconds) for the directory service.
+    Raises:
+      TimeoutError: If the directory service doesn't answer in time.
+    """
+    try:
+      rows = NTTable.unwrap(directory_service_get(timeout=timeout, name=pattern, show=",".join(cls.columns)))
+    except RemoteError:
+      # Services which don't know this 'show' may refuse the request.
+      rows = []
+    if rows and all(col in rows[0] for col in cls.columns):
+      return cls(**{col: [row[col] for row in rows] for col in cls.columns})
+    pvs = [row["name"] for row in NTTable.unwrap(directory_service_get(timeout=timeout, name=pattern))]
+    by_z = [row["name"] for row in NTTable.unwrap(directory_service_get(timeout=timeout, name=pattern, sort="z"))]
+    rank = {pv: i for i, pv in enumerate(by_z)}
+    warnings.warn("The directory service only sent PV names, so the name table has no 'dname', 'ename', 'tag', or 'etype' columns.")
+    return cls(pvs, z=[rank.get(pv, np.nan) for pv in pvs])
+
+_name_table = None
+
+def load_name_table(refresh=False, timeout=None):
+  """Get the full directory service name table as a :class:`NameTable`.
+
+  The table is fetched the first time this is called, and the same table
+  is returned on every call after that.
+
+  Args:
+    refresh (bool, optional): Re-fetch the table from the directory service,
+      even if it has already been loaded.
+    timeout (float, optional): Time to wait (in seconds) for the directory service.
+  Returns:
+    NameTable: The name table.
+  """
+  global _name_table
+  metrics.record_cache("names.table", _name_table is not None and not refresh)
+  if _name_table is None or refresh:
+    _name_table = NameTable.from_service(timeout=timeout)
+  return _name_table
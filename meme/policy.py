@@ -0,0 +1,203 @@
+"""Timeout, retry, and circuit breaker policy for requests to the MEME services.
+
+All of the service wrappers (:func:`meme.archive.archive.hist_service_get`,
+:func:`meme.names.names.directory_service_get`, and the
+:class:`~meme.model.Model` fetches) send their requests through the same
+:class:`ServicePolicy`.  You can change how they behave by installing a new
+policy with :func:`set_policy`:
+
+.. code-block:: python
+
+  import meme.policy
+  meme.policy.set_policy(meme.policy.ServicePolicy(timeout=10.0, retries=4))
+"""
+import random
+import threading
+import time
+from p4p.client.thread import Disconnected
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of making a request when a service's circuit breaker is open."""
+    pass
+
+class _Circuit(object):
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+class ServicePolicy(object):
+    """Decides how long to wait for a request, and whether (and when) to retry it.
+
+    Timeouts scale with the size of a request: each request waits
+    `timeout + timeout_per_item * items + timeout_per_item_hour * items * hours`
+    seconds, up to `max_timeout`, where `items` is the number of things asked
+    for (PVs, for the archive service) and `hours` is the time span of the request.
+
+    Failed requests are retried with exponential backoff and random jitter.
+    To stop retries from piling on to an overloaded service, retries come out
+    of a budget: every request that succeeds without a retry adds
+    `retry_budget` to the budget (up to `max_retry_budget`), and every retry
+    spends 1 from it.  When the budget is empty, failures are not retried.
+
+    Each service also has a circuit breaker.  After `failure_threshold`
+    requests in a row have failed, the circuit opens, and requests fail
+    immediately with :class:`CircuitOpenError` for `reset_timeout` seconds.
+    After that, one trial request is let through: if it succeeds, the circuit
+    closes again.
+
+    Args:
+      timeout (float, optional): The base timeout (in seconds).  Defaults to 5.0.
+      timeout_per_item (float, optional): Extra timeout per item requested.
+      timeout_per_item_hour (float, optional): Extra timeout per item, per hour of data requested.
+      max_timeout (float, optional): The longest timeout used for a single attempt.
+      retries (int, optional): The maximum number of retries for one request.
+      backoff (float, optional): The delay (in seconds) before the first retry.
+        The delay doubles for every retry after that.
+      max_backoff (float, optional): The longest delay between retries.
+      jitter (float, optional): The fraction of each delay which is randomized.
+      retry_budget (float, optional): How much each successful request adds to the retry budget.
+      max_retry_budget (float, optional): The most retries which can be saved up.
+      failure_threshold (int, optional): Failures in a row which open the circuit.
+        Set to None to turn the circuit breaker off.
+      reset_timeout (float, optional): How long (in seconds) the circuit stays open.
+      retry_on (tuple of exception types, optional): Errors which are retried.
+        Defaults to timeouts and disconnections.  Errors from the service itself
+        are not retried, since they will usually just happen again.
+    """
+    def __init__(self, timeout=5.0, timeout_per_item=0.01, timeout_per_item_hour=0.005, max_timeout=60.0,
+                 retries=2, backoff=0.5, max_backoff=10.0, jitter=0.5,
+                 retry_budget=0.2, max_retry_budget=10.0,
+                 failure_threshold=5, reset_timeout=30.0,
+                 retry_on=(TimeoutError, Disconnected)):
+        self.timeout = timeout
+        self.timeout_per_item = timeout_per_item
+        self.timeout_per_item_hour = timeout_per_item_hour
+        self.max_timeout = max_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_budget = retry_budget
+        self.max_retry_budget = max_retry_budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_on = tuple(retry_on)
+        self._lock = threading.Lock()
+        self._budget = max_retry_budget
+        self._circuits = {}
+
+    def timeout_for(self, items=0, span=None):
+        """Get the timeout (in seconds) for a request.
+
+        Args:
+          items (int, optional): The number of things asked for (PVs, for example).
+            Requests which don't ask for a number of things (like directory
+            service and model requests) leave it at 0, and get the base `timeout`.
+          span (float, optional): The time span of the data asked for, in seconds.
+        """
+        timeout = self.timeout + self.timeout_per_item * items
+        if span is not None:
+            timeout += self.timeout_per_item_hour * items * max(span, 0.0) / 3600.0
+        return min(timeout, max(self.max_timeout, self.timeout))
+
+    def backoff_for(self, attempt):
+        """Get the delay (in seconds) before retry number `attempt` (starting at 1)."""
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (1.0 - self.jitter * random.random())
+
+    def _before_call(self, service):
+        with self._lock:
+            circuit = self._circuits.setdefault(service, _Circuit())
+            if circuit.opened_at is None:
+                return
+            if time.monotonic() - circuit.opened_at < self.reset_timeout or circuit.trial_running:
+                raise CircuitOpenError("Too many failed requests to '{}', not trying again for now.".format(service))
+            circuit.trial_running = True
+
+    def _after_call(self, service, ok, retried=False):
+        with self._lock:
+            circuit = self._circuits[service]
+            circuit.trial_running = False
+            if ok:
+                circuit.failures = 0
+                circuit.opened_at = None
+                if not retried:
+                    self._budget = min(self._budget + self.retry_budget, self.max_retry_budget)
+                return
+            circuit.failures += 1
+            if self.failure_threshold is not None and circuit.failures >= self.failure_threshold:
+                circuit.opened_at = time.monotonic()
+
+    def _end_trial(self, service):
+        with self._lock:
+            self._circuits[service].trial_running = False
+
+    def _take_retry(self):
+        with self._lock:
+            if self._budget < 1.0:
+                return False
+            self._budget -= 1.0
+            return True
+
+    def is_open(self, service):
+        """Whether the circuit breaker for `service` is currently open."""
+        with self._lock:
+            circuit = self._circuits.get(service)
+            return circuit is not None and circuit.opened_at is not None
+
+    def call(self, service, fn, *args, timeout=None, items=0, span=None, **kwargs):
+        """Call `fn(*args, timeout=..., **kwargs)`, retrying according to this policy.
+
+        Args:
+          service (str): The name of the service, used for its circuit breaker.
+          fn (callable): Makes the request.  Must accept a `timeout` keyword argument.
+          timeout (float, optional): The timeout for each attempt.  If not given,
+            it is calculated from `items` and `span` with :meth:`timeout_for`.
+          items (int, optional): The number of things asked for.  Defaults to 0.
+          span (float, optional): The time span (in seconds) of the data asked for.
+        Returns:
+          Whatever `fn` returns.
+        Raises:
+          CircuitOpenError: If the circuit breaker for the service is open.
+        """
+        if timeout is None:
+            timeout = self.timeout_for(items, span)
+        attempt = 0
+        while True:
+            self._before_call(service)
+            try:
+                result = fn(*args, timeout=timeout, **kwargs)
+            except self.retry_on:
+                self._after_call(service, False)
+                attempt += 1
+                if attempt > self.retries or self.is_open(service) or not self._take_retry():
+                    raise
+                time.sleep(self.backoff_for(attempt))
+                continue
+            except Exception:
+                # The service answered, so it is up, even though the request failed.
+                self._after_call(service, True, retried=True)
+                raise
+            except BaseException:
+                # Interrupted (by KeyboardInterrupt, for example): this says nothing
+                # about the service, but the next call must be allowed to try it.
+                self._end_trial(service)
+                raise
+            self._after_call(service, True, retried=attempt > 0)
+            return result
+
+_policy = ServicePolicy()
+
+def get_policy():
+    """Get the policy used by all of the meme service wrappers."""
+    return _policy
+
+def set_policy(policy):
+    """Set the policy used by all of the meme service wrappers.
+
+    Args:
+      policy (ServicePolicy): The new policy.
+    """
+    global _policy
+    _policy = policy
@@ -0,0 +1,350 @@
+"""A caching proxy for the MEME services, shared by every process on a host.
+
+On a console host where many people (and many scripts) use meme at once, each
+process asks the central services the same questions: the same model tables,
+the same name lookups.  The proxy answers them locally instead.  It serves the
+same names as the real services:
+
+* `ds` and `hist` (RPC): Answers are cached for a short time (see `ttl`), and
+  identical requests that arrive together share one upstream request.
+* Model PVs (like "BMAD:SYS0:1:CU_HXR:LIVE:TWISS"): The proxy monitors each one
+  upstream once, and serves the latest value to every local client.  Local gets
+  and monitors never reach the model service.  The proxy only answers searches
+  for a model PV once its first value has arrived from upstream, so names the
+  model service doesn't have are never claimed.
+
+Cache statistics are served as an NTTable, on the PV named by `stats_name`.
+
+Run it with the `meme-proxy` command, pointing it at the real services:
+
+.. code-block:: bash
+
+  meme-proxy --upstream meme-services.example --port 5085
+
+Then point meme at it, with the usual EPICS settings (like
+`EPICS_PVA_ADDR_LIST=localhost`), or from Python:
+
+.. code-block:: python
+
+  import meme.context
+  meme.context.configure(conf={"EPICS_PVA_ADDR_LIST": "localhost", "EPICS_PVA_AUTO_ADDR_LIST": "NO"}, useenv=False)
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from p4p.nt import NTTable
+from p4p.client.thread import Context, Disconnected
+from p4p.server import Server, DynamicProvider
+from p4p.server.thread import SharedPV
+from .singleflight import SingleFlight
+from ._server import ServerMixin, add_server_arguments, rpc_pv, server_conf
+
+logger = logging.getLogger(__name__)
+
+default_model_pattern = r"[A-Z0-9_]+:SYS0:1:[A-Z0-9_]+:(LIVE|DESIGN):(TWISS|RMAT)"
+default_ttl = {"ds": 300.0, "hist": 10.0, "model": 10.0}
+rpc_services = ("ds", "hist")
+stats_table = NTTable([("service", "s"), ("hits", "l"), ("misses", "l"), ("errors", "l"),
+                       ("entries", "i"), ("upstream_updates", "l")])
+
+class TTLCache(object):
+    """A thread-safe dict whose entries expire `ttl` seconds after they are added.
+
+    When it holds `max_entries`, adding another one drops the least recently used.
+
+    Args:
+      ttl (float): How long (in seconds) each entry is kept.
+      max_entries (int, optional): The most entries to keep.
+    """
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Get (True, value) for a fresh entry, or (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class _Mirror(object):
+    """One model PV, monitored upstream once and served to local clients from a SharedPV."""
+    def __init__(self, proxy, name):
+        self.proxy = proxy
+        self.name = name
+        self.ready = False
+        self.error = None
+        self.created = time.monotonic()
+        self.updates = 0
+        self.pv = SharedPV(handler=self)
+        self.subscription = proxy.upstream.monitor(name, self._update, notify_disconnect=True)
+
+    def _update(self, value):
+        if isinstance(value, Exception):
+            # Keep serving the last value.  The monitor reconnects by itself.
+            if self.ready:
+                logger.warning("Lost the upstream monitor for %s: %s", self.name, value)
+            elif not isinstance(value, Disconnected):
+                # The proxy drops the mirror, and stops claiming the name.
+                self.error = value
+            return
+        self.updates += 1
+        if not self.ready:
+            self.pv.open(value)
+            self.ready = True
+            return
+        try:
+            self.pv.post(value)
+        except (TypeError, ValueError):
+            # The upstream PV changed type (after a restart, for example).
+            self.pv.close()
+            self.pv.open(value)
+
+    def rpc(self, pv, op):
+        self.proxy._forward("model", self.name, op)
+
+    def close(self):
+        self.subscription.close()
+        self.pv.close(destroy=True)
+
+class CachingProxy(ServerMixin):
+    """Serves the MEME services to local clients, from a shared cache.
+
+    See the module documentation for what is cached.  The proxy starts serving
+    when it is made, until :meth:`close`.
+
+    Args:
+      upstream (list of str, optional): The addresses ("host" or "host:port") to
+        search for the real services at.  Set this explicitly when the proxy runs
+        on the port its clients search, so it doesn't find itself.  By default,
+        the usual EPICS_PVA_* environment variables are used.
+      upstream_conf (dict, optional): More client settings for the upstream Context,
+        with the same names as the EPICS_PVA_* environment variables.
+      conf (dict, optional): Settings for the proxy's own server, with the same
+        names as the EPICS_PVAS_* environment variables (like EPICS_PVAS_SERVER_PORT).
+      useenv (bool, optional): Whether the server also reads its settings from the environment.
+      ttl (dict, optional): How long (in seconds) answers are cached, for any of
+        'ds', 'hist', and 'model' (RPCs to model PVs).  Defaults to 300, 10, and 10.
+      max_entries (int, optional): The most cached answers kept for each service.
+      model_pattern (str, optional): A regular expression for the model PV names to mirror.
+      max_mirrors (int, optional): The most model PVs mirrored at once.  Searches
+        for more model PVs go unanswered.
+      stats_name (str, optional): The name of the cache statistics PV.
+      timeout (float, optional): The timeout (in seconds) for upstream RPCs, and
+        for the first value of a mirrored model PV.  Model PVs which don't send
+        one in time (or send an error) aren't searched for upstream again for
+        the 'model' `ttl`.
+      max_workers (int, optional): The most upstream RPCs in progress at once.
+      stats_period (float, optional): How often (in seconds) the statistics PV is updated.
+    """
+    def __init__(self, upstream=None, upstream_conf=None, conf=None, useenv=True, ttl=None, max_entries=1000,
+                 model_pattern=default_model_pattern, max_mirrors=1000, stats_name="MEME:PROXY:STATS",
+                 timeout=10.0, max_workers=8, stats_period=1.0):
+        client_conf = None
+        if upstream is not None or upstream_conf is not None:
+            client_conf = {}
+            if upstream is not None:
+                client_conf.update({"EPICS_PVA_ADDR_LIST": " ".join(upstream), "EPICS_PVA_AUTO_ADDR_LIST": "NO"})
+            client_conf.update(upstream_conf or {})
+        # nt=False: pass Values through untouched, instead of unwrapping them.
+        self.upstream = Context("pva", conf=client_conf, useenv=client_conf is None, nt=False)
+        self.timeout = timeout
+        self.stats_name = stats_name
+        self.stats_period = stats_period
+        self.upstream_errors = {}
+        ttl = dict(default_ttl, **(ttl or {}))
+        self.caches = {service: TTLCache(ttl[service], max_entries) for service in ("ds", "hist", "model")}
+        self._model_regex = re.compile(model_pattern)
+        self.max_mirrors = max_mirrors
+        self._not_found = TTLCache(ttl["model"], max_entries)
+        self._flights = SingleFlight()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="meme-proxy")
+        self._lock = threading.Lock()
+        self._mirrors = {}
+        self._rpc_pvs = {}
+        for service in rpc_services:
+            self._rpc_pvs[service] = rpc_pv(_RPCHandler(self, service))
+        self._stats_pv = SharedPV(nt=stats_table, initial=self.stats())
+        self._closed = threading.Event()
+        self._stats_thread = threading.Thread(target=self._post_stats, name="meme-proxy-stats", daemon=True)
+        self._stats_thread.start()
+        self.provider = DynamicProvider("meme-proxy", self)
+        self.server = Server(providers=[self.provider], conf=conf, useenv=useenv)
+        logger.info("Serving %s", self.server.conf())
+
+    # DynamicProvider handler methods.
+    def testChannel(self, name):
+        if name in rpc_services or name == self.stats_name:
+            return True
+        if self._model_regex.fullmatch(name):
+            return self._claim(name)
+        return False
+
+    def makeChannel(self, name, peer):
+        if name in rpc_services:
+            return self._rpc_pvs[name]
+        if name == self.stats_name:
+            return self._stats_pv
+        with self._lock:
+            return self._mirrors[name].pv
+
+    def _claim(self, name):
+        """Answer a search for a model PV: only once its mirror has a value from upstream.
+
+        The first search starts mirroring the PV.  Until its first value arrives,
+        searches get DynamicProvider.NotYet, so clients keep searching without
+        the answer being cached.
+        """
+        if self._not_found.get(name)[0]:
+            return False
+        with self._lock:
+            mirror = self._mirrors.get(name)
+            if mirror is None and len(self._mirrors) < self.max_mirrors:
+                mirror = self._mirrors[name] = _Mirror(self, name)
+        if mirror is None:
+            logger.warning("Not mirroring %s: already mirroring %d model PVs.", name, self.max_mirrors)
+            return False
+        if mirror.ready:
+            return True
+        if mirror.error is not None:
+            self._drop_mirrors()
+            return False
+        return DynamicProvider.NotYet
+
+    def _drop_mirrors(self):
+        """Stop mirroring the model PVs which sent an error, or no value within `timeout`."""
+        now = time.monotonic()
+        with self._lock:
+            dropped = [mirror for mirror in self._mirrors.values()
+                       if not mirror.ready and (mirror.error is not None or now - mirror.created > self.timeout)]
+            for mirror in dropped:
+                del self._mirrors[mirror.name]
+        for mirror in dropped:
+            logger.info("Not mirroring %s: %s", mirror.name, mirror.error or "no value from upstream.")
+            self._not_found.put(mirror.name, True)
+            mirror.close()
+
+    def _forward(self, service, name, op):
+        request = op.value()
+        key = (name, json.dumps(request.todict(), sort_keys=True, default=str))
+        self._executor.submit(self._answer, service, name, key, request, op)
+
+    def _answer(self, service, name, key, request, op):
+        cache = self.caches[service]
+        try:
+            hit, response = cache.get(key)
+            if not hit:
+                response = self._flights.do(key, self._fetch, cache, key, name, request)
+        except Exception as e:
+            with self._lock:
+                self.upstream_errors[service] = self.upstream_errors.get(service, 0) + 1
+            logger.warning("Upstream %s request failed: %s", service, e)
+            op.done(error=str(e))
+            return
+        op.done(response)
+
+    def _fetch(self, cache, key, name, request):
+        response = self.upstream.rpc(name, request, timeout=self.timeout)
+        cache.put(key, response)
+        return response
+
+    def stats(self):
+        """Get the cache statistics, as a list of rows for the statistics PV.
+
+        Returns:
+          list of dict: One row for each of 'ds', 'hist', and 'model' (RPCs to model
+          PVs), plus a 'monitors' row where `entries` is the number of mirrored model
+          PVs, and `upstream_updates` is how many updates they have received.
+        """
+        rows = []
+        for service, cache in self.caches.items():
+            rows.append({"service": service, "hits": cache.hits, "misses": cache.misses,
+                         "errors": self.upstream_errors.get(service, 0), "entries": len(cache), "upstream_updates": 0})
+        mirrors = list(self._mirrors.values())
+        rows.append({"service": "monitors", "hits": 0, "misses": 0, "errors": 0, "entries": len(mirrors),
+                     "upstream_updates": sum(mirror.updates for mirror in mirrors)})
+        return rows
+
+    def _post_stats(self):
+        last = None
+        while not self._closed.wait(self.stats_period):
+            self._drop_mirrors()
+            rows = self.stats()
+            if rows != last:
+                self._stats_pv.post(rows)
+                last = rows
+
+    def close(self):
+        """Stop serving, and close the upstream connections."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.server.stop()
+        with self._lock:
+            mirrors, self._mirrors = list(self._mirrors.values()), {}
+        for mirror in mirrors:
+            mirror.close()
+        self._executor.shutdown(wait=True)
+        self.upstream.close()
+
+class _RPCHandler(object):
+    def __init__(self, proxy, service):
+        self.proxy = proxy
+        self.service = service
+
+    def rpc(self, pv, op):
+        self.proxy._forward(self.service, self.service, op)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A caching proxy for the MEME model, ds, and hist services.")
+    parser.add_argument("--upstream", action="append", required=True,
+                        help="An address (host or host:port) to find the real services at.  Can be given more than once.")
+    add_server_arguments(parser)
+    parser.add_argument("--ds-ttl", type=float, default=default_ttl["ds"], help="Seconds to cache ds answers.")
+    parser.add_argument("--hist-ttl", type=float, default=default_ttl["hist"], help="Seconds to cache hist answers.")
+    parser.add_argument("--model-ttl", type=float, default=default_ttl["model"], help="Seconds to cache model RPC answers.")
+    parser.add_argument("--max-entries", type=int, default=1000, help="The most cached answers kept per service.")
+    parser.add_argument("--model-pattern", default=default_model_pattern, help="A regular expression for the model PVs to mirror.")
+    parser.add_argument("--max-mirrors", type=int, default=1000, help="The most model PVs mirrored at once.")
+    parser.add_argument("--stats-name", default="MEME:PROXY:STATS", help="The name of the cache statistics PV.")
+    parser.add_argument("--timeout", type=float, default=10.0, help="The timeout for upstream RPCs, in seconds.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every upstream error and mirror.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    proxy = CachingProxy(upstream=args.upstream, conf=server_conf(args),
+                         ttl={"ds": args.ds_ttl, "hist": args.hist_ttl, "model": args.model_ttl},
+                         max_entries=args.max_entries, model_pattern=args.model_pattern, max_mirrors=args.max_mirrors,
+                         stats_name=args.stats_name, timeout=args.timeout)
+    proxy.run_forever()
+
+if __name__ == "__main__":
+    main()
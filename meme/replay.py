@@ -0,0 +1,297 @@
+"""Record the answers meme gets from the MEME services, and serve them back later.
+
+A recording is a file of every response meme got while recording: `ds` and
+`hist` RPCs, and gets of model PVs, each with how long it took.  Record one
+against the real services:
+
+.. code-block:: python
+
+  import meme.replay
+  with meme.replay.record("session.rec"):
+      run_my_script()
+
+Then serve it on a private port, with the `meme-replay` command (or
+:class:`ReplayServer`), and point meme (or :mod:`meme.loadgen`) at it:
+
+.. code-block:: bash
+
+  meme-replay session.rec --port 5095 --jitter 0.02
+
+Recordings are Python pickles.  Only replay recordings you trust.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import pickle
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from p4p import Type, Value
+from p4p.client.thread import Context
+from p4p.server import Server
+from p4p.server.thread import SharedPV
+from . import context
+from ._server import ServerMixin, add_server_arguments, rpc_pv, server_conf
+
+logger = logging.getLogger(__name__)
+
+class Recorder(object):
+    """Writes responses from the MEME services to a recording file.
+
+    Use :meth:`factory` as the Context factory for :func:`meme.context.configure`,
+    or just use :func:`record`, which does that for you.  Responses are appended,
+    so several sessions can go in one file.
+
+    Only successful responses which are p4p Values are recorded.  That covers
+    every MEME service; types that p4p unwraps (like NTScalar) are skipped.
+
+    Args:
+      path (str): The recording file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+
+    def factory(self, provider="pva", **context_kws):
+        """Make a Context which records its responses to this file."""
+        return RecordingContext(self, Context(provider, **context_kws))
+
+    def write(self, op, name, request, response, seconds):
+        """Add one response to the file.
+
+        Args:
+          op (str): 'get' or 'rpc'.
+          name (str): The PV name.
+          request: The pvRequest string of a get, or the request Value of an RPC.
+          response (Value): The response.
+          seconds (float): How long the request took.
+        """
+        if not isinstance(response, Value):
+            return
+        entry = {"op": op, "name": name, "key": request_key(op, request), "response": encode(response),
+                 "seconds": seconds, "time": time.time()}
+        with self._lock:
+            if self._file is None:
+                return
+            pickle.dump(entry, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class RecordingContext(object):
+    """Wraps a p4p Context, and records the response to each get and rpc.
+
+    Everything else (like monitors) is passed straight to the wrapped Context.
+    """
+    def __init__(self, recorder, ctx):
+        self.recorder = recorder
+        self.ctx = ctx
+
+    def get(self, name, request=None, *args, **kws):
+        if not isinstance(name, str):
+            return self.ctx.get(name, request, *args, **kws)
+        start = time.perf_counter()
+        response = self.ctx.get(name, request, *args, **kws)
+        self.recorder.write("get", name, request, response, time.perf_counter() - start)
+        return response
+
+    def rpc(self, name, value, *args, **kws):
+        start = time.perf_counter()
+        response = self.ctx.rpc(name, value, *args, **kws)
+        self.recorder.write("rpc", name, value, response, time.perf_counter() - start)
+        return response
+
+    def close(self):
+        self.ctx.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ctx, name)
+
+@contextlib.contextmanager
+def record(path, **context_kws):
+    """Record every response meme gets inside a `with` block.
+
+    The shared Context pool (see :mod:`meme.context`) is switched to recording
+    Contexts for the block, and back afterwards.
+
+    Args:
+      path (str): The recording file.  New responses are appended to it.
+      **context_kws: Extra keyword arguments for the Contexts, like `conf`.
+    Yields:
+      Recorder: The recorder.  Its `count` is the number of responses recorded so far.
+    """
+    recorder = Recorder(path)
+    pool = context._pool
+    previous_factory, previous_kws = pool.factory, dict(pool.context_kws)
+    pool.configure(factory=recorder.factory, **context_kws)
+    try:
+        yield recorder
+    finally:
+        pool.close()
+        pool.factory = previous_factory
+        pool.context_kws = previous_kws
+        recorder.close()
+
+def load(path):
+    """Read every entry from a recording file, as a list of dicts."""
+    entries = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                entries.append(pickle.load(f))
+            except EOFError:
+                return entries
+
+def request_key(op, request):
+    """A string which identifies a request, for matching it to a recorded one."""
+    if op == "get":
+        return request if request is None or isinstance(request, str) else str(request)
+    return json.dumps(request.todict(), sort_keys=True, default=str)
+
+def encode(value):
+    """Convert a Value to plain Python objects which pickle.  :func:`decode` converts them back."""
+    if isinstance(value, Value):
+        return ("Value", value.type().aspy(), {key: encode(value[key]) for key in value.keys()})
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    return value
+
+def decode(data):
+    if isinstance(data, tuple) and data and data[0] == "Value":
+        spec = data[1]
+        return Value(Type(spec[2], id=spec[1]), {key: decode(item) for key, item in data[2].items()})
+    if isinstance(data, list):
+        return [decode(item) for item in data]
+    return data
+
+def _leaf_count(spec):
+    if isinstance(spec, tuple):
+        return sum(_leaf_count(field) for _, field in spec[2])
+    return 1
+
+class ReplayServer(ServerMixin):
+    """Serves the responses in a recording, as the MEME services would.
+
+    RPCs are matched to a recorded request with the same PV name and arguments.
+    When one request was recorded more than once, its responses are served in
+    turn.  Gets of a recorded PV are answered with its recorded value (the one
+    with the most fields, if it was recorded with different field requests).
+
+    Latency is added to RPCs only.  Gets (like the model service's Twiss and
+    R-matrix tables) are answered by the server straight from memory, because
+    p4p's SharedPV has no hook to delay a get.  So a replay can't reproduce the
+    model service's latency: run :mod:`meme.loadgen` with `--replay`, which
+    leaves the 'model' operation out of the latency statistics.
+
+    Args:
+      path (str or list of dict): The recording file, or entries from :func:`load`.
+      latency (float, optional): Seconds to wait before answering each RPC.  By
+        default, each response waits as long as it took when it was recorded.
+      jitter (float, optional): Up to this many more seconds (picked at random)
+        to wait before answering each RPC.
+      strict (bool, optional): If True (the default), RPCs which weren't recorded
+        get an error.  If False, they get the recorded responses for the same PV
+        name in turn, so clients which ask for different times still get data.
+      conf (dict, optional): Server settings, with the same names as the
+        EPICS_PVAS_* environment variables (like EPICS_PVAS_SERVER_PORT).
+      useenv (bool, optional): Whether the server also reads its settings from the environment.
+      max_workers (int, optional): The most RPCs answered at once.
+      seed (int, optional): Seed for the jitter, for repeatable runs.
+    """
+    def __init__(self, path, latency=None, jitter=0.0, strict=True, conf=None, useenv=True, max_workers=32, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.strict = strict
+        self.served = 0
+        self.missed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._turns = {}
+        self._closed = threading.Event()
+        self._responses = {}
+        self._by_name = {}
+        values = {}
+        for entry in load(path) if isinstance(path, str) else path:
+            if entry["op"] == "rpc":
+                response = (entry["response"], entry["seconds"])
+                self._responses.setdefault((entry["name"], entry["key"]), []).append(response)
+                self._by_name.setdefault(entry["name"], []).append(response)
+            else:
+                value = decode(entry["response"])
+                previous = values.get(entry["name"])
+                if previous is None or _leaf_count(value.type().aspy()) >= _leaf_count(previous.type().aspy()):
+                    values[entry["name"]] = value
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="meme-replay")
+        # The server doesn't keep the PVs alive by itself.
+        self.pvs = {}
+        for name in set(values) | set(self._by_name):
+            handler = _ReplayHandler(self, name)
+            if name in values:
+                self.pvs[name] = SharedPV(handler=handler, initial=values[name])
+            else:
+                self.pvs[name] = rpc_pv(handler)
+        self.server = Server(providers=[self.pvs], conf=conf, useenv=useenv)
+        logger.info("Serving %d PVs on %s", len(self.pvs), self.server.conf())
+
+    def _answer(self, name, op):
+        key = (name, request_key("rpc", op.value()))
+        responses = self._responses.get(key)
+        if responses is None and not self.strict:
+            responses = self._by_name.get(name)
+        if not responses:
+            with self._lock:
+                self.missed += 1
+            op.done(error="No recorded response for this {} request.".format(name))
+            return
+        with self._lock:
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+            self.served += 1
+            delay = self.latency
+            if self.jitter:
+                delay = (delay or 0.0) + self._random.uniform(0.0, self.jitter)
+        response, seconds = responses[turn % len(responses)]
+        time.sleep(seconds if delay is None else delay)
+        op.done(decode(response))
+
+    def close(self):
+        """Stop serving."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self.server.stop()
+        self._executor.shutdown(wait=True)
+
+class _ReplayHandler(object):
+    def __init__(self, server, name):
+        self.server = server
+        self.name = name
+
+    def rpc(self, pv, op):
+        self.server._executor.submit(self.server._answer, self.name, op)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a recording of MEME service responses.")
+    parser.add_argument("recording", help="The recording file, made with meme.replay.record().")
+    parser.add_argument("--latency", type=float, help="Seconds to wait before each RPC response.  Defaults to the recorded time.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more seconds (at random) to wait before each RPC response.")
+    parser.add_argument("--loose", action="store_true", help="Answer requests which weren't recorded with other responses for the same PV.")
+    add_server_arguments(parser)
+    parser.add_argument("--seed", type=int, help="Seed for the jitter.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log what is served.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    server = ReplayServer(args.recording, latency=args.latency, jitter=args.jitter, strict=not args.loose,
+                          conf=server_conf(args), seed=args.seed)
+    server.run_forever()
+
+if __name__ == "__main__":
+    main()
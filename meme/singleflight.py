@@ -0,0 +1,78 @@
+"""Coalesce identical service requests that are in flight at the same time.
+
+When many threads ask a service the same question at the same moment, only
+the first one (the 'leader') actually makes the request.  The rest wait for
+the leader's request to finish, and all of them get its result (or its error).
+Nothing is cached: once a request finishes, the next identical request goes
+to the service again.
+"""
+import threading
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight(object):
+    """Runs at most one call per key at a time, sharing the result with concurrent callers.
+
+    Args:
+      enabled (bool, optional): If False, every call is made independently.
+        Defaults to True.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call `fn(*args, **kwargs)`, unless a call with the same key is already running.
+
+        Args:
+          key (hashable): Identifies the request.  Calls with equal keys are
+            considered identical.
+          fn (callable): The function which makes the request.  It should
+            have a timeout of its own, since callers sharing its request wait
+            for it to finish.
+        Returns:
+          Whatever `fn` returns.  Callers which share a request get the same object,
+          so they should not modify it.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """The number of distinct requests currently running."""
+        with self._lock:
+            return len(self._calls)
+
+# The group used by all of the meme service wrappers.
+flights = SingleFlight()
@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import meme.archive
+from meme.archive import archive
+from meme.archive.steps import StepFrame, StepFunction
+
+start = pd.Timestamp("2024-01-01", tz="UTC")
+end = start + pd.Timedelta(hours=6)
+rng = np.random.default_rng(5)
+# PV:B follows PV:A three seconds later, and PV:C is unrelated.  Samples are on change, a little before the range too.
+sample_ns = (start - pd.Timedelta(minutes=1)).value + np.cumsum(rng.integers(1, 20, 3000)) * 1000000000
+a = np.cumsum(rng.normal(size=len(sample_ns)))
+sample_values = {"PV:A": a, "PV:C": 100.0 + rng.normal(size=len(sample_ns))}
+lagged_ns = sample_ns + 3000000000
+
+def fake_fetch(pv, from_time, to_time, span, timeout, fields=None):
+  result = []
+  for name in pv:
+    ns, values = (lagged_ns, a) if name == "PV:B" else (sample_ns, sample_values[name])
+    first = np.searchsorted(ns, pd.Timestamp(from_time).value, side="right") - 1
+    last = np.searchsorted(ns, pd.Timestamp(to_time).value, side="right")
+    selected = slice(max(first, 0), last)
+    result.append({"pvName": name, "value": {"value": {"secondsPastEpoch": ns[selected] // 1000000000,
+                                                        "nanoseconds": ns[selected] % 1000000000, "values": values[selected]}}})
+  return result if len(pv) > 1 else result[0]["value"]["value"]
+
+def expected_grid():
+  frame = StepFrame([StepFunction(sample_ns, a, "PV:A"), StepFunction(lagged_ns, a, "PV:B"),
+                     StepFunction(sample_ns, sample_values["PV:C"], "PV:C")])
+  return frame.resample(1.0, start.value, end.value)
+
+class CorrelateTest(unittest.TestCase):
+  def test_matches_full_grid(self):
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      r = meme.archive.correlate(["PV:A", "PV:B", "PV:C"], start, end, chunk=1000, pvs_per_chunk=2, max_workers=3)
+    _, values = expected_grid()
+    complete = values[~np.isnan(values).any(axis=1)]
+    self.assertEqual(r["n"], len(complete))
+    np.testing.assert_allclose(r["correlation"], np.corrcoef(complete.T), atol=1e-9)
+    np.testing.assert_allclose(r["mean"], complete.mean(axis=0))
+    np.testing.assert_allclose(r["std"], complete.std(axis=0, ddof=1))
+    self.assertNotIn("lagged_correlation", r)
+
+  def test_lags_across_chunks(self):
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      r = meme.archive.correlate(["PV:A", "PV:B", "PV:C"], start, end, max_lag=5, chunk=600)
+    np.testing.assert_array_equal(r["lags"], np.arange(-5, 6))
+    lagged = r["lagged_correlation"]
+    self.assertEqual(lagged.shape, (11, 3, 3))
+    # PV:B at t + 3 s is PV:A at t.
+    self.assertEqual(np.argmax(lagged[:, 0, 1]), 5 + 3)
+    self.assertAlmostEqual(lagged[5 + 3, 0, 1], 1.0, places=2)
+    np.testing.assert_allclose(lagged[5], r["correlation"], atol=1e-3)
+    self.assertLess(np.abs(lagged[:, 0, 2]).max(), 0.2)
+    # Lagged products are checked directly against the whole grid, for one lag.
+    _, values = expected_grid()
+    x, y = values[:-2, 0], values[2:, 2]
+    keep = ~np.isnan(values).any(axis=1)
+    keep = keep[:-2] & keep[2:]
+    expected = np.cov(x[keep], y[keep])[0, 1]
+    self.assertAlmostEqual(lagged[5 + 2, 0, 2], expected / (r["std"][0] * r["std"][2]), places=9)
+
+  def test_chunking_does_not_change_result(self):
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      whole = meme.archive.correlate(["PV:A", "PV:C"], start, end, max_lag=2, chunk=6 * 3600)
+      pieces = meme.archive.correlate(["PV:A", "PV:C"], start, end, max_lag=2, chunk=777)
+    np.testing.assert_allclose(whole["correlation"], pieces["correlation"], atol=1e-9)
+    np.testing.assert_allclose(whole["lagged_correlation"], pieces["lagged_correlation"], atol=1e-9)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,203 @@
+import calendar
+import struct
+import threading
+import unittest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+import pytz
+import meme.archive
+from meme.archive import archive
+from meme.archive.appliance import ApplianceBackend, ApplianceError, decode_message, parse_time, unescape
+from meme.archive.appliance import SCALAR_DOUBLE, SCALAR_FLOAT, SCALAR_INT, SCALAR_STRING
+
+def varint(value):
+  value &= (1 << 64) - 1
+  out = bytearray()
+  while True:
+    byte = value & 0x7f
+    value >>= 7
+    if value:
+      out.append(byte | 0x80)
+    else:
+      out.append(byte)
+      return bytes(out)
+
+def field(number, wire_type, payload):
+  return varint(number << 3 | wire_type) + payload
+
+def escape(message):
+  return message.replace(b"\x1b", b"\x1b\x01").replace(b"\n", b"\x1b\x02").replace(b"\r", b"\x1b\x03")
+
+def header(pv, year, payload_type):
+  return field(1, 0, varint(payload_type)) + field(2, 2, varint(len(pv)) + pv.encode()) + field(3, 0, varint(year))
+
+def sample(seconds_into_year, nano, value, payload_type, severity=0, status=0):
+  if payload_type == SCALAR_DOUBLE:
+    val = field(3, 1, struct.pack("<d", value))
+  elif payload_type == SCALAR_FLOAT:
+    val = field(3, 5, struct.pack("<f", value))
+  else:
+    val = field(3, 0, varint((value << 1) ^ (value >> 31)))
+  message = field(1, 0, varint(seconds_into_year)) + field(2, 0, varint(nano)) + val
+  if severity:
+    message += field(4, 0, varint(severity))
+  if status:
+    message += field(5, 0, varint(status))
+  return message
+
+# Samples for each PV: (epoch seconds, nanoseconds, value, severity, status), across a new year.
+new_year = calendar.timegm((2024, 1, 1, 0, 0, 0))
+rng = np.random.default_rng(6)
+seconds = new_year - 500 + np.cumsum(rng.integers(1, 10, 200))
+# Values whose bytes include newlines, carriage returns, and escape characters.
+tricky = [struct.unpack("<d", bytes([0x0a, 0x1b, 0x0d, 0x1b, 0x01, 0x0a, 0xf0, 0x3f]))[0], 10.0, 27.0, 13.0]
+samples = {"PV:DOUBLE": (SCALAR_DOUBLE, [(int(s), 1000 * i, tricky[i] if i < 4 else float(rng.normal()), i % 3, i % 5) for i, s in enumerate(seconds)]),
+           "PV:FLOAT": (SCALAR_FLOAT, [(int(s), 0, float(np.float32(i / 4)), 0, 0) for i, s in enumerate(seconds)]),
+           "PV:INT": (SCALAR_INT, [(int(s), 0, i - 100, 0, 0) for i, s in enumerate(seconds)]),
+           "PV:STRING": (SCALAR_STRING, [])}
+
+def pb_stream(pv, start, end):
+  payload_type, pv_samples = samples[pv]
+  chunks, year = [], None
+  for s, nano, value, severity, status in pv_samples:
+    if not start <= s < end:
+      continue
+    sample_year = datetime.fromtimestamp(s, pytz.utc).year
+    if sample_year != year:
+      if chunks:
+        chunks.append(b"\n")
+      year = sample_year
+      chunks.append(escape(header(pv, year, payload_type)) + b"\n")
+    chunks.append(escape(sample(s - calendar.timegm((year, 1, 1, 0, 0, 0)), nano, value, payload_type, severity, status)) + b"\n")
+  if not chunks:
+    chunks.append(escape(header(pv, 2024, payload_type)) + b"\n")
+  return b"".join(chunks)
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  connections = set()
+
+  def setup(self):
+    super().setup()
+    Handler.connections.add(self.client_address)
+
+  def do_GET(self):
+    url = urlsplit(self.path)
+    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+    if query.get("pv") == "PV:ERROR":
+      # A long error page, more than the backend reads of it.
+      body = b"x" * 5000
+      self.send_response(500)
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+      return
+    if url.path != "/retrieval/data/getData.raw" or query["pv"] not in samples:
+      self.send_response(404)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+      return
+    start, end = (pd.Timestamp(query[key]).timestamp() for key in ("from", "to"))
+    body = pb_stream(query["pv"], start, end)
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-protobuf")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+class ApplianceTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+    cls.thread.start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    # A tiny block size makes lines straddle the blocks.
+    self.backend = ApplianceBackend("http://127.0.0.1:{}/retrieval".format(self.server.server_address[1]), max_workers=2, block_size=7)
+    meme.archive.set_backend(self.backend)
+
+  def tearDown(self):
+    meme.archive.set_backend(None)
+    self.backend.close()
+
+  def test_get_through_backend(self):
+    from_time = pd.Timestamp(int(seconds[0]), unit="s", tz="UTC").to_pydatetime()
+    to_time = pd.Timestamp(int(seconds[-1]) + 1, unit="s", tz="UTC").to_pydatetime()
+    data = meme.archive.get("PV:DOUBLE", from_time=from_time, to_time=to_time)
+    expected = samples["PV:DOUBLE"][1]
+    np.testing.assert_array_equal(data['secondsPastEpoch'], [s[0] for s in expected])
+    np.testing.assert_array_equal(data['nanoseconds'], [s[1] for s in expected])
+    np.testing.assert_array_equal(data['values'], [s[2] for s in expected])
+    np.testing.assert_array_equal(data['severity'], [s[3] for s in expected])
+    np.testing.assert_array_equal(data['status'], [s[4] for s in expected])
+
+  def test_many_pvs_and_types(self):
+    from_time = pd.Timestamp(int(seconds[0]), unit="s", tz="UTC").to_pydatetime()
+    to_time = pd.Timestamp(int(seconds[-1]) + 1, unit="s", tz="UTC").to_pydatetime()
+    data = meme.archive.get(["PV:FLOAT", "PV:INT", "PV:MISSING"], from_time=from_time, to_time=to_time, fields=['values'])
+    self.assertEqual([item['pvName'] for item in data], ["PV:FLOAT", "PV:INT", "PV:MISSING"])
+    self.assertEqual(set(data[0]['value']['value']), {'secondsPastEpoch', 'nanoseconds', 'values'})
+    np.testing.assert_array_equal(data[0]['value']['value']['values'], [s[2] for s in samples["PV:FLOAT"][1]])
+    np.testing.assert_array_equal(data[1]['value']['value']['values'], np.arange(len(seconds)) - 100)
+    self.assertEqual(len(data[2]['value']['value']['values']), 0)
+    steps = meme.archive.get_steps(["PV:INT"], from_time, to_time)
+    self.assertEqual(len(steps["PV:INT"]), len(seconds))
+
+  def test_connections_are_kept_alive(self):
+    Handler.connections.clear()
+    from_time = pd.Timestamp(int(seconds[0]), unit="s", tz="UTC").to_pydatetime()
+    for _ in range(5):
+      meme.archive.get(["PV:DOUBLE", "PV:FLOAT"], from_time=from_time, to_time="now")
+    self.assertLessEqual(len(Handler.connections), 2)
+
+  def test_unsupported_type(self):
+    with self.assertRaises(ApplianceError):
+      meme.archive.get("PV:STRING", from_time="1 hour ago", to_time="now")
+
+  def test_connection_recovers_after_error(self):
+    backend = ApplianceBackend("http://127.0.0.1:{}/retrieval".format(self.server.server_address[1]), max_workers=1)
+    self.addCleanup(backend.close)
+    from_time = pd.Timestamp(int(seconds[0]), unit="s", tz="UTC").to_pydatetime()
+    for _ in range(2):
+      with self.assertRaises(ApplianceError):
+        backend.fetch("PV:ERROR", from_time, "now")
+      with self.assertRaises(ApplianceError):
+        backend.fetch("PV:STRING", from_time, "now")
+      data = backend.fetch("PV:DOUBLE", from_time, "now")
+      self.assertEqual(len(data['values']), len(seconds))
+
+class DecodeTest(unittest.TestCase):
+  def test_unescape(self):
+    for raw in (b"\x1b\n", b"\x1b\x01\x02", b"\r\n\x1b\x1b", b"plain"):
+      self.assertEqual(unescape(escape(raw)), raw)
+
+  def test_decode_message(self):
+    message = sample(12345, 678, -3, SCALAR_INT, severity=2)
+    self.assertEqual(decode_message(message), {1: 12345, 2: 678, 3: 5, 4: 2})
+    with self.assertRaises(ValueError):
+      decode_message(message[:-1] + b"\x80")
+
+  def test_parse_time(self):
+    now = datetime(2024, 6, 1, 12, tzinfo=pytz.utc)
+    self.assertEqual(parse_time("1 hour ago", now), datetime(2024, 6, 1, 11, tzinfo=pytz.utc))
+    self.assertEqual(parse_time("90 min ago", now), datetime(2024, 6, 1, 10, 30, tzinfo=pytz.utc))
+    self.assertEqual(parse_time("2 days ago", now), datetime(2024, 5, 30, 12, tzinfo=pytz.utc))
+    self.assertEqual(parse_time("now", now), now)
+    self.assertEqual(parse_time("2024-01-01T08:00:00.000Z"), datetime(2024, 1, 1, 8, tzinfo=pytz.utc))
+    # Without a timezone, times are in 'US/Pacific'.
+    self.assertEqual(parse_time("2024-01-01 00:00"), datetime(2024, 1, 1, 8, tzinfo=pytz.utc))
+
+if __name__ == '__main__':
+  unittest.main()
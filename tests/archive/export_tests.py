@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import meme.archive
+from meme.archive import archive
+
+try:
+  import pyarrow
+except ImportError:
+  pyarrow = None
+try:
+  import h5py
+except ImportError:
+  h5py = None
+
+start = pd.Timestamp("2024-01-01", tz="UTC")
+end = start + pd.Timedelta(hours=6)
+# One sample every 7 seconds for each PV, from a little before the export starts.
+sample_ns = (start - pd.Timedelta(minutes=1)).value + np.arange(0, 8 * 3600, 7, dtype=np.int64) * 1000000000
+pvs = ["PV:{}".format(i) for i in range(5)]
+
+class FakeArchive(object):
+  """Acts like the archiver, and can fail after some number of requests."""
+  def __init__(self, fail_after=None):
+    self.calls = 0
+    self.fail_after = fail_after
+    self.lock = threading.Lock()
+
+  def __call__(self, pv, from_time, to_time, span, timeout, fields=None):
+    with self.lock:
+      self.calls += 1
+      if self.fail_after is not None and self.calls > self.fail_after:
+        raise TimeoutError("hist")
+    first = np.searchsorted(sample_ns, pd.Timestamp(from_time).value, side="right") - 1
+    last = np.searchsorted(sample_ns, pd.Timestamp(to_time).value, side="right")
+    ns = sample_ns[max(first, 0):last]
+    result = []
+    for name in pv:
+      offset = pvs.index(name)
+      result.append({"pvName": name, "value": {"value": {"secondsPastEpoch": ns // 1000000000, "nanoseconds": ns % 1000000000,
+                                                          "values": ns / 1e9 + offset, "severity": np.zeros(len(ns), dtype=int), "status": np.full(len(ns), offset)}}})
+    return result if len(pv) > 1 else result[0]["value"]["value"]
+
+def expected_times():
+  return sample_ns[(sample_ns >= start.value) & (sample_ns < end.value)]
+
+class ExportTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.dir.cleanup)
+
+  def export(self, path, fake, format):
+    with mock.patch.object(archive, "_fetch", side_effect=fake):
+      return meme.archive.export(pvs, start, end, path, format=format, chunk=3600, pvs_per_chunk=2, max_workers=2)
+
+  @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+  def test_parquet_export_and_resume(self):
+    path = os.path.join(self.dir.name, "dataset")
+    with self.assertRaises(TimeoutError):
+      self.export(path, FakeArchive(fail_after=7), "parquet")
+    rerun = FakeArchive()
+    manifest = self.export(path, rerun, "parquet")
+    self.assertTrue(manifest["complete"])
+    self.assertEqual(len(manifest["done"]), 18)
+    self.assertLess(rerun.calls, 18)
+    df = pd.read_parquet(path)
+    self.assertEqual(len(df), len(pvs) * len(expected_times()))
+    pv3 = df[df["pv"] == "PV:3"].sort_values("time")
+    np.testing.assert_array_equal(pd.DatetimeIndex(pv3["time"]).as_unit("ns").asi8, expected_times())
+    np.testing.assert_allclose(pv3["value"], expected_times() / 1e9 + 3)
+    self.assertTrue((pv3["status"] == 3).all())
+
+  @unittest.skipIf(h5py is None, "h5py is not installed")
+  def test_hdf5_export_and_resume(self):
+    path = os.path.join(self.dir.name, "export.h5")
+    with self.assertRaises(TimeoutError):
+      self.export(path, FakeArchive(fail_after=5), "hdf5")
+    self.export(path, FakeArchive(), "hdf5")
+    with h5py.File(path, "r") as f:
+      self.assertEqual(sorted(f[name].attrs["pv"] for name in f), pvs)
+      np.testing.assert_array_equal(f["PV:1"]["time"][:], expected_times())
+      np.testing.assert_allclose(f["PV:1"]["value"][:], expected_times() / 1e9 + 1)
+
+  @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+  def test_different_settings_are_refused(self):
+    path = os.path.join(self.dir.name, "dataset")
+    self.export(path, FakeArchive(), "parquet")
+    with mock.patch.object(archive, "_fetch", side_effect=FakeArchive()):
+      with self.assertRaises(ValueError):
+        meme.archive.export(pvs[:2], start, end, path, chunk=3600)
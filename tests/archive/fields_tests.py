@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+from p4p import Type, Value
+from p4p.nt import NTTable
+import meme.archive
+from meme.archive import archive
+
+single_pv_struct = NTTable([("secondsPastEpoch", "l"), ("values", "d"), ("nanoseconds", "i"), ("severity", "i"), ("status", "i")])
+multi_pv_struct = Type([("pvName", "s"), ("value", ("S", "NTComplexTable", single_pv_struct.type.items()))])
+multi_response_struct = Type([("value", "av")])
+rows = [{"secondsPastEpoch": 1, "values": 123.45, "nanoseconds": 5, "severity": 0, "status": 0}]
+
+def fake_service(pv, **kws):
+  pvs = pv.split(",")
+  if len(pvs) == 1:
+    return single_pv_struct.wrap(rows)
+  return Value(multi_response_struct, {"value": [Value(multi_pv_struct, {"pvName": p, "value": single_pv_struct.wrap(rows)}) for p in pvs]})
+
+class ArchiveFieldsTest(unittest.TestCase):
+  def setUp(self):
+    patcher = mock.patch.object(archive, "hist_service_get", side_effect=fake_service)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_single_pv(self):
+    r = meme.archive.get("PV:A", fields=["values"])
+    self.assertEqual(sorted(r), ["nanoseconds", "secondsPastEpoch", "values"])
+    self.assertEqual(list(r["values"]), [123.45])
+    self.assertEqual(sorted(meme.archive.get("PV:A")), ["nanoseconds", "secondsPastEpoch", "severity", "status", "values"])
+
+  def test_multiple_pvs_and_dataframe(self):
+    r = meme.archive.get(["PV:A", "PV:B"], fields=["values"])
+    self.assertEqual([item["pvName"] for item in r], ["PV:A", "PV:B"])
+    self.assertEqual(sorted(r[1]["value"]["value"]), ["nanoseconds", "secondsPastEpoch", "values"])
+    self.assertEqual(list(meme.archive.convert_to_dataframe(r).columns), ["PV:A", "PV:B"])
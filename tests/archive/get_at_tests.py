@@ -0,0 +1,78 @@
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import meme.archive
+from meme.archive import archive
+
+start = pd.Timestamp("2024-01-01", tz="UTC")
+# Samples every 10.5 seconds for a day, with a different slope for each PV.
+sample_times = start + pd.to_timedelta(np.arange(0, 86400, 10.5), unit="s")
+slopes = {"PV:A": 1.0, "PV:B": -2.0}
+
+def fake_fetch(pv, from_time, to_time, span, timeout, fields=None):
+  """Acts like the archiver: the samples in the range, plus the last one before it."""
+  first = np.searchsorted(sample_times, pd.Timestamp(from_time), side="right") - 1
+  last = np.searchsorted(sample_times, pd.Timestamp(to_time), side="right")
+  times = sample_times[max(first, 0):last]
+  ns = times.asi8
+  fake_fetch.requests.append((from_time, to_time))
+  result = []
+  for name in pv:
+    result.append({"pvName": name, "value": {"value": {
+      "secondsPastEpoch": ns // 1000000000, "nanoseconds": ns % 1000000000,
+      "values": slopes[name] * np.arange(max(first, 0), last, dtype=float)}}})
+  return result if len(pv) > 1 else result[0]["value"]["value"]
+
+class GetAtTest(unittest.TestCase):
+  def setUp(self):
+    fake_fetch.requests = []
+
+  def expected(self, timestamps, pv):
+    positions = np.searchsorted(sample_times, timestamps, side="right") - 1
+    return np.where(positions >= 0, slopes[pv] * positions, np.nan)
+
+  def test_asof_values(self):
+    rng = np.random.default_rng(1)
+    offsets = np.concatenate((rng.uniform(-60, 3600, 200), rng.uniform(50000, 54000, 200)))
+    timestamps = start + pd.to_timedelta(offsets, unit="s")
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      values = meme.archive.get_at(["PV:A", "PV:B"], timestamps)
+    self.assertEqual(values.shape, (400, 2))
+    np.testing.assert_array_equal(values[:, 0], self.expected(timestamps, "PV:A"))
+    np.testing.assert_array_equal(values[:, 1], self.expected(timestamps, "PV:B"))
+    # The big gap between the two groups of times splits them into two requests.
+    self.assertEqual(len(fake_fetch.requests), 2)
+
+  def test_single_pv_and_naive_local_times(self):
+    local = pd.DatetimeIndex(["2024-01-01 00:00:05", "2023-12-31 16:00:30"])
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      values = meme.archive.get_at("PV:A", local)
+    np.testing.assert_array_equal(values[:, 0], self.expected(local.tz_localize("US/Pacific").tz_convert("UTC"), "PV:A"))
+
+  def test_repeated_pvs(self):
+    timestamps = [start + pd.Timedelta(seconds=11), start + pd.Timedelta(seconds=30)]
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      values = meme.archive.get_at(["PV:A", "PV:A", "PV:B"], timestamps)
+      single = meme.archive.get_at(["PV:B", "PV:B"], timestamps)
+    np.testing.assert_array_equal(values, [[1.0, 1.0, -2.0], [2.0, 2.0, -4.0]])
+    np.testing.assert_array_equal(single, [[-2.0, -2.0], [-4.0, -4.0]])
+
+  def test_long_runs_are_split(self):
+    timestamps = start + pd.to_timedelta(np.arange(100, 4 * 3600, 60.0), unit="s")
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      values = meme.archive.get_at(["PV:A", "PV:B"], timestamps, max_span=3600.0)
+    self.assertEqual(len(fake_fetch.requests), 4)
+    for from_time, to_time in fake_fetch.requests:
+      self.assertLessEqual((pd.Timestamp(to_time) - pd.Timestamp(from_time)).total_seconds(), 3601)
+    np.testing.assert_array_equal(values[:, 0], self.expected(timestamps, "PV:A"))
+    np.testing.assert_array_equal(values[:, 1], self.expected(timestamps, "PV:B"))
+    with self.assertRaises(ValueError):
+      meme.archive.get_at("PV:A", timestamps, max_span=0)
+
+  def test_times_before_first_sample_are_nan(self):
+    timestamps = [start - pd.Timedelta(seconds=5), start + pd.Timedelta(seconds=11)]
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      values = meme.archive.get_at(["PV:A", "PV:B"], timestamps)
+    self.assertTrue(np.isnan(values[0]).all())
+    np.testing.assert_array_equal(values[1], [1.0, -2.0])
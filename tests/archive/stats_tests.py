@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import meme.archive
+from meme.archive import archive
+from meme.archive.summary import Moments, QuantileSketch
+
+start = pd.Timestamp("2024-01-01", tz="UTC")
+end = start + pd.Timedelta(days=2)
+rng = np.random.default_rng(2)
+# Irregular, on-change samples, starting a little before the range.
+sample_ns = (start - pd.Timedelta(minutes=5)).value + np.cumsum(rng.integers(1, 120, 5000)) * 1000000000
+sample_values = {"PV:A": rng.normal(5.0, 2.0, len(sample_ns)), "PV:B": rng.integers(0, 2, len(sample_ns)).astype(float)}
+
+def fake_fetch(pv, from_time, to_time, span, timeout, fields=None):
+  first = np.searchsorted(sample_ns, pd.Timestamp(from_time).value, side="right") - 1
+  last = np.searchsorted(sample_ns, pd.Timestamp(to_time).value, side="right")
+  selected = slice(max(first, 0), last)
+  ns = sample_ns[selected]
+  result = [{"pvName": name, "value": {"value": {"secondsPastEpoch": ns // 1000000000, "nanoseconds": ns % 1000000000,
+                                                  "values": sample_values[name][selected]}}} for name in pv]
+  return result if len(pv) > 1 else result[0]["value"]["value"]
+
+class StatsTest(unittest.TestCase):
+  def test_matches_full_history(self):
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      s = meme.archive.stats(["PV:A", "PV:B"], start, end, chunk=3 * 3600, pvs_per_chunk=1, seed=0)
+    inside = (sample_ns >= start.value) & (sample_ns < end.value)
+    a = sample_values["PV:A"][inside]
+    self.assertEqual(s["PV:A"]["count"], len(a))
+    self.assertAlmostEqual(s["PV:A"]["mean"], a.mean())
+    self.assertAlmostEqual(s["PV:A"]["std"], a.std(ddof=1))
+    self.assertEqual((s["PV:A"]["min"], s["PV:A"]["max"]), (a.min(), a.max()))
+    for q, value in s["PV:A"]["quantiles"].items():
+      self.assertLess(abs(np.mean(a <= value) - q), 0.02)
+    # Each value holds until the next sample, with the value from before the range covering its start.
+    first = np.searchsorted(sample_ns, start.value, side="right") - 1
+    last = np.searchsorted(sample_ns, end.value, side="left")
+    begins = np.maximum(sample_ns[first:last], start.value)
+    durations = np.diff(np.append(begins, end.value))
+    b = sample_values["PV:B"][first:last]
+    self.assertAlmostEqual(s["PV:B"]["time_weighted_mean"], np.dot(b, durations) / durations.sum())
+    self.assertAlmostEqual(s["PV:B"]["duty_cycle"], durations[b > 0].sum() / durations.sum())
+    self.assertAlmostEqual(s["PV:B"]["covered_seconds"], (end - start).total_seconds())
+
+class AccumulatorTest(unittest.TestCase):
+  def test_moments_merge(self):
+    values = np.random.default_rng(3).normal(size=1000)
+    merged = Moments()
+    for part in np.array_split(values, 7):
+      m = Moments()
+      m.update(part)
+      merged.merge(m)
+    self.assertAlmostEqual(merged.mean, values.mean())
+    self.assertAlmostEqual(merged.variance, values.var(ddof=1))
+
+  def test_quantile_sketch_is_small_and_accurate(self):
+    values = np.random.default_rng(4).exponential(size=200000)
+    sketch = QuantileSketch(seed=1)
+    for part in np.array_split(values, 50):
+      other = QuantileSketch(seed=2)
+      other.update(part)
+      sketch.merge(other)
+    self.assertEqual(sketch.count, len(values))
+    self.assertLess(sum(len(level) for level in sketch.levels), 2000)
+    for q, value in zip([0.01, 0.5, 0.99], sketch.quantiles([0.01, 0.5, 0.99])):
+      self.assertLess(abs(np.mean(values <= value) - q), 0.02)
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import meme.archive
+from meme.archive import StepFunction, StepFrame, archive
+
+second = 1000000000
+
+def archive_data(name, seconds, values):
+  return {"pvName": name, "value": {"value": {"secondsPastEpoch": np.array(seconds), "nanoseconds": np.zeros(len(seconds), dtype=int), "values": np.array(values, dtype=float)}}}
+
+class StepFunctionTest(unittest.TestCase):
+  def test_compress_and_at(self):
+    step = StepFunction(np.array([10, 20, 30, 40]) * second, [1.0, 1.0, 2.0, 2.0], name="PV:A")
+    self.assertEqual(len(step), 2)
+    np.testing.assert_array_equal(step.at(np.array([5, 10, 25, 35, 100]) * second), [np.nan, 1.0, 1.0, 2.0, 2.0])
+    self.assertEqual(len(StepFunction([1, 2], [1.0, 1.0], compress=False)), 2)
+
+  def test_at_datetimes(self):
+    step = StepFunction([pd.Timestamp("2024-01-01 08:00", tz="UTC").value], [3.0])
+    # Naive times are US/Pacific, so midnight local is 08:00 UTC.
+    np.testing.assert_array_equal(step.at(pd.DatetimeIndex(["2023-12-31 23:59", "2024-01-01 00:00"])), [np.nan, 3.0])
+
+  def test_at_timezone_aware_times(self):
+    step = StepFunction([pd.Timestamp("2024-01-01 08:00", tz="UTC").value], [3.0])
+    times = pd.DatetimeIndex(["2024-01-01 07:59", "2024-01-01 08:00"]).tz_localize("UTC")
+    np.testing.assert_array_equal(step.at(times), [np.nan, 3.0])
+    np.testing.assert_array_equal(step.at(pd.Series(times)), [np.nan, 3.0])
+    np.testing.assert_array_equal(StepFrame([step]).at(times.tz_convert("US/Pacific"))[:, 0], [np.nan, 3.0])
+
+class StepFrameTest(unittest.TestCase):
+  def setUp(self):
+    fast = archive_data("FAST", range(0, 100), np.arange(100) % 7)
+    slow = archive_data("SLOW", [50], [9.0])
+    self.data = [fast, slow]
+    self.frame = StepFrame.from_archive(self.data)
+
+  def test_resample(self):
+    grid, values = self.frame.resample(10.0, start=0, end=100 * second)
+    np.testing.assert_array_equal(grid, np.arange(0, 100, 10) * second)
+    np.testing.assert_array_equal(values[:, 0], np.arange(0, 100, 10) % 7)
+    np.testing.assert_array_equal(values[:, 1], [np.nan] * 5 + [9.0] * 5)
+    df = self.frame.resample(10.0, as_dataframe=True)
+    self.assertEqual(list(df.columns), ["FAST", "SLOW"])
+    self.assertEqual(len(df), 10)
+
+  def test_repeated_names(self):
+    frame = StepFrame.from_archive(self.data, ["SLOW", "FAST", "SLOW"])
+    self.assertEqual(frame.names, ["SLOW", "FAST", "SLOW"])
+    values = frame.at(np.array([60]) * second)
+    np.testing.assert_array_equal(values, [[9.0, 60 % 7, 9.0]])
+    self.assertIs(frame["SLOW"], frame.steps[0])
+
+  def test_to_dataframe_only_carries_forward(self):
+    df = self.frame.to_dataframe()
+    self.assertEqual(len(df), 100)
+    self.assertTrue(np.isnan(df["SLOW"].iloc[49]))
+    self.assertEqual(df["SLOW"].iloc[99], 9.0)
+
+  def test_get_steps(self):
+    with mock.patch.object(archive, "_fetch", return_value=self.data):
+      steps = meme.archive.get_steps(["FAST", "SLOW"])
+    self.assertEqual(steps.names, ["FAST", "SLOW"])
+    self.assertEqual(len(steps["SLOW"]), 1)
+    np.testing.assert_array_equal(steps.at([55 * second]), [[55 % 7, 9.0]])
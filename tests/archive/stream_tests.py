@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+import threading
+import numpy as np
+from p4p.nt import NTScalar
+from meme.archive import ArchiveStream, archive, stream
+
+second = 1000000000
+
+class FakeSubscription(object):
+  def __init__(self):
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+class FakeContext(object):
+  def __init__(self):
+    self.callbacks = {}
+    self.subscriptions = []
+
+  def monitor(self, name, cb, notify_disconnect=False):
+    self.callbacks[name] = cb
+    self.subscriptions.append(FakeSubscription())
+    return self.subscriptions[-1]
+
+  def post(self, pv, seconds, value):
+    self.callbacks[pv](NTScalar("d").wrap(value, timestamp=seconds))
+
+def history(pvs, seconds):
+  return [{"pvName": pv, "value": {"value": {"secondsPastEpoch": np.array(seconds), "nanoseconds": np.zeros(len(seconds), dtype=int),
+                                              "values": np.array(seconds, dtype=float) * 10}}} for pv in pvs]
+
+class ArchiveStreamTest(unittest.TestCase):
+  def setUp(self):
+    self.ctx = FakeContext()
+    patcher = mock.patch.object(stream, "get_context", return_value=self.ctx)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_handoff_drops_overlap(self):
+    def fetch(pv, from_time, to_time, span, timeout, fields=None):
+      # Updates that arrive during the backfill, some of them already archived.
+      self.ctx.post("PV:A", 102, 1020.0)
+      self.ctx.post("PV:A", 103, 1030.0)
+      self.ctx.post("PV:B", 104, 1040.0)
+      return history(pv, [100, 101, 102, 103])
+    with mock.patch.object(archive, "_fetch", side_effect=fetch):
+      s = ArchiveStream(["PV:A", "PV:B"])
+    self.ctx.post("PV:A", 103, -1.0)  # The current value, sent again on reconnect.
+    self.ctx.post("PV:A", 105, 1050.0)
+    times, values = s.latest("PV:A")
+    np.testing.assert_array_equal(times, np.array([100, 101, 102, 103, 105]) * second)
+    np.testing.assert_array_equal(values, [1000.0, 1010.0, 1020.0, 1030.0, 1050.0])
+    self.assertEqual(s.boundary["PV:B"], 103 * second)
+    np.testing.assert_array_equal(s.latest("PV:B")[0], np.array([100, 101, 102, 103, 104]) * second)
+    s.close()
+    self.assertTrue(all(sub.closed for sub in self.ctx.subscriptions))
+
+  def test_chunks(self):
+    with mock.patch.object(archive, "_fetch", side_effect=lambda pv, *args: history(pv, [1, 2])):
+      s = ArchiveStream(["PV:A", "PV:B"], buffer_size=3)
+    chunks = s.chunks(timeout=5)
+    first = [next(chunks), next(chunks)]
+    self.assertEqual([pv for pv, _, _ in first], ["PV:A", "PV:B"])
+    np.testing.assert_array_equal(first[0][2], [10.0, 20.0])
+    threading.Timer(0.05, self.ctx.post, ("PV:B", 3, 7.0)).start()
+    pv, times, values = next(chunks)
+    self.assertEqual(pv, "PV:B")
+    np.testing.assert_array_equal(values, [7.0])
+    for t in range(4, 8):
+      self.ctx.post("PV:A", t, float(t))
+    # The ring buffer (and the unread chunk) only keep the newest samples.
+    np.testing.assert_array_equal(s.latest("PV:A")[1], [5.0, 6.0, 7.0])
+    np.testing.assert_array_equal(next(chunks)[2], [5.0, 6.0, 7.0])
+    s.close()
+    self.assertEqual(list(chunks), [])
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from meme.archive import TimeSeries, to_timeseries
+
+class TimeSeriesTest(unittest.TestCase):
+  def test_unbounded_append_and_extend(self):
+    ts = TimeSeries("PV:A")
+    for t in range(100):
+      ts.append(t, t * 0.5)
+    ts.extend(np.arange(100, 1000), np.arange(100, 1000) * 0.5)
+    self.assertEqual(len(ts), 1000)
+    np.testing.assert_array_equal(ts.times, np.arange(1000))
+    np.testing.assert_array_equal(ts.values, np.arange(1000) * 0.5)
+
+  def test_ring_keeps_newest_samples_contiguous(self):
+    ts = TimeSeries("PV:A", capacity=5)
+    expected = []
+    for t in range(23):
+      if t % 4 == 0:
+        chunk = np.arange(t * 10, t * 10 + t % 7)
+        ts.extend(chunk, chunk * 2.0)
+        expected.extend(chunk)
+      else:
+        ts.append(t * 10 + 9, (t * 10 + 9) * 2.0)
+        expected.append(t * 10 + 9)
+      np.testing.assert_array_equal(ts.times, expected[-5:])
+      np.testing.assert_array_equal(ts.values, np.array(expected[-5:]) * 2.0)
+    self.assertTrue(np.shares_memory(ts.times, ts._times))
+
+  def test_window_and_last(self):
+    ts = TimeSeries("PV:A", capacity=8, times=np.arange(20), values=np.arange(20.0))
+    np.testing.assert_array_equal(ts.window(14, 17).times, [14, 15, 16])
+    np.testing.assert_array_equal(ts.window(start=18).values, [18.0, 19.0])
+    np.testing.assert_array_equal(ts.last(3).times, [17, 18, 19])
+    self.assertEqual(len(ts.last(100)), 8)
+    ts.clear()
+    self.assertEqual(len(ts), 0)
+
+  def test_to_series_shares_values(self):
+    ts = TimeSeries("PV:A", times=np.array([0, 1000000000]), values=[1.0, 2.0])
+    series = ts.to_series()
+    self.assertTrue(np.shares_memory(series.to_numpy(), ts._values))
+    self.assertEqual(series.name, "PV:A")
+    self.assertEqual(str(ts.to_series(tz="US/Pacific").index[1]), "1969-12-31 16:00:01-08:00")
+
+  def test_from_archive_data(self):
+    data = {"secondsPastEpoch": [1, 2], "nanoseconds": [5, 0], "values": [3.0, 4.0]}
+    ts = to_timeseries(data, "PV:A")
+    np.testing.assert_array_equal(ts.times, [1000000005, 2000000000])
+    many = to_timeseries([{"pvName": "PV:B", "value": {"value": data}}])
+    self.assertEqual(list(many), ["PV:B"])
+    np.testing.assert_array_equal(many["PV:B"].values, [3.0, 4.0])
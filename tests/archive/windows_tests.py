@@ -0,0 +1,54 @@
+import unittest
+from unittest import mock
+from datetime import datetime
+import threading
+import pandas as pd
+import pytz
+import meme.archive
+from meme.archive import archive
+
+def fake_fetch(pv, from_time, to_time, span, timeout, fields=None):
+  return {"pv": pv, "from": from_time, "to": to_time, "span": span}
+
+class GetWindowsTest(unittest.TestCase):
+  def test_naive_times_are_pacific(self):
+    windows = [(datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 16)),
+               (datetime(2024, 7, 1, 8), datetime(2024, 7, 1, 16))]
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      r = meme.archive.get_windows("PV:A", windows)
+    self.assertEqual(list(r), windows)
+    self.assertEqual(r[windows[0]]["from"], "2024-01-01T16:00:00.000Z")
+    self.assertEqual(r[windows[1]]["to"], "2024-07-01T23:00:00.000Z")
+    self.assertEqual(r[windows[0]]["span"], 8 * 3600)
+
+  def test_matches_single_window_conversion(self):
+    from_time, to_time = datetime(2023, 3, 12, 12, 30), datetime(2023, 11, 5, 12)
+    expected = archive.iso8601_string_from_datetime(archive.convert_datetime_to_UTC(from_time))
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      r = meme.archive.get_windows("PV:A", [(from_time, to_time)])
+    self.assertEqual(r[(from_time, to_time)]["from"], expected)
+
+  def test_interval_index_and_mixed_timezones(self):
+    shifts = pd.interval_range(start=pd.Timestamp("2024-01-01 07:00", tz="UTC"), periods=3, freq="8h")
+    with mock.patch.object(archive, "_fetch", side_effect=fake_fetch):
+      r = meme.archive.get_windows("PV:A", shifts)
+      mixed = meme.archive.get_windows("PV:A", [(datetime(2024, 1, 1), pytz.utc.localize(datetime(2024, 1, 2))), ("1 hour ago", "now")])
+    self.assertEqual(list(r), list(shifts))
+    self.assertEqual(r[shifts[1]]["from"], "2024-01-01T15:00:00.000Z")
+    self.assertEqual(list(mixed.values())[0]["to"], "2024-01-02T00:00:00.000Z")
+    self.assertEqual(mixed[("1 hour ago", "now")]["from"], "1 hour ago")
+    self.assertIsNone(mixed[("1 hour ago", "now")]["span"])
+
+  def test_duplicate_windows_are_requested_once(self):
+    calls = []
+    lock = threading.Lock()
+    def counting_fetch(*args):
+      with lock:
+        calls.append(args)
+      return fake_fetch(*args)
+    window = (datetime(2024, 1, 1), datetime(2024, 1, 2))
+    same_window = (pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02"))
+    with mock.patch.object(archive, "_fetch", side_effect=counting_fetch):
+      r = meme.archive.get_windows(["PV:A", "PV:B"], [window, same_window, window])
+    self.assertEqual(len(calls), 1)
+    self.assertIs(r[window], r[same_window])
@@ -0,0 +1,40 @@
+import unittest
+from meme.context import ContextPool
+
+class FakeContext(object):
+  def __init__(self, provider, **kws):
+    self.provider = provider
+    self.kws = kws
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+class ContextPoolTest(unittest.TestCase):
+  def test_contexts_are_created_lazily(self):
+    pool = ContextPool(factory=FakeContext)
+    self.assertEqual(len(pool), 0)
+    ctx = pool.get()
+    self.assertIs(pool.get(), ctx)
+    self.assertEqual(len(pool), 1)
+
+  def test_round_robin_up_to_max_contexts(self):
+    pool = ContextPool(max_contexts=2, factory=FakeContext, maxsize=4)
+    contexts = [pool.get() for _ in range(4)]
+    self.assertEqual(len(pool), 2)
+    self.assertEqual(len(set(map(id, contexts))), 2)
+    self.assertEqual(contexts[0].kws, {"maxsize": 4})
+
+  def test_max_contexts_must_be_positive(self):
+    with self.assertRaises(ValueError):
+      ContextPool(max_contexts=0, factory=FakeContext)
+    pool = ContextPool(factory=FakeContext)
+    with self.assertRaises(ValueError):
+      pool.configure(max_contexts=0)
+
+  def test_close(self):
+    pool = ContextPool(factory=FakeContext)
+    ctx = pool.get()
+    pool.close()
+    self.assertTrue(ctx.closed)
+    self.assertIsNot(pool.get(), ctx)
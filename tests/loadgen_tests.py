@@ -0,0 +1,48 @@
+import time
+import unittest
+from meme.loadgen import run, make_operations
+
+class LoadGenTest(unittest.TestCase):
+  def test_run(self):
+    calls = {"fast": 0, "slow": 0}
+    def fast():
+      calls["fast"] += 1
+    def slow():
+      calls["slow"] += 1
+      time.sleep(0.01)
+    def broken():
+      raise RuntimeError("no")
+    report = run({"fast": fast, "slow": slow, "broken": broken}, clients=3, requests=6)
+    rows = {row["operation"]: row for row in report.summary()}
+    # Each client takes turns through the operations, from a different start.
+    self.assertEqual([rows[name]["requests"] for name in ("fast", "slow", "broken")], [6, 6, 6])
+    self.assertEqual(calls, {"fast": 6, "slow": 6})
+    self.assertEqual(rows["broken"]["errors"], 6)
+    self.assertEqual(rows["total"]["requests"], 18)
+    self.assertGreaterEqual(rows["slow"]["p50"], 0.01)
+    self.assertLessEqual(rows["slow"]["p50"], rows["slow"]["p99"])
+    self.assertIn("p99 ms", report.format())
+
+  def test_untimed_operations(self):
+    report = run({"get": lambda: None, "rpc": lambda: time.sleep(0.01)}, clients=2, requests=4, untimed=["get"])
+    rows = {row["operation"]: row for row in report.summary()}
+    self.assertEqual(rows["get"]["requests"], 4)
+    self.assertNotEqual(rows["get"]["p50"], rows["get"]["p50"])
+    # The total only has the timed operation's latencies.
+    self.assertGreaterEqual(rows["total"]["p50"], 0.01)
+    self.assertEqual(rows["total"]["requests"], 8)
+
+  def test_duration(self):
+    start = time.perf_counter()
+    report = run({"sleep": lambda: time.sleep(0.01)}, clients=2, duration=0.2)
+    self.assertLess(time.perf_counter() - start, 1.0)
+    self.assertGreater(report.summary()[0]["throughput"], 0)
+
+  def test_make_operations(self):
+    self.assertEqual(set(make_operations(pvs=["A"], pattern="B%")), {"archive", "names"})
+    self.assertEqual(make_operations(), {})
+    with self.assertRaises(ValueError):
+      run({})
+
+if __name__ == '__main__':
+  unittest.main()
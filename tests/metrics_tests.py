@@ -0,0 +1,74 @@
+import re
+import unittest
+import meme.metrics as metrics
+
+class MetricsTest(unittest.TestCase):
+  def setUp(self):
+    metrics.reset()
+    metrics.enable()
+
+  def tearDown(self):
+    metrics.disable()
+    metrics.reset()
+
+  def test_nothing_is_recorded_while_disabled(self):
+    metrics.disable()
+    with metrics.timer("hist", "wait"):
+      pass
+    metrics.record_payload("hist", 10, 100)
+    metrics.record_cache("model.rmat", True)
+    self.assertEqual(metrics.snapshot(), {"timings": {}, "payloads": {}, "cache": {}})
+
+  def test_timings(self):
+    for _ in range(3):
+      with metrics.timer("hist", "wait"):
+        pass
+    timing = metrics.snapshot()["timings"]["hist"]["wait"]
+    self.assertEqual(timing["count"], 3)
+    self.assertEqual(sum(timing["buckets"].values()), 3)
+    self.assertLessEqual(timing["min"], timing["max"])
+
+  def test_timed_decorator(self):
+    @metrics.timed("ds", "decode")
+    def decode(x):
+      return x * 2
+    self.assertEqual(decode(2), 4)
+    self.assertEqual(metrics.snapshot()["timings"]["ds"]["decode"]["count"], 1)
+
+  def test_payloads_and_cache(self):
+    metrics.record_payload("hist", 10, 100)
+    metrics.record_payload("hist", 5, 50)
+    metrics.record_cache("model.rmat", False)
+    metrics.record_cache("model.rmat", True)
+    metrics.record_cache("model.rmat", True)
+    data = metrics.snapshot()
+    self.assertEqual(data["payloads"]["hist"], {"count": 2, "rows": 15, "bytes": 150})
+    self.assertEqual(data["cache"]["model.rmat"], {"hits": 2, "misses": 1})
+
+  def test_prometheus_export(self):
+    metrics.record("hist", "wait", 0.002)
+    metrics.record_payload("hist", 10, 100)
+    metrics.record_cache("names.table", True)
+    text = metrics.to_prometheus()
+    self.assertIn('meme_call_seconds_bucket{operation="hist",phase="wait",le="0.005"} 1', text)
+    self.assertIn('meme_call_seconds_count{operation="hist",phase="wait"} 1', text)
+    self.assertIn('meme_payload_rows_total{operation="hist"} 10', text)
+    self.assertIn('meme_cache_requests_total{cache="names.table",result="hit"} 1', text)
+    # Every sample belongs to the family named by the TYPE line before it.
+    suffixes = {"histogram": ("_bucket", "_sum", "_count"), "counter": ("",)}
+    family = None
+    for line in text.splitlines():
+      if line.startswith("# TYPE "):
+        _, _, name, kind = line.split()
+        family = (name, suffixes[kind])
+        continue
+      match = re.match(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)\{(.*)\} (\S+)$', line)
+      self.assertIsNotNone(match, line)
+      self.assertIn(match.group(1), [family[0] + suffix for suffix in family[1]])
+      float(match.group(3))
+
+  def test_log_events(self):
+    metrics.enable(log=True)
+    with self.assertLogs("meme.metrics", level="INFO") as logs:
+      metrics.record_cache("names.table", False)
+    self.assertEqual(logs.records[0].meme_metric, {"type": "cache", "cache": "names.table", "hit": False})
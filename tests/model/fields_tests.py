@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+import numpy as np
+from p4p.nt import NTTable
+import meme.context
+from meme.model import Model, full_machine_rmats, full_machine_twiss
+from meme.model.model import rmat_columns
+
+twiss_columns = ['element', 'device_name', 's', 'z', 'beta_x', 'beta_y', 'psi_x']
+
+class FakeContext(object):
+  """Serves a small twiss and rmat table, and remembers the requests."""
+  def __init__(self):
+    self.requests = []
+    twiss = NTTable([(c, 's' if c in ('element', 'device_name') else 'd') for c in twiss_columns])
+    self.twiss = twiss.wrap([{c: ("E{}".format(i) if c == 'element' else "DEV:{}".format(i) if c == 'device_name' else i * 1.5) for c in twiss_columns} for i in range(4)])
+    rmat_cols = ['element', 'device_name', 'z', 's'] + rmat_columns
+    rmat = NTTable([(c, 's' if c in ('element', 'device_name') else 'd') for c in rmat_cols])
+    rows = []
+    for i in range(4):
+      row = {"element": "E{}".format(i), "device_name": "DEV:{}".format(i), "z": float(i), "s": float(i)}
+      row.update({c: float(i * 100 + k) for k, c in enumerate(rmat_columns)})
+      rows.append(row)
+    self.rmat = rmat.wrap(rows)
+
+  def get(self, path, request=None, timeout=None):
+    self.requests.append((path, request))
+    return self.twiss if path.endswith("TWISS") else self.rmat
+
+class FieldsTest(unittest.TestCase):
+  def setUp(self):
+    self.ctx = FakeContext()
+    patcher = mock.patch.object(meme.context, "get_context", return_value=self.ctx)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_twiss_fields(self):
+    twiss = full_machine_twiss("TEST", fields=["beta_x"])
+    self.assertEqual(twiss.dtype.names, ("element", "device_name", "beta_x"))
+    np.testing.assert_array_equal(twiss["beta_x"], np.arange(4) * 1.5)
+    self.assertEqual(self.ctx.requests[-1][1], "field(value.element,value.device_name,value.beta_x)")
+    self.assertEqual(len(full_machine_twiss("TEST").dtype.names), len(twiss_columns))
+    self.assertIsNone(self.ctx.requests[-1][1])
+
+  def test_rmat_fields(self):
+    full = full_machine_rmats("TEST")
+    rmats = full_machine_rmats("TEST", fields=["r_mat"])
+    self.assertEqual(rmats.dtype.names, ("element", "device_name", "r_mat"))
+    np.testing.assert_array_equal(rmats["r_mat"], full["r_mat"])
+    self.assertEqual(rmats["r_mat"][1, 0, 1], 101.0)
+    self.assertEqual(full_machine_rmats("TEST", fields=["s"]).dtype.names, ("element", "device_name", "s"))
+
+  def test_model_fields(self):
+    m = Model("TEST", fields=["s", "beta_x"])
+    self.assertEqual(m.twiss_data.dtype.names, ("element", "device_name", "s", "beta_x"))
+    twiss = m.get_twiss(["DEV:1", "DEV:2"])
+    self.assertEqual(twiss.dtype.names, ("s", "beta_x"))
+    np.testing.assert_array_equal(m.get_twiss_attribute(["DEV:1", "E3"], "beta_x"), [1.5, 4.5])
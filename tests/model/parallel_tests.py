@@ -0,0 +1,52 @@
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import numpy as np
+from tests.model.synthetic import synthetic_model
+
+class ParallelGatherTest(unittest.TestCase):
+  def setUp(self):
+    self.m = synthetic_model()
+    rng = np.random.default_rng(0)
+    self.a = ["DEV:{}".format(i) for i in rng.integers(0, 20, 500)]
+    self.b = ["E{}".format(i) for i in rng.integers(0, 20, 500)]
+
+  def test_rmat_matches_old_pairwise_result(self):
+    expected = np.matmul(self.m.rmat_data["r_mat"][7], np.linalg.inv(self.m.rmat_data["r_mat"][3]))
+    np.testing.assert_allclose(self.m.get_rmat("DEV:3", "DEV:7"), expected, rtol=1e-5, atol=1e-6)
+
+  def test_thread_pool_rmat(self):
+    serial = self.m.get_rmat(self.a, self.b)
+    with ThreadPoolExecutor(4) as executor:
+      parallel = self.m.get_rmat(self.a, self.b, executor=executor, chunk_size=64)
+    np.testing.assert_array_equal(parallel, serial)
+
+  def test_process_pool_rmat(self):
+    serial = self.m.get_rmat(self.a, self.b)
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as executor:
+      parallel = self.m.get_rmat(self.a, self.b, executor=executor, chunk_size=100)
+    np.testing.assert_array_equal(parallel, serial)
+
+  def test_thread_pool_twiss(self):
+    with ThreadPoolExecutor(4) as executor:
+      twiss = self.m.get_twiss(self.b, executor=executor, chunk_size=64)
+      beta_x = self.m.get_twiss_attribute(self.b, "beta_x", executor=executor, chunk_size=64)
+    np.testing.assert_array_equal(twiss, self.m.get_twiss(self.b))
+    np.testing.assert_array_equal(beta_x, self.m.get_twiss_attribute(self.b, "beta_x"))
+
+  def test_name_index_follows_twiss_data(self):
+    self.assertEqual(self.m.get_s("DEV:3"), 1.5)
+    twiss_data = self.m.twiss_data.copy()
+    twiss_data["device_name"][3] = "RENAMED:3"
+    self.m.twiss_data = twiss_data
+    self.assertEqual(self.m.get_s("RENAMED:3"), 1.5)
+    with self.assertRaises(IndexError):
+      self.m.get_s("DEV:3")
+
+  def test_bad_names_are_nan(self):
+    rmats = self.m.get_rmat(["DEV:1", "NOPE", "DEV:2"], "DEV:9", ignore_bad_names=True)
+    self.assertTrue(np.isnan(rmats[1]).all())
+    self.assertFalse(np.isnan(rmats[[0, 2]]).any())
+    zpos = self.m.get_zpos(["DEV:1", "NOPE", "DEV:2"], ignore_bad_names=True)
+    self.assertTrue(np.isnan(zpos[1]))
+    self.assertEqual(zpos[2], self.m.twiss_data["z"][2])
@@ -0,0 +1,56 @@
+import unittest
+from meme.model import ModelProfiler
+from tests.model.synthetic import synthetic_model
+
+class ModelProfilingTest(unittest.TestCase):
+  def test_profiling_is_off_by_default(self):
+    m = synthetic_model()
+    self.assertIsNone(m.profiler)
+    m.get_rmat("DEV:3", "DEV:7")
+
+  def test_get_rmat_counts(self):
+    m = synthetic_model()
+    profiler = m.enable_profiling()
+    m.get_rmat(["DEV:1", "DEV:2", "DEV:3"], "DEV:9")
+    report = profiler.report()
+    # "DEV:9" is only looked up once for all three pairs.
+    self.assertEqual(report["counts"]["name_lookups"], 4)
+    self.assertEqual(report["counts"]["inversions"], 3)
+    self.assertEqual(report["counts"]["matmuls"], 3)
+    self.assertEqual(report["sections"]["get_rmat"]["calls"], 1)
+    # All of the 'from' names are resolved in one pass, and all of the 'to' names in another.
+    self.assertEqual(report["sections"]["index_resolution"]["calls"], 2)
+    self.assertEqual(report["sections"]["linear_algebra"]["calls"], 1)
+
+  def test_twiss_counts(self):
+    m = synthetic_model()
+    profiler = m.enable_profiling()
+    m.get_twiss(["DEV:1", "E2"])
+    m.get_zpos("DEV:4")
+    self.assertEqual(profiler.counts["twiss_lookups"], 3)
+    self.assertEqual(profiler.calls["get_twiss"], 1)
+    self.assertEqual(profiler.calls["get_twiss_attribute"], 1)
+
+  def test_hooks(self):
+    m = synthetic_model()
+    events = []
+    profiler = m.enable_profiling()
+    profiler.add_hook(lambda event, value: events.append(event))
+    m.get_rmat("DEV:3")
+    self.assertIn("inversions", events)
+    self.assertIn("get_rmat", events)
+
+  def test_merge_profilers_from_several_models(self):
+    a, b = synthetic_model(), synthetic_model()
+    pa, pb = a.enable_profiling(), b.enable_profiling()
+    a.get_rmat("DEV:3")
+    b.get_rmat(["DEV:3", "DEV:4"])
+    total = pa + pb
+    self.assertEqual(total.counts["inversions"], 3)
+    self.assertEqual(total.calls["get_rmat"], 2)
+    shared = ModelProfiler()
+    a.enable_profiling(shared)
+    b.enable_profiling(shared)
+    a.get_rmat("DEV:3")
+    b.get_rmat("DEV:3")
+    self.assertEqual(shared.calls["get_rmat"], 2)
@@ -0,0 +1,61 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tests.model.synthetic import synthetic_model
+
+def initial_conditions(k):
+  initial = np.zeros(k, dtype=[('beta_x', 'f8'), ('alpha_x', 'f8'), ('eta_x', 'f8'), ('beta_y', 'f8'), ('alpha_y', 'f8')])
+  initial['beta_x'] = np.linspace(1.0, 10.0, k)
+  initial['alpha_x'] = np.linspace(-1.0, 1.0, k)
+  initial['eta_x'] = 0.01
+  initial['beta_y'] = 4.0
+  initial['alpha_y'] = -0.5
+  return initial
+
+class PropagateTwissTest(unittest.TestCase):
+  def setUp(self):
+    self.m = synthetic_model()
+    self.devices = ["DEV:{}".format(i) for i in range(4, 20)]
+
+  def test_matches_sigma_matrix_transport(self):
+    initial = initial_conditions(50)
+    twiss = self.m.propagate_twiss(initial, "DEV:3", self.devices)
+    self.assertEqual(twiss.shape, (50, len(self.devices)))
+    rmats = self.m.get_rmat("DEV:3", self.devices)
+    for k, j in ((0, 0), (17, 5), (49, 15)):
+      b, a = initial['beta_x'][k], initial['alpha_x'][k]
+      sigma = np.array([[b, -a], [-a, (1 + a * a) / b]])
+      r = rmats[j][:2, :2]
+      sigma = r @ sigma @ r.T / np.linalg.det(r)
+      self.assertAlmostEqual(twiss['beta_x'][k, j], sigma[0, 0], places=6)
+      self.assertAlmostEqual(twiss['alpha_x'][k, j], -sigma[0, 1], places=6)
+      x = rmats[j] @ np.array([0.01, 0.0, 0.0, 0.0, 0.0, 1.0])
+      self.assertAlmostEqual(twiss['eta_x'][k, j], x[0] / x[5], places=8)
+      self.assertEqual(twiss['eta_y'][k, j], 0.0)
+
+  def test_phase_advance_adds_up(self):
+    initial = initial_conditions(5)
+    middle = self.m.propagate_twiss(initial, "DEV:3", "DEV:9")[:, 0]
+    whole = self.m.propagate_twiss(initial, "DEV:3", "DEV:15")[:, 0]
+    rest = self.m.propagate_twiss(middle, "DEV:9", "DEV:15", from_device_pos='mid')[:, 0]
+    for plane in ('x', 'y'):
+      np.testing.assert_allclose(rest['beta_' + plane], whole['beta_' + plane], rtol=1e-5)
+      np.testing.assert_allclose(np.mod(middle['psi_' + plane] + rest['psi_' + plane], 2 * np.pi), whole['psi_' + plane], rtol=1e-5)
+
+  def test_dict_and_executor(self):
+    one = self.m.propagate_twiss({'beta_x': 2.0, 'alpha_x': 0.0, 'beta_y': 3.0, 'alpha_y': 0.0}, "DEV:3", "DEV:5")
+    self.assertEqual(one.shape, (1, 1))
+    initial = initial_conditions(100)
+    with ThreadPoolExecutor(4) as executor:
+      parallel = self.m.propagate_twiss(initial, "DEV:3", self.devices, executor=executor, chunk_size=16)
+    np.testing.assert_array_equal(parallel, self.m.propagate_twiss(initial, "DEV:3", self.devices))
+    with self.assertRaises(ValueError):
+      self.m.propagate_twiss({'beta_x': 2.0}, "DEV:3", "DEV:5")
+
+  def test_bad_names(self):
+    twiss = self.m.propagate_twiss(initial_conditions(3), "DEV:3", ["DEV:5", "NOPE"], ignore_bad_names=True)
+    self.assertTrue(np.isnan(twiss['beta_x'][:, 1]).all())
+    self.assertFalse(np.isnan(twiss['beta_x'][:, 0]).any())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import multiprocessing
+import subprocess
+import sys
+from unittest import mock
+import numpy as np
+from meme.model import Model
+from tests.model.synthetic import synthetic_model
+
+def rmat_in_worker(descriptor):
+  m = Model.from_shared_memory(descriptor)
+  return m.get_rmat("DEV:3", "DEV:7")
+
+def unregisters_in_worker(descriptor):
+  """Attach in a worker, and say whether the block was unregistered from the resource tracker."""
+  from multiprocessing import resource_tracker
+  with mock.patch.object(resource_tracker, "unregister", wraps=resource_tracker.unregister) as unregister:
+    m = Model.from_shared_memory(descriptor)
+    del m
+  return unregister.called
+
+class SharedMemoryTest(unittest.TestCase):
+  def test_attach_in_same_process(self):
+    m = synthetic_model()
+    with m.share() as shared:
+      attached = Model.from_shared_memory(shared.descriptor)
+      np.testing.assert_array_equal(attached.rmat_data, m.rmat_data)
+      np.testing.assert_array_equal(attached.twiss_data, m.twiss_data)
+      self.assertFalse(attached.rmat_data.flags.writeable)
+      del attached
+
+  def test_workers_share_data(self):
+    m = synthetic_model()
+    expected = m.get_rmat("DEV:3", "DEV:7")
+    with m.share() as shared:
+      with multiprocessing.get_context("spawn").Pool(2) as pool:
+        results = pool.map(rmat_in_worker, [shared.descriptor] * 4)
+    for r in results:
+      np.testing.assert_array_equal(r, expected)
+
+  @unittest.skipIf(sys.version_info >= (3, 13), "Attaching doesn't use the resource tracker.")
+  def test_workers_keep_the_owners_registration(self):
+    # Forked and spawned workers share the owner's resource tracker, so they
+    # must not unregister the owner's blocks from it.
+    with synthetic_model().share() as shared:
+      for method in ("fork", "spawn"):
+        with multiprocessing.get_context(method).Pool(1) as pool:
+          self.assertEqual(pool.map(unregisters_in_worker, [shared.descriptor] * 2), [False, False], method)
+      self.assertFalse(unregisters_in_worker(shared.descriptor))
+
+  @unittest.skipIf(sys.version_info >= (3, 13), "Attaching doesn't use the resource tracker.")
+  def test_unrelated_process_unregisters(self):
+    # A process with its own tracker has to unregister, or its tracker unlinks the blocks.
+    with synthetic_model().share() as shared:
+      code = "from tests.model.shared_memory_tests import unregisters_in_worker; print(unregisters_in_worker({!r}))".format(shared.descriptor)
+      output = subprocess.check_output([sys.executable, "-c", code], text=True)
+      self.assertEqual(output.strip(), "True")
+      # The blocks outlive the other process.
+      self.assertFalse(unregisters_in_worker(shared.descriptor))
+
+  def test_missing_table_is_fetched(self):
+    m = synthetic_model()
+    twiss_data = m.twiss_data
+    m.twiss_data = None
+    def refresh_twiss_data():
+      m.twiss_data = twiss_data
+    m.refresh_twiss_data = refresh_twiss_data
+    with m.share() as shared:
+      attached = Model.from_shared_memory(shared.descriptor)
+      np.testing.assert_array_equal(attached.twiss_data, twiss_data)
+      del attached
+
+  def test_close_unlinks(self):
+    from multiprocessing import shared_memory
+    shared = synthetic_model().share()
+    names = [t["shm_name"] for t in shared.descriptor["tables"].values()]
+    shared.close()
+    for name in names:
+      with self.assertRaises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
@@ -0,0 +1,81 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+from meme.model import Model
+from tests.model.synthetic import synthetic_model
+
+try:
+  import pyarrow
+except ImportError:
+  pyarrow = None
+
+@unittest.skipIf(pyarrow is None, "Model snapshots need pyarrow.")
+class ModelSnapshotTest(unittest.TestCase):
+  def assert_round_trip(self, format):
+    m = synthetic_model()
+    with tempfile.TemporaryDirectory() as path:
+      m.save_snapshot(path, format=format)
+      loaded = Model.from_snapshot(path)
+    self.assertEqual(loaded.model_name, m.model_name)
+    self.assertEqual(loaded.model_source, m.model_source)
+    self.assertEqual(loaded.use_design, m.use_design)
+    for name in ("rmat_data", "twiss_data"):
+      self.assertEqual(getattr(loaded, name).dtype, getattr(m, name).dtype)
+      np.testing.assert_array_equal(getattr(loaded, name), getattr(m, name))
+    np.testing.assert_array_equal(loaded.get_rmat("DEV:3", "DEV:7"), m.get_rmat("DEV:3", "DEV:7"))
+
+  def test_arrow_round_trip(self):
+    self.assert_round_trip("arrow")
+
+  def test_parquet_round_trip(self):
+    self.assert_round_trip("parquet")
+
+  def test_arrow_is_loaded_in_place(self):
+    m = synthetic_model()
+    with tempfile.TemporaryDirectory() as path:
+      m.save_snapshot(path)
+      loaded = Model.from_snapshot(path)
+      for name in ("rmat_data", "twiss_data"):
+        data = getattr(loaded, name)
+        self.assertFalse(data.flags.writeable)
+        self.assertFalse(data.flags.owndata)
+        self.assertIsInstance(data.base, pyarrow.Buffer)
+      del loaded, data
+
+  def test_fields_are_restored(self):
+    m = synthetic_model()
+    m.fields = ["s", "beta_x"]
+    for format in ("arrow", "parquet"):
+      with tempfile.TemporaryDirectory() as path:
+        m.save_snapshot(path, format=format)
+        self.assertEqual(Model.from_snapshot(path).fields, ["s", "beta_x"])
+        m.fields, fields = None, m.fields
+        m.save_snapshot(path, format=format)
+        self.assertIsNone(Model.from_snapshot(path).fields)
+        m.fields = fields
+
+  def test_newest_format_is_loaded(self):
+    m = synthetic_model()
+    with tempfile.TemporaryDirectory() as path:
+      m.save_snapshot(path, format="parquet")
+      m.rmat_data['s'] += 1.0
+      m.save_snapshot(path, format="arrow")
+      for name in ("rmat_data", "twiss_data"):
+        os.utime(os.path.join(path, name + ".parquet"), (0, 0))
+      np.testing.assert_array_equal(Model.from_snapshot(path).rmat_data['s'], m.rmat_data['s'])
+      m.rmat_data['s'] += 1.0
+      m.save_snapshot(path, format="parquet")
+      for name in ("rmat_data", "twiss_data"):
+        os.utime(os.path.join(path, name + ".arrow"), (0, 0))
+      np.testing.assert_array_equal(Model.from_snapshot(path).rmat_data['s'], m.rmat_data['s'])
+
+  def test_bad_format(self):
+    with tempfile.TemporaryDirectory() as path:
+      with self.assertRaises(ValueError):
+        synthetic_model().save_snapshot(path, format="csv")
+
+  def test_missing_snapshot(self):
+    with tempfile.TemporaryDirectory() as path:
+      with self.assertRaises(FileNotFoundError):
+        Model.from_snapshot(path)
@@ -0,0 +1,49 @@
+import numpy as np
+from meme.model import Model
+
+twiss_fields = ['s', 'z', 'length', 'p0c', 'alpha_x', 'beta_x', 'eta_x', 'etap_x', 'psi_x',
+                'alpha_y', 'beta_y', 'eta_y', 'etap_y', 'psi_y']
+
+def fodo_element_matrices(n, focal_length=5.0, drift_length=1.0):
+  """6x6 matrices for a FODO line: alternating drifts and thin quads (with a little dispersion)."""
+  mats = np.tile(np.eye(6), (n, 1, 1))
+  for i in range(n):
+    if i % 2 == 0:
+      mats[i, 0, 1] = mats[i, 2, 3] = drift_length
+      mats[i, 4, 5] = drift_length * 1e-4
+    else:
+      f = focal_length if i % 4 == 1 else -focal_length
+      mats[i, 1, 0] = -1.0 / f
+      mats[i, 3, 2] = 1.0 / f
+      mats[i, 1, 5] = 1e-3
+  return mats
+
+def synthetic_model(n=20):
+  """A Model with no service behind it, holding a small FODO lattice.
+
+  Element i has element name "E{i}" and device name "DEV:{i}".  Its R-matrix is
+  the transport from the start of the line to the end of element i.
+  """
+  mats = fodo_element_matrices(n)
+  cumulative = np.zeros((n, 6, 6))
+  r = np.eye(6)
+  for i in range(n):
+    r = mats[i] @ r
+    cumulative[i] = r
+  rmat_data = np.zeros(n, dtype=[('element', 'U60'), ('device_name', 'U60'), ('z', 'float32'), ('s', 'float32'), ('r_mat', 'float32', (6,6))])
+  rmat_data['element'] = ["E{}".format(i) for i in range(n)]
+  rmat_data['device_name'] = ["DEV:{}".format(i) for i in range(n)]
+  rmat_data['s'] = np.arange(n) * 0.5
+  rmat_data['z'] = rmat_data['s']
+  rmat_data['r_mat'] = cumulative
+  twiss_data = np.zeros(n, dtype=[('element', 'U60'), ('device_name', 'U60')] + [(f, 'f8') for f in twiss_fields])
+  twiss_data['element'] = rmat_data['element']
+  twiss_data['device_name'] = rmat_data['device_name']
+  twiss_data['s'] = rmat_data['s']
+  twiss_data['z'] = rmat_data['z']
+  twiss_data['beta_x'] = np.linspace(1.0, 2.0, n)
+  twiss_data['beta_y'] = np.linspace(2.0, 1.0, n)
+  m = Model("SYNTHETIC", initialize=False)
+  m.rmat_data = rmat_data
+  m.twiss_data = twiss_data
+  return m
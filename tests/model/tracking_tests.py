@@ -0,0 +1,43 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tests.model.synthetic import synthetic_model
+
+class TrackTest(unittest.TestCase):
+  def setUp(self):
+    self.m = synthetic_model()
+    self.devices = ["DEV:{}".format(i) for i in range(4, 20)]
+    self.particles = np.random.default_rng(0).normal(1e-4, 1e-3, (10000, 6))
+
+  def test_coordinates(self):
+    coordinates = self.m.track(self.particles, "DEV:3", self.devices, output='coordinates', chunk_size=999)
+    self.assertEqual(coordinates.shape, (len(self.devices), 10000, 6))
+    rmats = self.m.get_rmat("DEV:3", self.devices)
+    np.testing.assert_allclose(coordinates[7], self.particles @ rmats[7].T)
+    with ThreadPoolExecutor(4) as executor:
+      parallel = self.m.track(self.particles, "DEV:3", self.devices, output='coordinates', executor=executor, chunk_size=999)
+    np.testing.assert_array_equal(parallel, coordinates)
+    single = self.m.track(self.particles.astype(np.float32), "DEV:3", "DEV:5", output='coordinates')
+    self.assertEqual(single.dtype, np.float32)
+
+  def test_moments_match_coordinates(self):
+    coordinates = self.m.track(self.particles, "DEV:3", self.devices, output='coordinates')
+    with ThreadPoolExecutor(4) as executor:
+      moments = self.m.track(self.particles, "DEV:3", self.devices, executor=executor, chunk_size=777)
+    self.assertEqual(moments["count"], 10000)
+    for j in (0, 9, 15):
+      np.testing.assert_allclose(moments["mean"][j], coordinates[j].mean(axis=0), rtol=1e-8, atol=1e-15)
+      np.testing.assert_allclose(moments["covariance"][j], np.cov(coordinates[j].T, bias=True), rtol=1e-8, atol=1e-15)
+      np.testing.assert_allclose(moments["rms"][j], coordinates[j].std(axis=0), rtol=1e-8)
+
+  def test_bad_arguments(self):
+    with self.assertRaises(ValueError):
+      self.m.track(self.particles[:, :4], "DEV:3", "DEV:5")
+    with self.assertRaises(ValueError):
+      self.m.track(self.particles, "DEV:3", "DEV:5", output='histogram')
+    moments = self.m.track(self.particles, "DEV:3", ["DEV:5", "NOPE"], ignore_bad_names=True)
+    self.assertTrue(np.isnan(moments["rms"][1]).all())
+    self.assertFalse(np.isnan(moments["rms"][0]).any())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,12 @@
+import re
 import unittest
+import warnings
+from unittest import mock
+from p4p.nt import NTTable
+from p4p.client.thread import RemoteError
 import meme.names
+import meme.names.table
+from meme.names import NameTable
 import subprocess
 import sys
 import signal
@@ -31,4 +38,89 @@ class NameListTest(unittest.TestCase):
 	@classmethod
 	def tearDownClass(cls):
 		cls.server_process.terminate()
-		cls.server_process.wait()
\ No newline at end of file
+		cls.server_process.wait()
+
+class NameTableTest(unittest.TestCase):
+	def setUp(self):
+		self.table = NameTable(
+			pv=["BPMS:LI24:801:X", "BPMS:LI24:801:Y", "XCOR:LI24:802:BACT", "BPMS:LTU1:250:X", "QUAD:LTU1:440:BACT"],
+			dname=["BPMS:LI24:801", "BPMS:LI24:801", "XCOR:LI24:802", "BPMS:LTU1:250", "QUAD:LTU1:440"],
+			ename=["BPM24801", "BPM24801", "XC24802", "BPMDL1", "QDL14"],
+			tag=["L3", "L3", "L3", "LTU,BSYLTU", "LTU,BSYLTU"],
+			etype=["INST", "INST", "XCOR", "INST", "QUAD"],
+			z=[2000.0, 2000.0, 2001.0, 3200.0, 3100.0])
+	
+	def test_wildcard_pattern(self):
+		self.assertEqual(self.table.list_pvs("BPMS:%:X"), ["BPMS:LI24:801:X", "BPMS:LTU1:250:X"])
+	
+	def test_regex_pattern(self):
+		self.assertEqual(self.table.list_pvs("(XCOR|QUAD):.*"), ["XCOR:LI24:802:BACT", "QUAD:LTU1:440:BACT"])
+		self.assertEqual(self.table.list_pvs("BPMS:LI2[0-4]:.*:Y"), ["BPMS:LI24:801:Y"])
+	
+	def test_tag_and_element_type_filters(self):
+		self.assertEqual(self.table.list_devices("%", tag="LTU", element_type="INST"), ["BPMS:LTU1:250"])
+		self.assertEqual(self.table.list_devices("%", tag="NOT_A_TAG"), [])
+	
+	def test_sort_by_z(self):
+		self.assertEqual(self.table.list_elements("%", tag="BSYLTU", sort_by="z"), ["QDL14", "BPMDL1"])
+	
+	def test_wildcard_matches_regex(self):
+		table = NameTable(pv=["BPMS:LI{:02d}:{}:{}".format(i % 30, i, "XY"[i % 2]) for i in range(2000)] + ["%:X", "X", ":X:X"])
+		for pattern in ["%:X", "BPMS:%:X", "%LI1%:Y", "%", "BPMS:LI0%1%", "%:%:%:X", "%X%", "X%"]:
+			regex = re.compile(".*".join(re.escape(part) for part in pattern.split("%")))
+			self.assertEqual(table.list_pvs(pattern), [pv for pv in table.pv.tolist() if regex.fullmatch(pv)], pattern)
+		# Repeating a pattern reuses the rows found the first time.
+		self.assertIs(table._match("pv", "%:X"), table._match("pv", "%:X"))
+	
+	def test_device_names_are_unique(self):
+		self.assertEqual(self.table.list_devices("BPMS:LI24:%"), ["BPMS:LI24:801"])
+	
+	def test_missing_columns_raise(self):
+		table = NameTable(pv=["A:1:X", "B:2:X"])
+		self.assertEqual(table.missing, {"dname", "ename", "tag", "etype", "z"})
+		self.assertEqual(table.list_pvs("%"), ["A:1:X", "B:2:X"])
+		with self.assertRaises(ValueError):
+			table.list_pvs("%", tag="L3")
+		with self.assertRaises(ValueError):
+			table.list_pvs("%", element_type="INST")
+		with self.assertRaises(ValueError):
+			table.list_pvs("%", sort_by="z")
+		with self.assertRaises(ValueError):
+			table.list_devices("%")
+
+class NameTableFromServiceTest(unittest.TestCase):
+	def test_service_with_only_names(self):
+		pvs = ["BPMS:LTU1:250:X", "BPMS:LI24:801:X", "BPMS:LI24:801:Y"]
+		by_z = ["BPMS:LI24:801:X", "BPMS:LI24:801:Y", "BPMS:LTU1:250:X"]
+		def fake(timeout=None, **kws):
+			names = by_z if kws.get("sort") == "z" else pvs
+			return NTTable([("name", "s")]).wrap([{"name": name} for name in names])
+		with mock.patch.object(meme.names.table, "directory_service_get", side_effect=fake):
+			with warnings.catch_warnings(record=True) as caught:
+				warnings.simplefilter("always")
+				table = NameTable.from_service()
+		self.assertEqual(len(caught), 1)
+		self.assertEqual(table.missing, {"dname", "ename", "tag", "etype"})
+		self.assertEqual(table.list_pvs("%:X", sort_by="z"), ["BPMS:LI24:801:X", "BPMS:LTU1:250:X"])
+		with self.assertRaises(ValueError):
+			table.list_devices("BPMS:%")
+		with self.assertRaises(ValueError):
+			table.list_pvs("%", tag="LTU")
+	
+	def test_refused_request_falls_back(self):
+		def fake(timeout=None, **kws):
+			if "show" in kws:
+				raise RemoteError("Unknown show")
+			return NTTable([("name", "s")]).wrap([{"name": "BPMS:LI24:801:X"}])
+		with mock.patch.object(meme.names.table, "directory_service_get", side_effect=fake) as service:
+			with warnings.catch_warnings():
+				warnings.simplefilter("ignore")
+				table = NameTable.from_service()
+		self.assertEqual(table.list_pvs("%"), ["BPMS:LI24:801:X"])
+		self.assertEqual(service.call_count, 3)
+	
+	def test_timeout_is_raised(self):
+		with mock.patch.object(meme.names.table, "directory_service_get", side_effect=TimeoutError()) as service:
+			with self.assertRaises(TimeoutError):
+				NameTable.from_service(timeout=0.1)
+		self.assertEqual(service.call_count, 1)
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+import unittest
+
+class LazySubmoduleTest(unittest.TestCase):
+  def test_every_submodule_is_reachable(self):
+    # Run in a fresh interpreter, so nothing is imported already.
+    code = ("import meme, pkgutil; "
+            "names = sorted(m.name for m in pkgutil.iter_modules(meme.__path__) if not m.name.startswith('_')); "
+            "assert set(names) <= set(dir(meme)), names; "
+            "assert all(getattr(meme, name).__name__ == 'meme.' + name for name in names)")
+    subprocess.check_call([sys.executable, "-c", code])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from meme.policy import ServicePolicy, CircuitOpenError
+
+class FlakyService(object):
+  def __init__(self, failures, error=TimeoutError):
+    self.failures = failures
+    self.error = error
+    self.timeouts = []
+
+  def __call__(self, timeout=None):
+    self.timeouts.append(timeout)
+    if len(self.timeouts) <= self.failures:
+      raise self.error("Service did not answer.")
+    return "ok"
+
+class ServicePolicyTest(unittest.TestCase):
+  def make_policy(self, **kws):
+    settings = dict(backoff=0.0, jitter=0.0)
+    settings.update(kws)
+    return ServicePolicy(**settings)
+
+  def test_timeout_scales_with_request_size(self):
+    p = self.make_policy(timeout=5.0, timeout_per_item=0.1, timeout_per_item_hour=0.01, max_timeout=60.0)
+    self.assertEqual(p.timeout_for(), 5.0)
+    self.assertAlmostEqual(p.timeout_for(1), 5.1)
+    self.assertAlmostEqual(p.timeout_for(100, span=3600.0 * 10), 5.0 + 10.0 + 10.0)
+    self.assertEqual(p.timeout_for(10000, span=3600.0 * 1000), 60.0)
+
+  def test_base_timeout_by_default(self):
+    p = self.make_policy(timeout=5.0)
+    service = FlakyService(failures=0)
+    p.call("ds", service)
+    self.assertEqual(service.timeouts, [5.0])
+
+  def test_retries_timeouts(self):
+    p = self.make_policy(retries=2)
+    service = FlakyService(failures=2)
+    self.assertEqual(p.call("svc", service, timeout=1.0), "ok")
+    self.assertEqual(service.timeouts, [1.0, 1.0, 1.0])
+
+  def test_gives_up_after_retries(self):
+    p = self.make_policy(retries=1)
+    service = FlakyService(failures=5)
+    with self.assertRaises(TimeoutError):
+      p.call("svc", service)
+    self.assertEqual(len(service.timeouts), 2)
+
+  def test_service_errors_are_not_retried(self):
+    p = self.make_policy(retries=3)
+    service = FlakyService(failures=1, error=ValueError)
+    with self.assertRaises(ValueError):
+      p.call("svc", service)
+    self.assertEqual(len(service.timeouts), 1)
+
+  def test_retry_budget(self):
+    p = self.make_policy(retries=3, max_retry_budget=1.0, failure_threshold=None)
+    service = FlakyService(failures=5)
+    with self.assertRaises(TimeoutError):
+      p.call("svc", service)
+    # Only one retry was in the budget.
+    self.assertEqual(len(service.timeouts), 2)
+
+  def test_circuit_opens_after_failures(self):
+    p = self.make_policy(retries=0, failure_threshold=2, reset_timeout=60.0)
+    service = FlakyService(failures=10)
+    for _ in range(2):
+      with self.assertRaises(TimeoutError):
+        p.call("svc", service)
+    self.assertTrue(p.is_open("svc"))
+    with self.assertRaises(CircuitOpenError):
+      p.call("svc", service)
+    self.assertEqual(len(service.timeouts), 2)
+    # Other services are not affected.
+    self.assertEqual(p.call("other", FlakyService(failures=0)), "ok")
+
+  def test_circuit_closes_after_successful_trial(self):
+    p = self.make_policy(retries=0, failure_threshold=1, reset_timeout=0.0)
+    service = FlakyService(failures=1)
+    with self.assertRaises(TimeoutError):
+      p.call("svc", service)
+    self.assertTrue(p.is_open("svc"))
+    self.assertEqual(p.call("svc", service), "ok")
+    self.assertFalse(p.is_open("svc"))
+
+  def test_interrupted_trial_allows_another(self):
+    p = self.make_policy(retries=0, failure_threshold=1, reset_timeout=0.0)
+    with self.assertRaises(TimeoutError):
+      p.call("svc", FlakyService(failures=1))
+    with self.assertRaises(KeyboardInterrupt):
+      p.call("svc", FlakyService(failures=1, error=KeyboardInterrupt))
+    self.assertTrue(p.is_open("svc"))
+    self.assertEqual(p.call("svc", FlakyService(failures=0)), "ok")
+    self.assertFalse(p.is_open("svc"))
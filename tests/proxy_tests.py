@@ -0,0 +1,147 @@
+import argparse
+import threading
+import time
+import unittest
+from p4p.client.thread import Context
+from p4p.nt import NTScalar, NTTable, NTURI
+from p4p.server import Server
+from p4p.server.thread import SharedPV
+from meme.proxy import CachingProxy, TTLCache
+from meme._server import add_server_arguments, server_conf
+
+name_table = NTTable([("name", "s")])
+model_table = NTTable([("element", "s"), ("s", "d")])
+
+class Upstream(object):
+  """Stand-in ds, hist, and model services, which count the requests they get."""
+  def __init__(self):
+    self.calls = {"ds": 0, "hist": 0}
+    self.model = SharedPV(nt=model_table, initial=[{"element": "QE1", "s": 1.0}])
+    providers = {"BMAD:SYS0:1:TEST:LIVE:TWISS": self.model}
+    for service in self.calls:
+      pv = SharedPV(nt=NTScalar("s"), initial="")
+      pv.rpc(self.handler(service))
+      providers[service] = pv
+    # The server doesn't keep the PVs alive by itself.
+    self.pvs = providers
+    self.server = Server(providers=[providers], isolate=True)
+    self.address = "127.0.0.1:{}".format(self.server.conf()["EPICS_PVAS_BROADCAST_PORT"])
+
+  def handler(self, service):
+    def rpc(pv, op):
+      self.calls[service] += 1
+      # Slow enough for concurrent requests to overlap.
+      time.sleep(0.2)
+      query = op.value().query.todict()
+      op.done(name_table.wrap([{"name": "{}:{}".format(service, query.get("name", ""))}]))
+    return rpc
+
+class ProxyTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.upstream = Upstream()
+    local = {"EPICS_PVAS_INTF_ADDR_LIST": "127.0.0.1", "EPICS_PVAS_SERVER_PORT": "0", "EPICS_PVAS_BROADCAST_PORT": "0"}
+    cls.proxy = CachingProxy(upstream=[cls.upstream.address], conf=local, useenv=False, ttl={"ds": 60.0, "hist": 0.5},
+                             timeout=1.0, stats_period=0.1)
+    cls.client = Context("pva", conf={"EPICS_PVA_ADDR_LIST": "127.0.0.1:{}".format(cls.proxy.server.conf()["EPICS_PVAS_BROADCAST_PORT"]),
+                                      "EPICS_PVA_AUTO_ADDR_LIST": "NO"}, useenv=False)
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.client.close()
+    cls.proxy.close()
+    cls.upstream.server.stop()
+
+  def ds(self, name):
+    return NTTable.unwrap(self.client.rpc("ds", NTURI([("name", "s")]).wrap("ds", kws={"name": name}), timeout=5.0))
+
+  def test_rpc_answers_are_cached_and_shared(self):
+    before = self.upstream.calls["ds"]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(self.ds("BPMS:%"))) for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(self.ds("BPMS:%")[0]["name"], "ds:BPMS:%")
+    self.assertEqual([r[0]["name"] for r in results], ["ds:BPMS:%"] * 5)
+    self.assertEqual(self.upstream.calls["ds"], before + 1)
+    self.ds("XCOR:%")
+    self.assertEqual(self.upstream.calls["ds"], before + 2)
+
+  def test_rpc_answers_expire(self):
+    request = NTURI([("pv", "s")]).wrap("hist", kws={"pv": "PV:A"})
+    before = self.upstream.calls["hist"]
+    self.client.rpc("hist", request, timeout=5.0)
+    self.client.rpc("hist", request, timeout=5.0)
+    self.assertEqual(self.upstream.calls["hist"], before + 1)
+    time.sleep(0.6)
+    self.client.rpc("hist", request, timeout=5.0)
+    self.assertEqual(self.upstream.calls["hist"], before + 2)
+
+  def test_model_pv_is_mirrored(self):
+    name = "BMAD:SYS0:1:TEST:LIVE:TWISS"
+    self.assertEqual(list(self.client.get(name, timeout=5.0).value.element), ["QE1"])
+    updates = []
+    subscription = self.client.monitor(name, updates.append)
+    try:
+      self.upstream.model.post([{"element": "QE1", "s": 2.0}])
+      deadline = time.monotonic() + 5.0
+      while not any(list(u.value.s) == [2.0] for u in updates) and time.monotonic() < deadline:
+        time.sleep(0.01)
+      self.assertEqual(list(updates[-1].value.s), [2.0])
+    finally:
+      subscription.close()
+    # Local clients share the proxy's one upstream monitor.
+    self.assertEqual(len(self.proxy._mirrors), 1)
+    with self.assertRaises(TimeoutError):
+      self.client.get("BMAD:SYS0:1:TEST:LIVE:NOTAMODELPV", timeout=0.5)
+
+  def test_missing_model_pv_is_not_claimed(self):
+    name = "BMAD:SYS0:1:TEST:DESIGN:RMAT"
+    with self.assertRaises(TimeoutError):
+      self.client.get(name, timeout=0.5)
+    # The mirror never gets a value upstream, so it is dropped after the timeout.
+    deadline = time.monotonic() + 5.0
+    while name in self.proxy._mirrors and time.monotonic() < deadline:
+      time.sleep(0.05)
+    self.assertNotIn(name, self.proxy._mirrors)
+    self.assertIs(self.proxy.testChannel(name), False)
+
+  def test_mirror_limit(self):
+    local = {"EPICS_PVAS_INTF_ADDR_LIST": "127.0.0.1", "EPICS_PVAS_SERVER_PORT": "0", "EPICS_PVAS_BROADCAST_PORT": "0"}
+    with CachingProxy(upstream=[self.upstream.address], conf=local, useenv=False, max_mirrors=0) as proxy:
+      with self.assertLogs("meme.proxy", "WARNING"):
+        self.assertIs(proxy.testChannel("BMAD:SYS0:1:TEST:LIVE:TWISS"), False)
+      self.assertEqual(proxy._mirrors, {})
+
+  def test_stats_pv(self):
+    self.ds("STATS:%")
+    time.sleep(0.3)
+    stats = {row["service"]: row for row in NTTable.unwrap(self.client.get(self.proxy.stats_name, timeout=5.0))}
+    self.assertGreaterEqual(stats["ds"]["misses"], 1)
+    self.assertGreaterEqual(stats["ds"]["entries"], 1)
+    self.assertIn("monitors", stats)
+
+class ServerOptionsTest(unittest.TestCase):
+  def test_server_conf(self):
+    parser = argparse.ArgumentParser()
+    add_server_arguments(parser)
+    self.assertIsNone(server_conf(parser.parse_args([])))
+    self.assertEqual(server_conf(parser.parse_args(["--port", "5095", "--interface", "127.0.0.1"])),
+                     {"EPICS_PVAS_SERVER_PORT": "5095", "EPICS_PVAS_INTF_ADDR_LIST": "127.0.0.1"})
+
+class TTLCacheTest(unittest.TestCase):
+  def test_expiry_and_size(self):
+    cache = TTLCache(ttl=0.05, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    self.assertEqual(cache.get("a"), (True, 1))
+    cache.put("c", 3)
+    self.assertEqual(cache.get("b"), (False, None))
+    time.sleep(0.06)
+    self.assertEqual(cache.get("a"), (False, None))
+    self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+import unittest
+from p4p import Type, Value
+from p4p.client.thread import Context
+from p4p.nt import NTScalar, NTTable, NTURI
+from p4p.server import Server
+from p4p.server.thread import SharedPV
+import meme.context
+import meme.names
+from meme.replay import record, load, encode, decode, ReplayServer
+
+name_table = NTTable([("name", "s")])
+model_table = NTTable([("element", "s"), ("s", "d")])
+local = {"EPICS_PVAS_INTF_ADDR_LIST": "127.0.0.1", "EPICS_PVAS_SERVER_PORT": "0", "EPICS_PVAS_BROADCAST_PORT": "0"}
+
+def client_conf(server):
+  return {"EPICS_PVA_ADDR_LIST": "127.0.0.1:{}".format(server.conf()["EPICS_PVAS_BROADCAST_PORT"]), "EPICS_PVA_AUTO_ADDR_LIST": "NO"}
+
+class Upstream(object):
+  """Stand-in ds and model services."""
+  def __init__(self):
+    self.ds = SharedPV(nt=NTScalar("s"), initial="")
+    self.ds.rpc(self.answer)
+    self.model = SharedPV(nt=model_table, initial=[{"element": "QE1", "s": 1.0}, {"element": "QE2", "s": 2.0}])
+    # The server doesn't keep the PVs alive by itself.
+    self.pvs = {"ds": self.ds, "BMAD:SYS0:1:TEST:LIVE:TWISS": self.model}
+    self.server = Server(providers=[self.pvs], isolate=True)
+
+  def answer(self, pv, op):
+    time.sleep(0.05)
+    pattern = op.value().query.name
+    op.done(name_table.wrap([{"name": pattern.replace("%", str(i))} for i in range(3)]))
+
+class ReplayTest(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.directory = tempfile.TemporaryDirectory()
+    cls.path = os.path.join(cls.directory.name, "session.rec")
+    upstream = Upstream()
+    try:
+      with record(cls.path, conf=client_conf(upstream.server), useenv=False) as recorder:
+        cls.names = meme.names.list_pvs("BPMS:%:X")
+        cls.model = meme.context.get_context().get("BMAD:SYS0:1:TEST:LIVE:TWISS", timeout=5.0)
+      cls.recorded = recorder.count
+    finally:
+      upstream.server.stop()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.directory.cleanup()
+
+  def replay(self, **kws):
+    server = ReplayServer(self.path, conf=local, useenv=False, **kws)
+    self.addCleanup(server.close)
+    client = Context("pva", conf=client_conf(server.server), useenv=False)
+    self.addCleanup(client.close)
+    return server, client
+
+  def list_pvs(self, client, pattern):
+    request = NTURI([(key, "s") for key in ("name", "tag", "sort", "etype", "show")]).wrap(
+      "ds", scheme="pva", kws={"name": pattern, "tag": None, "sort": None, "etype": None, "show": None})
+    return [row["name"] for row in NTTable.unwrap(client.rpc("ds", request, timeout=5.0))]
+
+  def test_recording(self):
+    self.assertEqual(self.recorded, 2)
+    entries = load(self.path)
+    self.assertEqual([entry["op"] for entry in entries], ["rpc", "get"])
+    self.assertGreater(entries[0]["seconds"], 0.04)
+    # The pool is back to normal Contexts.
+    self.assertNotIn("conf", meme.context._pool.context_kws)
+
+  def test_replay(self):
+    server, client = self.replay(latency=0.0)
+    self.assertEqual(self.list_pvs(client, "BPMS:%:X"), self.names)
+    model = client.get("BMAD:SYS0:1:TEST:LIVE:TWISS", timeout=5.0)
+    self.assertEqual(list(model.value.element), ["QE1", "QE2"])
+    self.assertEqual(model.getID(), self.model.getID())
+    with self.assertRaises(Exception):
+      self.list_pvs(client, "XCOR:%")
+    self.assertEqual((server.served, server.missed), (1, 1))
+
+  def test_latency_and_loose_matching(self):
+    server, client = self.replay(latency=0.2, jitter=0.1, strict=False, seed=1)
+    start = time.perf_counter()
+    self.assertEqual(self.list_pvs(client, "XCOR:%"), self.names)
+    self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+  def test_encode_variant_arrays(self):
+    inner = Value(Type([("pvName", "s")]), {"pvName": "A"})
+    value = Value(Type([("value", "av"), ("count", "i")]), {"value": [inner, inner], "count": 2})
+    copy = decode(encode(value))
+    self.assertEqual(copy.type().aspy(), value.type().aspy())
+    self.assertEqual([item.pvName for item in copy.value], ["A", "A"])
+    self.assertEqual(copy.count, 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import threading
+import time
+from meme.singleflight import SingleFlight
+
+class SingleFlightTest(unittest.TestCase):
+  def setUp(self):
+    self.flights = SingleFlight()
+    self.release = threading.Event()
+    self.started = threading.Event()
+    self.count = 0
+
+  def slow_call(self, value, timeout=None):
+    self.count += 1
+    self.started.set()
+    self.release.wait(5.0)
+    if isinstance(value, Exception):
+      raise value
+    return value
+
+  def run_concurrently(self, key, value, n=5):
+    results = []
+    def worker():
+      try:
+        results.append(self.flights.do(key, self.slow_call, value))
+      except Exception as e:
+        results.append(e)
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    threads[0].start()
+    self.started.wait(5.0)
+    for t in threads[1:]:
+      t.start()
+    while self.flights.shared < n - 1:
+      time.sleep(0.001)
+    self.release.set()
+    for t in threads:
+      t.join()
+    return results
+
+  def test_concurrent_identical_calls_share_one_request(self):
+    results = self.run_concurrently("a", 42)
+    self.assertEqual(self.count, 1)
+    self.assertEqual(results, [42] * 5)
+    self.assertEqual(self.flights.in_flight(), 0)
+
+  def test_errors_are_shared(self):
+    error = ValueError("service is down")
+    results = self.run_concurrently("a", error, n=3)
+    self.assertEqual(self.count, 1)
+    self.assertTrue(all(r is error for r in results))
+
+  def test_sequential_calls_are_not_cached(self):
+    self.release.set()
+    self.flights.do("a", self.slow_call, 1)
+    self.flights.do("a", self.slow_call, 1)
+    self.assertEqual(self.count, 2)